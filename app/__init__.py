@@ -2,17 +2,30 @@
 from flask import Flask
 from .config import Config          # <— relativo
 from .models import db              # <— relativo
-from .routes import main            # <— relativo
 
 
 def create_app():
+    # rutas y storage se importan acá y no al cargar el paquete: si no,
+    # `python -m app.<módulo>` encontraría el módulo ya cargado (vía routes ->
+    # analytics) y lo ejecutaría dos veces. Así el resto importa a nivel de módulo.
+    from .routes import main
+    from .storage import opciones_engine, preparar, asegurar_esquema
+
     app = Flask(__name__, template_folder="templates", static_folder="static")
     app.config.from_object(Config)
+    app.config.setdefault(
+        "SQLALCHEMY_ENGINE_OPTIONS",
+        opciones_engine(app.config["SQLALCHEMY_DATABASE_URI"], app.config),
+    )
 
     db.init_app(app)
     with app.app_context():
-        db.create_all()
+        preparar(app)
+        asegurar_esquema()   # create_all/índices solo si cambió la versión del esquema
 
+    if app.config.get("MULTI_TENANT"):
+        from .tenants import instalar as instalar_tenants
+        instalar_tenants(app)
     app.register_blueprint(main)
     return app
 
@@ -1,14 +1,39 @@
 # app/analytics.py
-from datetime import datetime, timedelta
-from sqlalchemy import func
-from .models import db, Venta, Producto, Cliente
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, cast, extract, case, true, false, Integer
+from .config import Config
+from .models import db, Venta, Producto, VentaRollup, Metadato
+from .cache import CacheLRU, data_version
+from . import clv, columnar, particiones, pronosticos, segmentacion, sketches
+
+_cache_kpis = CacheLRU(maxsize=Config.KPI_CACHE_SIZE, ttl=Config.KPI_CACHE_TTL)
+_pool_paneles = ThreadPoolExecutor(max_workers=Config.DASHBOARD_WORKERS, thread_name_prefix="panel")
+
+
+def _reiniciar_pool_paneles():
+    """Los hilos no sobreviven a un fork (app/servidor.py): cada worker arma su pool."""
+    global _pool_paneles
+    _pool_paneles = ThreadPoolExecutor(max_workers=Config.DASHBOARD_WORKERS, thread_name_prefix="panel")
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reiniciar_pool_paneles)
 
 
 # ---------- Helpers de fechas / rangos ----------
-def _parse_date(s: str | None):
+def _parse_date(s: str | datetime | None):
     """Convierte 'YYYY-MM-DD' a datetime (00:00) o None."""
     if not s:
         return None
+    if isinstance(s, datetime):
+        return s
     try:
         return datetime.fromisoformat(s)
     except Exception:
@@ -20,20 +45,274 @@ def _end_of_day(dt: datetime | None):
     return dt + timedelta(days=1) if dt else None
 
 
-def _apply_range(query, desde_str: str | None, hasta_str: str | None):
+def _apply_range(query, desde_str: str | None, hasta_str: str | None, fuente=Venta):
     """
-    Aplica filtros por fecha (incluye el día 'hasta' completo).
+    Aplica filtros por fecha (incluye el día 'hasta' completo) sobre `fuente`
+    (Venta o la entidad de particiones.ventas() para ese rango).
     Devuelve: (query_filtrada, desde_dt, hasta_dt)
     """
     desde = _parse_date(desde_str)
     hasta = _parse_date(hasta_str)
     if desde:
-        query = query.filter(Venta.fecha >= desde)
+        query = query.filter(fuente.fecha >= desde)
     if hasta:
-        query = query.filter(Venta.fecha < _end_of_day(hasta))
+        query = query.filter(fuente.fecha < _end_of_day(hasta))
     return query, desde, hasta
 
 
+def _ventas(desde: datetime | None, hasta: datetime | None):
+    """Ventas del rango [desde, hasta] tocando solo las particiones que se solapan."""
+    return particiones.ventas(desde, _end_of_day(hasta))
+
+
+# ---------- Agregación genérica (GROUP BY en la BD) ----------
+NOMBRES_DIAS = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+# Dimensión -> expresión SQL; lo de fechas depende del dialecto.
+DIMENSIONES = ("hora", "dia_semana", "fecha", "mes", "producto", "cliente", "categoria")
+
+MEDIDAS = {
+    "total":    lambda v: func.coalesce(func.sum(v.total), 0.0),
+    "cantidad": lambda v: func.coalesce(func.sum(v.cantidad), 0),
+    "ventas":   lambda v: func.count(v.id),
+    "clientes": lambda v: func.count(func.distinct(v.cliente_id)),
+}
+
+# Lo que se puede responder desde ventas_rollup (día × hora × producto).
+DIMENSIONES_ROLLUP = {"hora", "dia_semana", "fecha", "mes", "producto", "categoria"}
+MEDIDAS_ROLLUP = {
+    "total":    lambda r: func.coalesce(func.sum(r.total), 0.0),
+    "cantidad": lambda r: func.coalesce(func.sum(r.cantidad), 0),
+    "ventas":   lambda r: func.coalesce(func.sum(r.n), 0),
+}
+
+
+def _dim_expr(dim: str, dialecto: str, fuente=Venta):
+    """
+    Expresión SQL de una dimensión sobre `fuente` (ventas o VentaRollup).
+    Día de la semana: 0 = lunes (como datetime.weekday).
+    """
+    if dim == "producto":
+        return fuente.producto_id
+    if dim == "cliente" and fuente is not VentaRollup:
+        return fuente.cliente_id
+    if dim == "categoria":
+        return Producto.categoria
+    if dim == "hora" and fuente is VentaRollup:
+        return VentaRollup.hora
+    fecha = fuente.fecha
+    if dialecto == "sqlite":
+        if dim == "hora":
+            return cast(func.strftime("%H", fecha), Integer)
+        if dim == "dia_semana":
+            # strftime('%w'): 0 = domingo
+            return (cast(func.strftime("%w", fecha), Integer) + 6) % 7
+        if dim == "fecha":
+            return func.strftime("%Y-%m-%d", fecha)
+        if dim == "mes":
+            return func.strftime("%Y-%m", fecha)
+    else:
+        if dim == "hora":
+            return cast(extract("hour", fecha), Integer)
+        if dim == "dia_semana":
+            # isodow: 1 = lunes
+            return cast(extract("isodow", fecha), Integer) - 1
+        if dim == "fecha":
+            return func.to_char(fecha, "YYYY-MM-DD")
+        if dim == "mes":
+            return func.to_char(fecha, "YYYY-MM")
+    raise ValueError(f"Dimensión desconocida: {dim!r} (válidas: {', '.join(DIMENSIONES)})")
+
+
+def _alineado(dt: datetime | None):
+    return dt is None or dt == datetime.combine(dt.date(), datetime.min.time())
+
+
+def rollups_listos():
+    """True si ventas_rollup está al día con ventas (lo marca el ETL)."""
+    meta = db.session.get(Metadato, "rollups")
+    return bool(meta and meta.valor == "ok")
+
+
+def _usar_rollup(dimensiones, medidas, desde, hasta):
+    return (
+        set(dimensiones) <= DIMENSIONES_ROLLUP
+        and set(medidas) <= set(MEDIDAS_ROLLUP)
+        and _alineado(desde) and _alineado(hasta)
+        and rollups_listos()
+    )
+
+
+def agrupar(dimensiones, medidas=("total",), desde=None, hasta=None,
+            orden: str | None = None, limite: int | None = None):
+    """
+    Un solo GROUP BY en la BD por las `dimensiones` pedidas.
+    Si el rango cae en límites de día se responde desde ventas_rollup;
+    si no, desde las ventas crudas.
+    `orden` es una dimensión o medida ("-total" = descendente).
+    Devuelve columnas compactas: {"dim1": [...], ..., "medida1": [...], ...},
+    una lista por dimensión/medida, alineadas por posición.
+    """
+    desconocidas = [m for m in medidas if m not in MEDIDAS]
+    if desconocidas:
+        raise ValueError(f"Medida desconocida: {desconocidas[0]!r} (válidas: {', '.join(MEDIDAS)})")
+
+    d, h = _parse_date(desde), _parse_date(hasta)
+    tienda = _columnar(dimensiones, medidas)
+    if tienda is not None:
+        return _agrupar_columnar(tienda, dimensiones, medidas, d, h, orden, limite)
+
+    dialecto = db.engine.dialect.name
+    if _usar_rollup(dimensiones, medidas, d, h):
+        fuente, tabla_medidas = VentaRollup, MEDIDAS_ROLLUP
+    else:
+        fuente, tabla_medidas = _ventas(d, h), MEDIDAS
+
+    dims = [_dim_expr(dim, dialecto, fuente).label(dim) for dim in dimensiones]
+    meds = [tabla_medidas[m](fuente).label(m) for m in medidas]
+    q = db.session.query(*dims, *meds).select_from(fuente)
+    if "categoria" in dimensiones:
+        q = q.join(Producto, fuente.producto_id == Producto.id)
+
+    if fuente is VentaRollup:
+        if d:
+            q = q.filter(VentaRollup.fecha >= d.date())
+        if h:
+            q = q.filter(VentaRollup.fecha < _end_of_day(h).date())
+    else:
+        q, _, _ = _apply_range(q, d, h, fuente)
+
+    if dims:
+        q = q.group_by(*dims)
+    if orden:
+        col = {c.name: c for c in (*dims, *meds)}[orden.lstrip("-")]
+        q = q.order_by(col.desc() if orden.startswith("-") else col.asc())
+    elif dims:
+        q = q.order_by(*dims)
+    if limite:
+        q = q.limit(limite)
+
+    columnas = {k: [] for k in (*dimensiones, *medidas)}
+    claves = list(columnas)
+    for fila in q.all():
+        for k, v in zip(claves, fila):
+            columnas[k].append(v)
+    return columnas
+
+
+def _columnar(dimensiones=(), medidas=()):
+    """Almacén columnar activo si puede responder estas dimensiones/medidas."""
+
+    if not (set(dimensiones) <= set(columnar.DIMENSIONES) and set(medidas) <= set(columnar.MEDIDAS)):
+        return None
+    return columnar.activo()
+
+
+def _agrupar_columnar(tienda, dimensiones, medidas, d, h, orden, limite):
+    """agrupar() desde el almacén columnar (mismo formato de salida)."""
+    res = tienda.agrupar(dimensiones, medidas, d, _end_of_day(h))
+    claves = [*dimensiones, *medidas]
+    if orden:
+        valores = res[orden.lstrip("-")]
+        idx = np.argsort(-valores if orden.startswith("-") else valores, kind="stable")
+        res = {k: res[k][idx] for k in claves}
+    if limite:
+        res = {k: res[k][:limite] for k in claves}
+    return {k: np.asarray(res[k]).tolist() for k in claves}
+
+
+def _kpis_una_pasada(desde: datetime | None, hasta: datetime | None, prev_desde: datetime | None):
+    """
+    KPIs del periodo [desde, hasta] y total del periodo anterior [prev_desde, desde)
+    con agregación condicional: una sola consulta sobre [prev_desde, hasta].
+    Las sumas salen del rollup si el rango está alineado a días; los clientes
+    distintos necesitan las ventas crudas (consulta aparte en ese caso).
+    Devuelve (total, cantidad, nº ventas, clientes únicos, total anterior).
+    """
+    tienda = _columnar()
+    if tienda is not None:
+        return tienda.kpis(desde, _end_of_day(hasta), prev_desde)
+
+    usar_rollup = _usar_rollup([], ["total"], desde, hasta) and _alineado(prev_desde)
+    fuente = VentaRollup if usar_rollup else _ventas(prev_desde or desde, hasta)
+    limite = (lambda dt: dt.date()) if usar_rollup else (lambda dt: dt)
+
+    actual = fuente.fecha >= limite(desde) if desde else true()
+    anterior = ~actual if prev_desde else false()
+    n = VentaRollup.n if usar_rollup else 1
+    cols = [
+        func.sum(case((actual, fuente.total), else_=0.0)),
+        func.sum(case((actual, fuente.cantidad), else_=0)),
+        func.sum(case((actual, n), else_=0)),
+        func.sum(case((anterior, fuente.total), else_=0.0)),
+    ]
+    if not usar_rollup:
+        cols.append(func.count(func.distinct(case((actual, fuente.cliente_id)))))
+
+    q = db.session.query(*cols)
+    inicio = prev_desde or desde
+    if inicio:
+        q = q.filter(fuente.fecha >= limite(inicio))
+    if hasta:
+        q = q.filter(fuente.fecha < limite(_end_of_day(hasta)))
+    fila = q.one()
+
+    if usar_rollup:
+        v = _ventas(desde, hasta)
+        cq = db.session.query(func.count(func.distinct(v.cliente_id)))
+        cq, _, _ = _apply_range(cq, desde, hasta, v)
+        clientes = cq.scalar()
+    else:
+        clientes = fila[4]
+    return (float(fila[0] or 0.0), int(fila[1] or 0), int(fila[2] or 0),
+            int(clientes or 0), float(fila[3] or 0.0))
+
+
+# ---------- Series de tiempo ----------
+GRANULARIDADES = ("dia", "semana", "mes")
+METRICAS_SERIE = ("total", "cantidad", "ventas")
+
+
+def _inicio_periodo(dias: np.ndarray, granularidad: str) -> np.ndarray:
+    """datetime64[D] -> primer día de su periodo (semanas de lunes a domingo)."""
+    if granularidad == "semana":
+        return dias - (dias.astype(np.int64) + 3) % 7      # 1970-01-01 fue jueves
+    if granularidad == "mes":
+        return dias.astype("datetime64[M]").astype("datetime64[D]")
+    return dias
+
+
+def _retroceder(inicio: np.datetime64, periodos: int, granularidad: str) -> np.datetime64:
+    if granularidad == "semana":
+        return inicio - 7 * periodos
+    if granularidad == "mes":
+        return (inicio.astype("datetime64[M]") - periodos).astype("datetime64[D]")
+    return inicio - periodos
+
+
+def _diario(desde: np.datetime64, hasta: np.datetime64, metrica: str) -> np.ndarray:
+    """
+    Valores por día en [desde, hasta], densos (días sin ventas = 0), con un
+    solo GROUP BY fecha (del rollup, que es exacto; los sketches son de approx=1).
+    """
+    valores = np.zeros(int((hasta - desde).astype(np.int64)) + 1)
+    cols = agrupar(["fecha"], [metrica], datetime.combine(desde.astype(date), datetime.min.time()),
+                   datetime.combine(hasta.astype(date), datetime.min.time()))
+    fechas, vals = cols["fecha"], cols[metrica]
+    if len(fechas):
+        idx = (np.array(fechas, dtype="datetime64[D]") - desde).astype(np.int64)
+        valores[idx] = np.array(vals, dtype=float)
+    return valores
+
+
+def _sketches(*limites):
+    """Módulo de sketches si approx=1 puede responder: límites de día y sketches al día."""
+
+    if all(_alineado(x) for x in limites) and sketches.listos():
+        return sketches
+    return None
+
+
 class AnalyticsEngine:
     """Motor de análisis de datos para Insight PYME"""
 
@@ -41,113 +320,98 @@ class AnalyticsEngine:
     # KPIs (con rango opcional: desde/hasta en formato YYYY-MM-DD)
     # ============================================================
     @staticmethod
-    def get_kpis(desde: str | None = None, hasta: str | None = None):
+    def get_kpis(desde: str | None = None, hasta: str | None = None, approx: bool = False):
+        """
+        approx=True: clientes únicos desde los HLL diarios (app/sketches.py) y
+        "aprox" con su intervalo; None si no se pudo y la respuesta es exacta.
+        """
         # Si no hay rango -> comportamiento original (mes actual vs mes anterior)
         if not desde and not hasta:
             hoy = datetime.now()
-            inicio_mes = hoy.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            mes_anterior = (inicio_mes - timedelta(days=1)).replace(
-                day=1, hour=0, minute=0, second=0, microsecond=0
-            )
-
-            ventas_mes = db.session.query(func.sum(Venta.total)) \
-                .filter(Venta.fecha >= inicio_mes).scalar() or 0.0
-
-            ventas_mes_anterior = db.session.query(func.sum(Venta.total)) \
-                .filter(Venta.fecha >= mes_anterior, Venta.fecha < inicio_mes).scalar() or 0.0
-
-            crecimiento = ((ventas_mes - ventas_mes_anterior) / ventas_mes_anterior * 100.0) \
-                if ventas_mes_anterior > 0 else 0.0
-
-            ticket_promedio = db.session.query(func.avg(Venta.total)) \
-                .filter(Venta.fecha >= inicio_mes).scalar() or 0.0
-
-            productos_vendidos = db.session.query(func.sum(Venta.cantidad)) \
-                .filter(Venta.fecha >= inicio_mes).scalar() or 0
-
-            clientes_unicos = db.session.query(func.count(func.distinct(Venta.cliente_id))) \
-                .filter(Venta.fecha >= inicio_mes, Venta.cliente_id.isnot(None)).scalar() or 0
-
-            return {
-                "ventas_mes": float(round(ventas_mes, 2)),
-                "crecimiento": float(round(crecimiento, 2)),
-                "ticket_promedio": float(round(ticket_promedio, 2)),
-                "productos_vendidos": int(productos_vendidos),
-                "clientes_unicos": int(clientes_unicos),
-            }
-
-        # Con rango: todo se calcula **dentro del rango**
-        # y el crecimiento se compara contra un periodo anterior de igual tamaño.
-        ventas_q = db.session.query(func.sum(Venta.total))
-        ventas_q, d, h = _apply_range(ventas_q, desde, hasta)
-        ventas_total = ventas_q.scalar() or 0.0
-
-        ticket_q = db.session.query(func.avg(Venta.total))
-        ticket_q, _, _ = _apply_range(ticket_q, desde, hasta)
-        ticket_promedio = ticket_q.scalar() or 0.0
-
-        prod_q = db.session.query(func.sum(Venta.cantidad))
-        prod_q, _, _ = _apply_range(prod_q, desde, hasta)
-        productos_vendidos = int(prod_q.scalar() or 0)
-
-        cli_q = db.session.query(func.count(func.distinct(Venta.cliente_id)))
-        cli_q, _, _ = _apply_range(cli_q, desde, hasta)
-        clientes_unicos = int(cli_q.scalar() or 0)
-
-        # Crecimiento si tenemos ambos extremos del rango
-        if d and h:
-            dias = (h.date() - d.date()).days + 1
-            prev_desde = d - timedelta(days=dias)
-            prev_hasta = d - timedelta(days=1)
-            prev_q = db.session.query(func.sum(Venta.total)) \
-                .filter(Venta.fecha >= prev_desde) \
-                .filter(Venta.fecha < _end_of_day(prev_hasta))
-            ventas_prev = prev_q.scalar() or 0.0
+            d = hoy.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            h = None
+            prev_desde = (d - timedelta(days=1)).replace(day=1)
         else:
-            ventas_prev = 0.0
-
+            # Con rango: todo se calcula **dentro del rango**
+            # y el crecimiento se compara contra un periodo anterior de igual tamaño.
+            d, h = _parse_date(desde), _parse_date(hasta)
+            prev_desde = None
+            if d and h:
+                dias = (h.date() - d.date()).days + 1
+                prev_desde = d - timedelta(days=dias)
+
+        # El rango ya resuelto entra en la clave (el "mes actual" cambia con la fecha)
+        clave = (str(db.engine.url), d, h, prev_desde, approx, data_version())
+        hit, kpis = _cache_kpis.get(clave)
+        if hit:
+            return dict(kpis)
+
+        sk = _sketches(d, h, prev_desde) if approx else None
+        if sk is not None:
+            valores, error = sk.kpis(d, _end_of_day(h), prev_desde)
+        else:
+            valores, error = _kpis_una_pasada(d, h, prev_desde), None
+        ventas_total, productos_vendidos, n_ventas, clientes_unicos, ventas_prev = valores
+        ticket_promedio = ventas_total / n_ventas if n_ventas else 0.0
         crecimiento = ((ventas_total - ventas_prev) / ventas_prev * 100.0) if ventas_prev > 0 else 0.0
 
-        return {
+        kpis = {
             "ventas_mes": float(round(ventas_total, 2)),     # nombre legado usado por el front
             "crecimiento": float(round(crecimiento, 2)),
             "ticket_promedio": float(round(ticket_promedio, 2)),
             "productos_vendidos": int(productos_vendidos),
             "clientes_unicos": int(clientes_unicos),
         }
+        if approx:
+            kpis["aprox"] = error
+        _cache_kpis.set(clave, kpis)
+        return dict(kpis)
 
     # =========================================
     # Top productos (acepta rango opcional)
     # =========================================
     @staticmethod
-    def get_top_productos(limite: int = 10, desde: str | None = None, hasta: str | None = None):
-        q = db.session.query(
-            Producto.nombre,
-            func.sum(Venta.cantidad).label("cant"),
-            func.sum(Venta.total).label("ing"),
-        ).join(Venta, Venta.producto_id == Producto.id)
-
-        q, _, _ = _apply_range(q, desde, hasta)
-
-        filas = q.group_by(Producto.id) \
-                 .order_by(func.sum(Venta.total).desc()) \
-                 .limit(limite).all()
-
-        return [
-            {"producto": f[0], "cantidad": int(f[1] or 0), "ingreso": float(round(f[2] or 0.0, 2))}
-            for f in filas
-        ]
+    def get_top_productos(limite: int = 10, desde: str | None = None, hasta: str | None = None,
+                          approx: bool = False):
+        """
+        approx=True: fusiona los top-K diarios (app/sketches.py) y devuelve
+        {"productos": [...], "aprox": {...}}; cada producto trae "ingreso_max"
+        (cota superior). "aprox" es None si la respuesta salió exacta.
+        """
+        d, h = _parse_date(desde), _parse_date(hasta)
+        sk = _sketches(d, h) if approx else None
+        if sk is not None:
+            ids, cantidades, ingresos, maximos, error_fuera = sk.top_productos(limite, d, _end_of_day(h))
+        else:
+            cols = agrupar(["producto"], ["cantidad", "total"], d, h, orden="-total", limite=limite)
+            ids, cantidades, ingresos = cols["producto"], cols["cantidad"], cols["total"]
+            maximos = None
+        nombres = dict(
+            db.session.query(Producto.id, Producto.nombre).filter(Producto.id.in_(ids)).all()
+        ) if ids else {}
+        productos = []
+        for i, pid in enumerate(ids):
+            if pid not in nombres:
+                continue
+            fila = {"producto": nombres[pid], "cantidad": int(cantidades[i] or 0),
+                    "ingreso": float(round(ingresos[i] or 0.0, 2))}
+            if maximos is not None:
+                fila["ingreso_max"] = float(round(maximos[i], 2))
+            productos.append(fila)
+        if not approx:
+            return productos
+        aprox = None if maximos is None else {"ingreso_max_no_listados": float(round(error_fuera, 2))}
+        return {"productos": productos, "aprox": aprox}
 
     # =========================================
     # Ventas por hora (acepta rango opcional)
     # =========================================
     @staticmethod
     def get_ventas_por_hora(desde: str | None = None, hasta: str | None = None):
-        totales = {h: 0.0 for h in range(24)}
-        q = db.session.query(Venta)
-        q, _, _ = _apply_range(q, desde, hasta)
-        for v in q.all():
-            totales[v.fecha.hour] += float(v.total or 0.0)
+        totales = [0.0] * 24
+        cols = agrupar(["hora"], ["total"], desde, hasta)
+        for h, t in zip(cols["hora"], cols["total"]):
+            totales[h] = float(t or 0.0)
         return [{"hora": f"{h:02d}:00", "ventas": float(round(totales[h], 2))} for h in range(24)]
 
     # ==================================================
@@ -155,125 +419,162 @@ class AnalyticsEngine:
     # ==================================================
     @staticmethod
     def get_ventas_por_dia_semana(desde: str | None = None, hasta: str | None = None):
-        nombres = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
-        totales = {i: 0.0 for i in range(7)}
-        q = db.session.query(Venta)
-        q, _, _ = _apply_range(q, desde, hasta)
-        for v in q.all():
-            totales[v.fecha.weekday()] += float(v.total or 0.0)
-        return [{"dia": nombres[i], "ventas": float(round(totales[i], 2))} for i in range(7)]
+        totales = [0.0] * 7
+        cols = agrupar(["dia_semana"], ["total"], desde, hasta)
+        for d, t in zip(cols["dia_semana"], cols["total"]):
+            totales[d] = float(t or 0.0)
+        return [{"dia": NOMBRES_DIAS[i], "ventas": float(round(totales[i], 2))} for i in range(7)]
+
+    # ==================================================
+    # Mapa de calor día de la semana × hora
+    # ==================================================
+    @staticmethod
+    def get_heatmap_hora_dia(desde: str | None = None, hasta: str | None = None):
+        valores = [[0.0] * 24 for _ in range(7)]
+        cols = agrupar(["dia_semana", "hora"], ["total"], desde, hasta)
+        for d, h, t in zip(cols["dia_semana"], cols["hora"], cols["total"]):
+            valores[d][h] = float(round(t or 0.0, 2))
+        return {
+            "dias": NOMBRES_DIAS,
+            "horas": [f"{h:02d}:00" for h in range(24)],
+            "valores": valores,   # valores[dia][hora]
+        }
+
+    # ==================================================
+    # Serie de tiempo con media móvil y variación entre periodos
+    # ==================================================
+    @staticmethod
+    def get_serie(granularidad: str = "dia", metrica: str = "total", ventana: int = 7,
+                  desde: str | None = None, hasta: str | None = None):
+        """
+        Serie densa por día/semana/mes (periodos sin ventas = 0) con media móvil
+        de `ventana` periodos y variación contra el periodo anterior. Se lee una
+        sola vez el rango más los periodos previos que piden la ventana y la
+        primera variación; el resto son sumas acumuladas de numpy.
+        El primer periodo se toma completo; el último llega hasta `hasta`.
+        """
+        if granularidad not in GRANULARIDADES:
+            raise ValueError(f"Granularidad desconocida: {granularidad!r} (válidas: {', '.join(GRANULARIDADES)})")
+        if metrica not in METRICAS_SERIE:
+            raise ValueError(f"Métrica desconocida: {metrica!r} (válidas: {', '.join(METRICAS_SERIE)})")
+        ventana = max(int(ventana), 1)
+
+        d, h = _parse_date(desde), _parse_date(hasta)
+        if d is None or h is None:
+            minimo, maximo = particiones.rango_fechas()
+            d, h = d or minimo, h or maximo
+        res = {"granularidad": granularidad, "metric": metrica, "ventana": ventana,
+               "periodos": [], "valores": [], "media_movil": [], "delta": [], "delta_pct": []}
+        if d is None or h is None or d.date() > h.date():
+            return res
+
+        inicio = _inicio_periodo(np.datetime64(d.date(), "D"), granularidad)
+        fin = np.datetime64(h.date(), "D")
+        lectura = _retroceder(inicio, max(ventana - 1, 1), granularidad)
+        diario = _diario(lectura, fin, metrica)
+
+        periodo = _inicio_periodo(lectura + np.arange(len(diario)), granularidad)
+        periodos, inv = np.unique(periodo, return_inverse=True)
+        valores = np.bincount(inv, weights=diario, minlength=len(periodos))
+
+        acumulado = np.concatenate([[0.0], np.cumsum(valores)])
+        media = np.full(len(valores), np.nan)
+        media[ventana - 1:] = (acumulado[ventana:] - acumulado[:-ventana]) / ventana
+        anterior = np.concatenate([[np.nan], valores[:-1]])
+        delta = valores - anterior
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta_pct = np.where(anterior > 0, delta / anterior * 100.0, np.nan)
+
+        desde_idx = int(np.searchsorted(periodos, inicio))
+
+        def lista(arr):
+            return [None if np.isnan(x) else round(float(x), 2) for x in arr[desde_idx:]]
+
+        res.update({
+            "desde": str(inicio),
+            "hasta": str(fin),
+            "periodos": [str(p) for p in periodos[desde_idx:]],
+            "valores": lista(valores),
+            "media_movil": lista(media),
+            "delta": lista(delta),
+            "delta_pct": lista(delta_pct),
+        })
+        return res
+
+    # ==================================================
+    # Dashboard completo (paneles en paralelo)
+    # ==================================================
+    @staticmethod
+    def get_dashboard(desde: str | None = None, hasta: str | None = None, limite: int = 10,
+                      approx: bool = False):
+        """
+        Todos los paneles del tablero en una sola respuesta. Cada panel corre en
+        un hilo del pool con su propio app context, es decir, su propia sesión y
+        conexión a la BD. Incluye el tiempo de cada panel en "tiempos_ms".
+        """
+        paneles = {
+            "kpis": (AnalyticsEngine.get_kpis, {"approx": approx}),
+            "top_productos": (AnalyticsEngine.get_top_productos, {"limite": limite, "approx": approx}),
+            "ventas_por_hora": (AnalyticsEngine.get_ventas_por_hora, {}),
+            "ventas_por_dia": (AnalyticsEngine.get_ventas_por_dia_semana, {}),
+        }
+        app = current_app._get_current_object()
+
+        def correr(fn, kwargs):
+            t0 = time.perf_counter()
+            with app.app_context():
+                res = fn(desde=desde, hasta=hasta, **kwargs)
+            return res, (time.perf_counter() - t0) * 1000.0
+
+        # copy_context: cada hilo hereda la empresa activa (app/tenants.py)
+        futuros = {
+            k: _pool_paneles.submit(contextvars.copy_context().run, correr, fn, kw)
+            for k, (fn, kw) in paneles.items()
+        }
+        res = {"tiempos_ms": {}}
+        for k, fut in futuros.items():
+            res[k], ms = fut.result()
+            res["tiempos_ms"][k] = round(ms, 2)
+        return res
 
     # =========================================
-    # Segmentación (RFM simple) – sin cambios
+    # Segmentación (RFM simple) – persistida e incremental
     # =========================================
     @staticmethod
-    def segmentar_clientes():
-        datos = (
-            db.session.query(
-                Cliente.id,
-                Cliente.nombre,
-                func.max(Venta.fecha).label("ultima"),
-                func.count(Venta.id).label("freq"),
-                func.sum(Venta.total).label("mont"),
-            )
-            .join(Venta, Venta.cliente_id == Cliente.id)
-            .group_by(Cliente.id)
-            .all()
-        )
-        if not datos:
-            return []
-
-        # Stats para percentiles
-        freqs = [d[3] or 0 for d in datos]
-        montos = [float(d[4] or 0.0) for d in datos]
-        p50_freq = sorted(freqs)[len(freqs) // 2]
-        p75_monto = sorted(montos)[int(len(montos) * 0.75)]
-
-        res = []
-        for d in datos:
-            recencia = (datetime.now() - d[2]).days if d[2] else 9999
-            freq = int(d[3] or 0)
-            monto = float(d[4] or 0.0)
-
-            if monto > p75_monto and freq > p50_freq:
-                segmento = "VIP"
-            elif recencia > 90:
-                segmento = "En Riesgo"
-            elif freq > p50_freq:
-                segmento = "Regular"
-            else:
-                segmento = "Ocasional"
-
-            # guardar en DB (opcional)
-            cli = Cliente.query.get(d[0])
-            if cli:
-                cli.segmento = segmento
-
-            res.append({
-                "cliente_id": d[0],
-                "nombre": d[1],
-                "recencia": recencia,
-                "frecuencia": freq,
-                "monto": float(round(monto, 2)),
-                "segmento": segmento,
-            })
-
-        db.session.commit()
-        return res
+    def segmentar_clientes(completo: bool = False):
+        """Recalcula y guarda segmentos (ver app/segmentacion.py); devuelve el detalle."""
+        segmentacion.segmentar(completo=completo)
+        return segmentacion.listar(limite=None)
 
     # =========================================
-    # CLV estimado – sin cambios
+    # CLV estimado
     # =========================================
     @staticmethod
     def calcular_clv(cliente_id):
-        compras = Venta.query.filter_by(cliente_id=cliente_id).order_by(Venta.fecha).all()
-        if not compras:
+        """CLV de un cliente con una consulta agregada (para toda la cartera: app/clv.py)."""
+
+        v = particiones.ventas()
+        n, total, primera, ultima = db.session.query(
+            func.count(v.id), func.coalesce(func.sum(v.total), 0.0),
+            func.min(v.fecha), func.max(v.fecha),
+        ).filter(v.cliente_id == cliente_id).one()
+        if not n:
             return 0.0
-
-        total = sum(float(c.total or 0.0) for c in compras)
-        n = len(compras)
-        valor_promedio = total / n
-
-        if n > 1:
-            dias = (compras[-1].fecha - compras[0].fecha).days or 1
-            freq_dias = dias / (n - 1)
-        else:
-            freq_dias = 30.0
-
-        compras_por_anio = 365.0 / freq_dias
-        clv = valor_promedio * compras_por_anio * 2  # horizonte 2 años
-        return float(round(clv, 2))
+        return float(clv.clv_vectorizado([n], [total], [primera], [ultima])[0])
 
     # =========================================
-    # Predicción de demanda – igual que tenías
+    # Predicción de demanda – lectura del pronóstico precalculado
     # =========================================
     @staticmethod
     def predecir_demanda(producto_id, dias_futuro=30):
-        ventas = (
-            db.session.query(Venta)
-            .filter(Venta.producto_id == producto_id)
-            .order_by(Venta.fecha.asc())
-            .all()
-        )
-        # UMBRAL BAJO PARA DEMO
-        if len(ventas) < 1:
-            print("DEBUG analytics: sin ventas para producto", producto_id)  # <— LOG
-            return {"error": "Datos insuficientes"}
+        """Busca el pronóstico guardado por app/pronosticos.py (no recorre el histórico)."""
 
-        # agregamos por día
-        por_dia = {}
-        for v in ventas:
-            clave = v.fecha.date()
-            por_dia[clave] = por_dia.get(clave, 0) + int(v.cantidad or 0)
-
-        if not por_dia:
+        demanda = pronosticos.consultar(producto_id, dias_futuro)
+        if demanda is None:
             return {"error": "Datos insuficientes"}
 
-        promedio_diario = sum(por_dia.values()) / len(por_dia)
-        demanda = promedio_diario * dias_futuro
-
         return {
             "demanda_estimada": int(round(demanda)),
-            "promedio_diario": float(round(promedio_diario, 2)),
+            "promedio_diario": float(round(demanda / dias_futuro, 2)),
             "horizonte_dias": dias_futuro,
         }
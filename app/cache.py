@@ -0,0 +1,81 @@
+# app/cache.py
+"""
+Versión de datos y caché LRU en proceso.
+
+`data_version()` identifica el estado de los datos: cualquier camino que
+escribe (ETL, rollups, ...) llama a `bump_data_version()` dentro de su
+transacción, así las entradas de caché con la versión vieja dejan de usarse.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import select
+
+from .models import db, Metadato
+
+# url de la BD -> (versión, momento de lectura); evita ir a la BD en cada request
+_versiones = {}
+
+
+def data_version(fresca: bool = False) -> str:
+    """
+    Versión actual de los datos. Los cambios hechos en este proceso se ven
+    al instante; los de otros procesos (el ETL) en menos de DATA_VERSION_TTL s,
+    o ya mismo con fresca=True (relee la BD y actualiza el memo).
+    """
+    clave = str(db.engine.url)
+    ahora = time.monotonic()
+    memo = _versiones.get(clave)
+    if not fresca and memo and ahora - memo[1] < current_app.config.get("DATA_VERSION_TTL", 1.0):
+        return memo[0]
+    valor = db.session.execute(
+        select(Metadato.valor).where(Metadato.clave == "data_version")
+    ).scalar() or "0"
+    _versiones[clave] = (valor, ahora)
+    return valor
+
+
+def bump_data_version() -> str:
+    """Nueva versión de datos (sin commit: va en la transacción de quien escribe)."""
+    valor = str(time.time_ns())
+    meta = db.session.get(Metadato, "data_version") or Metadato(clave="data_version")
+    meta.valor = valor
+    db.session.add(meta)
+    _versiones[str(db.engine.url)] = (valor, time.monotonic())
+    return valor
+
+
+class CacheLRU:
+    """LRU acotada por número de entradas y por antigüedad (ttl en segundos)."""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._datos = OrderedDict()   # clave -> (valor, expira)
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        """Devuelve (encontrado, valor)."""
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return False, None
+            valor, expira = item
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return False, None
+            self._datos.move_to_end(clave)
+            return True, valor
+
+    def set(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (valor, time.monotonic() + self.ttl)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maxsize:
+                self._datos.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
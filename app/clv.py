@@ -0,0 +1,107 @@
+# app/clv.py
+"""
+CLV de toda la cartera en lote, guardado en clv_clientes.
+
+Un solo GROUP BY cliente (nº de compras, suma, primera y última compra) y
+la fórmula de siempre aplicada con numpy:
+
+    clv = (total / n) * (365 / frecuencia_dias) * 2     # horizonte 2 años
+    frecuencia_dias = max(días entre primera y última, 1) / (n - 1), o 30 si n == 1
+
+El ETL lo refresca al terminar de cargar ventas; también a mano:
+
+    python -m app.clv
+"""
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, select, delete, insert
+
+from .models import db, Cliente, ClvCliente
+from .cache import bump_data_version
+from . import particiones
+
+HORIZONTE_ANIOS = 2
+FRECUENCIA_UNA_COMPRA = 30.0
+
+
+def clv_vectorizado(compras, total, primera, ultima):
+    """Arrays por cliente -> array de CLV (redondeado a 2 decimales)."""
+    compras = np.asarray(compras, dtype=np.int64)
+    total = np.asarray(total, dtype=float)
+    dias = (np.asarray(ultima, dtype="datetime64[s]") - np.asarray(primera, dtype="datetime64[s]")) \
+        .astype(np.int64) // 86400
+    dias = np.where(dias > 0, dias, 1)
+    frecuencia = np.where(compras > 1, dias / np.maximum(compras - 1, 1), FRECUENCIA_UNA_COMPRA)
+    clv = (total / compras) * (365.0 / frecuencia) * HORIZONTE_ANIOS
+    return np.round(clv, 2)
+
+
+def _agregados():
+    v = particiones.ventas()
+    return db.session.execute(
+        select(
+            v.cliente_id,
+            func.count(v.id),
+            func.coalesce(func.sum(v.total), 0.0),
+            func.min(v.fecha),
+            func.max(v.fecha),
+        ).where(v.cliente_id.isnot(None)).group_by(v.cliente_id)
+    ).all()
+
+
+def recalcular(avance=lambda fraccion, mensaje: None) -> int:
+    """
+    Reemplaza clv_clientes en una sola transacción. Devuelve nº de clientes.
+    `avance(fraccion, mensaje)` informa el progreso antes de escribir.
+    """
+    avance(0.05, "agregando ventas por cliente")
+    filas = _agregados()
+    avance(0.8, f"calculando CLV de {len(filas)} clientes")
+    if filas:
+        ids, compras, total, primera, ultima = zip(*filas)
+        clv = clv_vectorizado(compras, total, primera, ultima)
+    avance(0.9, "guardando")
+    db.session.execute(delete(ClvCliente))
+    if filas:
+        ahora = datetime.now()
+        db.session.execute(insert(ClvCliente), [
+            {"cliente_id": ids[i], "compras": int(compras[i]), "total": float(total[i]),
+             "primera_compra": primera[i], "ultima_compra": ultima[i],
+             "clv": float(clv[i]), "actualizado": ahora}
+            for i in range(len(ids))
+        ])
+    bump_data_version()
+    db.session.commit()
+    return len(filas)
+
+
+def listar(limite: int = 100, offset: int = 0):
+    """Página de clientes ordenados por CLV descendente (lee la tabla, no recalcula)."""
+    q = db.session.query(
+        ClvCliente.cliente_id, Cliente.nombre, ClvCliente.clv, ClvCliente.compras,
+        ClvCliente.total, ClvCliente.ultima_compra,
+    ).join(Cliente, Cliente.id == ClvCliente.cliente_id) \
+        .order_by(ClvCliente.clv.desc(), ClvCliente.cliente_id) \
+        .offset(offset).limit(limite)
+    return [{
+        "cliente_id": cid,
+        "nombre": nombre,
+        "clv": float(clv or 0.0),
+        "compras": int(compras or 0),
+        "total": float(round(total or 0.0, 2)),
+        "ultima_compra": ultima.isoformat() if ultima else None,
+    } for cid, nombre, clv, compras, total, ultima in q.all()]
+
+
+def main():
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        n = recalcular()
+        print(f"CLV recalculado para {n} clientes.")
+
+
+if __name__ == "__main__":
+    main()
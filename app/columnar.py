@@ -0,0 +1,328 @@
+# app/columnar.py
+"""
+Copia columnar de `ventas` en archivos .npy para responder analytics sin SQL.
+
+Columnas (ordenadas por fecha, id):
+    fecha        int64   segundos epoch de la fecha "ingenua" (sin zona)
+    id           int64
+    producto_id  int32   (-1 = nulo)
+    cliente_id   int32   (-1 = nulo)
+    cantidad     int32
+    total        float64
+
+Un rango de fechas es un corte por búsqueda binaria (searchsorted) y los
+GROUP BY son bincount. Los archivos se abren con mmap_mode="r", así que los
+workers de un mismo servidor comparten las páginas.
+
+Se activa con ANALYTICS_COLUMNAR=1. El ETL lo refresca al terminar: si solo
+hubo altas, agrega las ventas nuevas (id > último id guardado); si hubo
+actualizaciones o bajas, lo reconstruye. AnalyticsEngine solo lo usa si
+coincide con la BD (nº de ventas, último id y suma de total); si no, vuelve
+a SQL. La ingesta en vivo no reescribe los .npy: lo marca como
+desactualizado (`marcar_obsoleto`) y queda fuera, sin recorrer la tabla,
+hasta el próximo refresco.
+
+    python -m app.columnar [--completo]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import delete, func, select
+
+from .models import db, Metadato
+from .cache import CacheLRU, data_version
+from . import particiones, tenants
+
+COLUMNAS = {
+    "fecha": np.int64,
+    "id": np.int64,
+    "producto_id": np.int32,
+    "cliente_id": np.int32,
+    "cantidad": np.int32,
+    "total": np.float64,
+}
+LOTE_LECTURA = 50_000
+META = "meta.json"
+OBSOLETO = "columnar_obsoleto"     # Metadato: hubo escrituras después del último refresco
+
+# Dimensiones que se pueden agrupar: nombre -> cardinalidad fija (None = según datos)
+DIMENSIONES = {"hora": 24, "dia_semana": 7, "producto": None, "cliente": None}
+MEDIDAS = ("total", "cantidad", "ventas")
+
+_lock = threading.Lock()
+_abiertos = CacheLRU(maxsize=64, ttl=3600)   # directorio -> (mtime de meta, VentasColumnar)
+_vigencia = {}     # url -> ((data_version, max_id, n), coincide con la BD)
+
+
+def epoch(dt) -> int:
+    """datetime ingenuo -> segundos epoch (misma convención que la columna fecha)."""
+    return int(np.datetime64(dt, "s").astype(np.int64))
+
+
+class VentasColumnar:
+    """Columnas en memoria (mmap) y agregaciones vectorizadas sobre ellas."""
+
+    def __init__(self, directorio: str, meta: dict):
+        self.meta = meta
+        self.col = {
+            nombre: np.load(os.path.join(directorio, f"{nombre}.npy"), mmap_mode="r")
+            for nombre in COLUMNAS
+        }
+
+    def __len__(self):
+        return int(self.meta["n"])
+
+    def rango(self, desde=None, hasta_excl=None):
+        """Índices [lo, hi) de las ventas con desde <= fecha < hasta_excl."""
+        fecha = self.col["fecha"]
+        lo = int(np.searchsorted(fecha, epoch(desde), "left")) if desde else 0
+        hi = int(np.searchsorted(fecha, epoch(hasta_excl), "left")) if hasta_excl else len(fecha)
+        return lo, max(lo, hi)
+
+    def _dimension(self, dim, lo, hi):
+        if dim == "hora":
+            return (self.col["fecha"][lo:hi] // 3600) % 24
+        if dim == "dia_semana":
+            # 1970-01-01 fue jueves (3 con lunes = 0)
+            return (self.col["fecha"][lo:hi] // 86400 + 3) % 7
+        if dim == "producto":
+            return self.col["producto_id"][lo:hi].astype(np.int64)
+        if dim == "cliente":
+            return self.col["cliente_id"][lo:hi].astype(np.int64)
+        raise ValueError(f"Dimensión no disponible en columnar: {dim!r}")
+
+    def agrupar(self, dimensiones, medidas, desde=None, hasta_excl=None):
+        """
+        GROUP BY vectorizado. Devuelve {dim: array, medida: array} con los grupos
+        no vacíos, ordenados por dimensiones (como el ORDER BY de la versión SQL).
+        Las filas con producto/cliente nulo quedan fuera si se agrupa por ellos.
+        """
+        lo, hi = self.rango(desde, hasta_excl)
+        codigos, tamanos = [], []
+        validos = np.ones(hi - lo, dtype=bool)
+        for dim in dimensiones:
+            c = self._dimension(dim, lo, hi)
+            if DIMENSIONES[dim] is None:
+                validos &= c >= 0
+                tamanos.append(int(c.max()) + 1 if len(c) else 1)
+            else:
+                tamanos.append(DIMENSIONES[dim])
+            codigos.append(c)
+
+        pesos = {
+            "total": self.col["total"][lo:hi],
+            "cantidad": self.col["cantidad"][lo:hi],
+            "ventas": None,
+        }
+        if not dimensiones:
+            return {m: [(float if m == "total" else int)(
+                pesos[m][validos].sum() if pesos[m] is not None else validos.sum())] for m in medidas}
+
+        clave = np.ravel_multi_index([c[validos] for c in codigos], tamanos) if len(codigos) > 1 \
+            else codigos[0][validos]
+        n_claves = int(np.prod(tamanos))
+        conteo = np.bincount(clave, minlength=n_claves)
+        presentes = np.flatnonzero(conteo)
+
+        res = {}
+        for dim, valores in zip(dimensiones, np.unravel_index(presentes, tamanos)):
+            res[dim] = valores
+        for m in medidas:
+            if m == "ventas":
+                res[m] = conteo[presentes]
+            else:
+                suma = np.bincount(clave, weights=pesos[m][validos], minlength=n_claves)[presentes]
+                res[m] = suma if m == "total" else np.rint(suma).astype(np.int64)
+        return res
+
+    def kpis(self, desde, hasta_excl, prev_desde):
+        """(total, cantidad, nº ventas, clientes únicos, total del periodo anterior)."""
+        lo, hi = self.rango(desde, hasta_excl)
+        total = float(self.col["total"][lo:hi].sum())
+        cantidad = int(self.col["cantidad"][lo:hi].sum())
+        clientes = self.col["cliente_id"][lo:hi]
+        unicos = int(len(np.unique(clientes[clientes >= 0])))
+        previo = 0.0
+        if prev_desde:
+            plo, _ = self.rango(prev_desde, None)
+            previo = float(self.col["total"][plo:lo].sum())
+        return total, cantidad, hi - lo, unicos, previo
+
+    def cantidades_por_dia(self):
+        """(producto_id, día datetime64[D], cantidad) sumadas por producto y día."""
+        prod = self.col["producto_id"].astype(np.int64)
+        dia = self.col["fecha"] // 86400
+        validos = prod >= 0
+        prod, dia = prod[validos], dia[validos]
+        if not len(prod):
+            return prod, dia.astype("datetime64[D]"), np.empty(0)
+        base = int(dia.min())
+        ancho = int(dia.max()) - base + 1
+        claves, inverso = np.unique(prod * ancho + (dia - base), return_inverse=True)
+        cant = np.bincount(inverso, weights=self.col["cantidad"][validos])
+        return claves // ancho, (claves % ancho + base).astype("datetime64[D]"), cant
+
+
+# ---------- Construcción / refresco ----------
+def directorio() -> str:
+    """COLUMNAR_DIR, o un subdirectorio por empresa en modo multi-empresa."""
+    tenant = tenants.actual()
+    base = current_app.config["COLUMNAR_DIR"]
+    return os.path.join(base, tenant) if tenant else base
+
+
+def _leer_meta(dir_):
+    try:
+        with open(os.path.join(dir_, META), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _huella():
+    """(nº de ventas, último id, suma de total) según la BD."""
+    v = particiones.ventas()
+    n, max_id, suma = db.session.execute(
+        select(func.count(v.id), func.max(v.id), func.coalesce(func.sum(v.total), 0.0))
+        .where(v.fecha.isnot(None))
+    ).one()
+    return int(n or 0), int(max_id or 0), float(suma or 0.0)
+
+
+def _leer_ventas(desde_id: int = 0):
+    """Columnas de las ventas con id > desde_id, ordenadas por fecha, id."""
+    v = particiones.ventas(ids=(desde_id + 1, None))
+    stmt = select(v.fecha, v.id, v.producto_id, v.cliente_id, v.cantidad, v.total) \
+        .where(v.fecha.isnot(None), v.id > desde_id) \
+        .order_by(v.fecha, v.id)
+    partes = {k: [] for k in COLUMNAS}
+    for lote in db.session.execute(stmt.execution_options(yield_per=LOTE_LECTURA)).partitions():
+        fecha, ids, prod, cli, cant, total = zip(*lote)
+        partes["fecha"].append(np.array(fecha, dtype="datetime64[s]").astype(np.int64))
+        partes["id"].append(np.array(ids, dtype=np.int64))
+        partes["producto_id"].append(np.array([-1 if v is None else v for v in prod], dtype=np.int32))
+        partes["cliente_id"].append(np.array([-1 if v is None else v for v in cli], dtype=np.int32))
+        partes["cantidad"].append(np.array([v or 0 for v in cant], dtype=np.int32))
+        partes["total"].append(np.array([v or 0.0 for v in total], dtype=np.float64))
+    return {k: (np.concatenate(v) if v else np.empty(0, dtype=COLUMNAS[k])) for k, v in partes.items()}
+
+
+def _escribir(dir_, cols, meta):
+    """Escribe cada columna a un temporal y la reemplaza; meta.json va al final."""
+    os.makedirs(dir_, exist_ok=True)
+    for nombre, arr in cols.items():
+        tmp = os.path.join(dir_, f"{nombre}.tmp.npy")
+        np.save(tmp, np.ascontiguousarray(arr, dtype=COLUMNAS[nombre]))
+        os.replace(tmp, os.path.join(dir_, f"{nombre}.npy"))
+    tmp = os.path.join(dir_, META + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(dir_, META))
+
+
+def refrescar(completo: bool = False) -> dict:
+    """
+    Pone el almacén al día con la BD. Devuelve {"modo", "filas", "nuevas"}.
+    Incremental solo si la BD tiene exactamente las ventas guardadas más las nuevas
+    (mismo conteo y misma suma de total: una actualización en el lugar la cambia).
+    """
+    dir_ = directorio()
+    url = str(db.engine.url)
+    meta = _leer_meta(dir_)
+    # antes de la huella: lo que se escriba después vuelve a marcarlo
+    db.session.execute(delete(Metadato).where(Metadato.clave == OBSOLETO))
+    db.session.commit()
+    n, max_id, suma = _huella()
+
+    if not completo and meta and meta.get("url") == url:
+        nuevas = _leer_ventas(meta["max_id"])
+        suma_esperada = meta["suma_total"] + float(nuevas["total"].sum())
+        misma_suma = abs(suma_esperada - suma) <= 1e-6 * max(1.0, abs(suma))
+        if not len(nuevas["id"]) and meta["n"] == n and meta["max_id"] == max_id and misma_suma:
+            return {"modo": "sin cambios", "filas": n, "nuevas": 0}
+        if meta["n"] + len(nuevas["id"]) == n and misma_suma:
+            viejas = {k: np.load(os.path.join(dir_, f"{k}.npy")) for k in COLUMNAS}
+            cols = {k: np.concatenate([viejas[k], nuevas[k]]) for k in COLUMNAS}
+            if len(nuevas["id"]) and len(viejas["fecha"]) and nuevas["fecha"][0] < viejas["fecha"][-1]:
+                orden = np.lexsort((cols["id"], cols["fecha"]))
+                cols = {k: v[orden] for k, v in cols.items()}
+            _escribir(dir_, cols, {"url": url, "n": n, "max_id": max_id, "suma_total": suma})
+            return {"modo": "incremental", "filas": n, "nuevas": len(nuevas["id"])}
+
+    cols = _leer_ventas()
+    _escribir(dir_, cols, {"url": url, "n": n, "max_id": max_id, "suma_total": suma})
+    return {"modo": "completo", "filas": n, "nuevas": n}
+
+
+def marcar_obsoleto():
+    """Marca el almacén como desactualizado (sin commit), en la misma transacción que la escritura."""
+    if current_app.config.get("COLUMNAR"):
+        db.session.merge(Metadato(clave=OBSOLETO, valor="1"))
+
+
+# ---------- Lectura desde AnalyticsEngine ----------
+def _abrir(dir_):
+    """Abre (o reutiliza) las columnas mapeadas; se reabren si cambió meta.json."""
+    try:
+        mtime = os.stat(os.path.join(dir_, META)).st_mtime_ns
+    except OSError:
+        return None
+    with _lock:
+        _, memo = _abiertos.get(dir_)
+        if memo and memo[0] == mtime:
+            return memo[1]
+        meta = _leer_meta(dir_)
+        if meta is None:
+            return None
+        tienda = VentasColumnar(dir_, meta)
+        _abiertos.set(dir_, (mtime, tienda))
+        return tienda
+
+
+def activo():
+    """El almacén columnar si está habilitado y al día con la BD; si no, None."""
+    if not current_app.config.get("COLUMNAR"):
+        return None
+    tienda = _abrir(directorio())
+    if tienda is None:
+        return None
+    url = str(db.engine.url)
+    version = data_version()
+    memo = _vigencia.get(url)
+    if memo is None or memo[0] != (version, tienda.meta["max_id"], tienda.meta["n"]):
+        meta = tienda.meta
+        if db.session.get(Metadato, OBSOLETO) is not None:
+            vigente = False    # marcado por la ingesta: ni hace falta la huella
+        else:
+            n, max_id, suma = _huella()
+            vigente = (
+                meta.get("url") == url and meta["n"] == n and meta["max_id"] == max_id
+                and abs(meta["suma_total"] - suma) <= 1e-6 * max(1.0, abs(suma))
+            )
+        memo = ((version, meta["max_id"], meta["n"]), vigente)
+        _vigencia[url] = memo
+    return tienda if memo[1] else None
+
+
+def main():
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Construye/refresca el almacén columnar de ventas")
+    parser.add_argument("--completo", action="store_true", help="reconstruye desde cero")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        t0 = time.perf_counter()
+        res = refrescar(completo=args.completo)
+        print(f"Columnar ({res['modo']}): {res['filas']} ventas, {res['nuevas']} nuevas "
+              f"en {time.perf_counter() - t0:.2f}s -> {directorio()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -24,3 +24,77 @@ class Config:
         "sqlite:///" + os.path.join(os.path.dirname(basedir), "app.db"),
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Caché de KPIs en proceso (entradas / segundos)
+    KPI_CACHE_SIZE = int(os.environ.get("KPI_CACHE_SIZE", 256))
+    KPI_CACHE_TTL = float(os.environ.get("KPI_CACHE_TTL", 300))
+    # Cada cuánto (s) se relee la versión de datos escrita por otros procesos (p. ej. el ETL)
+    DATA_VERSION_TTL = float(os.environ.get("DATA_VERSION_TTL", 1.0))
+
+    # Caché HTTP de las APIs de lectura (ETag/304)
+    API_CACHE_MAX_AGE = int(os.environ.get("API_CACHE_MAX_AGE", 0))
+    API_GZIP_MIN_BYTES = int(os.environ.get("API_GZIP_MIN_BYTES", 1024))  # 0 = sin gzip
+
+    # Hilos para calcular los paneles de /api/dashboard en paralelo
+    DASHBOARD_WORKERS = int(os.environ.get("DASHBOARD_WORKERS", 4))
+
+    # Perfil de almacenamiento (ver app/storage.py)
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",          # lectores no bloquean al escritor (ETL)
+        "synchronous": "NORMAL",
+        "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+        "cache_size": -int(os.environ.get("SQLITE_CACHE_KB", 64 * 1024)),   # negativo = KiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    }
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+
+    # Pronósticos de demanda (ver app/pronosticos.py)
+    PRONOSTICO_HORIZONTE = int(os.environ.get("PRONOSTICO_HORIZONTE", 90))   # días guardados
+    PRONOSTICO_ALFA = float(os.environ.get("PRONOSTICO_ALFA", 0.3))          # suavizado del nivel
+    PRONOSTICO_GAMMA = float(os.environ.get("PRONOSTICO_GAMMA", 0.1))        # suavizado estacional
+    PRONOSTICO_WORKERS = int(os.environ.get("PRONOSTICO_WORKERS", 1))        # 0 = todos los núcleos
+
+    # Almacén columnar de ventas en .npy (ver app/columnar.py)
+    COLUMNAR = os.environ.get("ANALYTICS_COLUMNAR", "0").lower() in ("1", "true", "yes")
+    COLUMNAR_DIR = os.environ.get("COLUMNAR_DIR", os.path.join(os.path.dirname(basedir), "columnar"))
+
+    # Modo aproximado approx=1 (ver app/sketches.py)
+    SKETCH_HLL_P = int(os.environ.get("SKETCH_HLL_P", 16))     # 2^p registros: σ = 1,04/√2^p ≈ 0,4 %
+    SKETCH_TOP_K = int(os.environ.get("SKETCH_TOP_K", 500))    # productos guardados por día (exacto si venden menos)
+
+    # Multi-empresa: una BD SQLite por empresa (ver app/tenants.py)
+    MULTI_TENANT = os.environ.get("MULTI_TENANT", "0").lower() in ("1", "true", "yes")
+    TENANT_DIR = os.environ.get("TENANT_DIR", os.path.join(os.path.dirname(basedir), "tenants"))
+    TENANT_HEADER = os.environ.get("TENANT_HEADER", "X-Tenant")
+    TENANT_DOMAIN = os.environ.get("TENANT_DOMAIN", "")             # p. ej. insightpyme.com
+    TENANT_MAX_ENGINES = int(os.environ.get("TENANT_MAX_ENGINES", 64))
+    TENANT_IDLE_SECONDS = float(os.environ.get("TENANT_IDLE_SECONDS", 300))
+
+    # Instrumentación (ver app/metricas.py)
+    METRICAS_SQL_LENTA_MS = float(os.environ.get("METRICAS_SQL_LENTA_MS", 200))
+    METRICAS_SERVER_TIMING = os.environ.get("METRICAS_SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+
+    # Ingesta en vivo POST /api/ventas/batch (ver app/ingesta.py)
+    INGESTA_LOTE = int(os.environ.get("INGESTA_LOTE", 500))                 # ventas por transacción
+    INGESTA_VENTANA_MS = float(os.environ.get("INGESTA_VENTANA_MS", 250))   # espera máx. para juntar un lote
+    INGESTA_COLA_MAX = int(os.environ.get("INGESTA_COLA_MAX", 20_000))      # pendientes; más -> 429
+    INGESTA_MAX_FILAS = int(os.environ.get("INGESTA_MAX_FILAS", 5_000))     # por request; más -> 413
+    INGESTA_ESPERA_S = float(os.environ.get("INGESTA_ESPERA_S", 10))        # máx. con ?esperar=1
+
+    # Actualizaciones en vivo GET /api/stream (ver app/stream.py)
+    STREAM_INTERVALO_S = float(os.environ.get("STREAM_INTERVALO_S", 0.5))   # cada cuánto buscar commits
+    STREAM_LATIDO_S = float(os.environ.get("STREAM_LATIDO_S", 15))          # comentario si no hay novedades
+    STREAM_TOP = int(os.environ.get("STREAM_TOP", 10))                      # productos del top enviados
+
+    # Jobs en segundo plano /api/jobs (ver app/jobs.py)
+    JOBS_MAX = int(os.environ.get("JOBS_MAX", 2))                          # corriendo a la vez por BD
+    JOBS_MAX_S = float(os.environ.get("JOBS_MAX_S", 3600))                 # más -> se mata / se da por abandonado
+    JOBS_INTERVALO_S = float(os.environ.get("JOBS_INTERVALO_S", 1.0))      # revisión de pendientes y procesos
+    JOBS_PROGRESO_S = float(os.environ.get("JOBS_PROGRESO_S", 1.0))        # mínimo entre escrituras de progreso
+    JOBS_TRAS_ETL = os.environ.get("JOBS_TRAS_ETL", "")                    # p. ej. "segmentacion,clv"
+
+    # Particiones mensuales de ventas (ver app/particiones.py; solo SQLite)
+    PARTICIONES_MESES_ABIERTOS = int(os.environ.get("PARTICIONES_MESES_ABIERTOS", 0))  # 0 = sin particiones
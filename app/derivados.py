@@ -0,0 +1,109 @@
+# app/derivados.py
+"""
+Marcas de agua de lo que se deriva de `ventas` por id (sketches, segmentación).
+
+sketches_dia y segmentos_clientes se recalculan de forma incremental desde
+las ventas con id mayor a su marca. Una venta escrita con id menor o igual
+(actualización, terminal que envía fuera de orden, CSV con ids no
+monótonos) no la supera: las dos escrituras de ventas, el ETL y la ingesta
+en vivo, llaman a `registrar` con cada lote, que compara cada id con las
+marcas y deja pendientes, en la misma transacción, los días y clientes que
+tocó. Quien
+escribe no tiene que saber nada del orden de los ids. El refresco siguiente
+recalcula los pendientes y los borra.
+
+Los pendientes son filas de `metadatos` con clave `prefijo + valor`.
+"""
+from sqlalchemy import select, delete, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import db, Metadato
+from . import particiones
+
+MARCA_SKETCHES = "sketches_max_venta_id"
+MARCA_SEGMENTOS = "segmentos_max_venta_id"
+DIA_PENDIENTE = "sketches_pendiente:"      # + AAAA-MM-DD
+CLIENTE_PENDIENTE = "segmentos_pendiente:"  # + id de cliente
+MAX_CLIENTES_PENDIENTES = 5000              # más: la próxima segmentación es completa
+
+
+def marca(clave: str) -> int | None:
+    """Mayor id de venta incluido en el derivado (None: nunca se calculó)."""
+    fila = db.session.get(Metadato, clave)
+    return int(fila.valor) if fila is not None and fila.valor else None
+
+
+# ---------- Pendientes ----------
+def _es(prefijo):
+    # rango sobre la clave primaria (el prefijo termina en ':' y ':' < ';'), sin LIKE
+    return Metadato.clave >= prefijo, Metadato.clave < prefijo[:-1] + ";"
+
+
+def marcar(prefijo: str, valores):
+    """Agrega pendientes (sin commit); los que ya estaban no se repiten."""
+    filas = [{"clave": prefijo + v, "valor": ""} for v in sorted(set(valores))]
+    if not filas:
+        return
+    dialecto = db.engine.dialect.name
+    if dialecto in ("sqlite", "postgresql"):
+        stmt = (sqlite_insert if dialecto == "sqlite" else pg_insert)(Metadato) \
+            .on_conflict_do_nothing(index_elements=[Metadato.clave])
+    else:
+        existentes = set(db.session.execute(
+            select(Metadato.clave).where(Metadato.clave.in_([f["clave"] for f in filas]))).scalars())
+        filas = [f for f in filas if f["clave"] not in existentes]
+        stmt = insert(Metadato)
+    if filas:
+        db.session.execute(stmt, filas)
+
+
+def pendientes(prefijo: str) -> list[str]:
+    """Claves pendientes con ese prefijo."""
+    return db.session.execute(select(Metadato.clave).where(*_es(prefijo))).scalars().all()
+
+
+def hay_pendientes(prefijo: str) -> bool:
+    return db.session.execute(select(Metadato.clave).where(*_es(prefijo)).limit(1)).first() is not None
+
+
+def borrar(claves):
+    """Borra los pendientes ya recalculados (solo esos: los marcados mientras tanto quedan)."""
+    claves = list(claves)
+    for i in range(0, len(claves), 5000):
+        db.session.execute(delete(Metadato).where(Metadato.clave.in_(claves[i:i + 5000])))
+
+
+def reiniciar():
+    """Borra marcas y pendientes (ETL --truncate); sin commit."""
+    db.session.execute(delete(Metadato).where(Metadato.clave.in_([MARCA_SKETCHES, MARCA_SEGMENTOS])))
+    for prefijo in (DIA_PENDIENTE, CLIENTE_PENDIENTE):
+        db.session.execute(delete(Metadato).where(*_es(prefijo)))
+
+
+# ---------- Escrituras ----------
+def registrar(filas):
+    """
+    Antes de escribir un lote de ventas (sin commit). Las filas con id <= la
+    marca de sketches dejan pendientes su día y, si ya existían, el de su
+    versión anterior; con id <= la marca de segmentación, su cliente (y el
+    anterior). Si un lote toca más de MAX_CLIENTES_PENDIENTES clientes, se
+    borra la marca de segmentación: la próxima corrida es completa.
+    """
+    m_sketches, m_segmentos = marca(MARCA_SKETCHES), marca(MARCA_SEGMENTOS)
+    tope = max((m for m in (m_sketches, m_segmentos) if m is not None), default=None)
+    debajo = {f["id"]: f for f in filas if tope is not None and f["id"] <= tope}
+    if not debajo:
+        return
+    v = particiones.ventas(ids=(min(debajo), max(debajo)))
+    previas = db.session.execute(select(v.id, v.fecha, v.cliente_id).where(v.id.in_(list(debajo)))).all()
+    versiones = [(i, f.get("fecha"), f.get("cliente_id")) for i, f in debajo.items()] + [tuple(p) for p in previas]
+
+    if m_sketches is not None:
+        marcar(DIA_PENDIENTE, {f.date().isoformat() for i, f, _ in versiones if f and i <= m_sketches})
+    if m_segmentos is not None:
+        clientes = {str(c) for i, _, c in versiones if c is not None and i <= m_segmentos}
+        if len(clientes) > MAX_CLIENTES_PENDIENTES:
+            db.session.execute(delete(Metadato).where(Metadato.clave == MARCA_SEGMENTOS))
+        else:
+            marcar(CLIENTE_PENDIENTE, clientes)
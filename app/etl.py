@@ -1,10 +1,29 @@
 # app/etl.py
 import csv
+import hashlib
+import io
+import itertools
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import argparse
 
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import select, insert, update
+
 from app import create_app
-from app.models import db, Cliente, Producto, Venta
+from app.models import (
+    db, Cliente, Producto, Venta, EtlEstado, VentaRollup, ClvCliente, SegmentoCliente, Metadato,
+    PronosticoDemanda, SketchDia,
+)
+from app.analytics import rollups_listos
+from app.cache import bump_data_version
+from app.storage import upsert_stmt
+from app import rollups, clv, pronosticos, columnar, sketches, tenants, metricas, jobs, particiones, derivados
 
 def sniff_dialect(path):
     with open(path, 'rb') as fb:
@@ -54,53 +73,461 @@ def read_rows(path):
                 norm[field_map.get(original_key, original_key)] = (val or "").strip()
             yield norm
 
-def cargar_clientes(path):
-    for row in read_rows(path):
-        # aceptamos variantes: id, cliente_id
-        _id = row.get("id") or row.get("cliente_id")
-        nombre = row.get("nombre")
-        correo = row.get("correo") or row.get("email")
-        if not _id:
-            raise KeyError(f"{path}: falta columna 'id' (o 'cliente_id') en fila {row}")
-        c = Cliente.query.get(int(_id))
-        if not c:
-            c = Cliente(id=int(_id))
-        c.nombre = (nombre or "").strip()
-        c.correo = (correo or "").strip() if correo else None
-        db.session.add(c)
-    db.session.commit()
+# ---------- Carga masiva (upsert por lotes) ----------
+CHUNK_SIZE = 5000
+
+
+def _chunks(iterable, size):
+    """Agrupa un iterable en listas de hasta `size` elementos."""
+    lote = []
+    for item in iterable:
+        lote.append(item)
+        if len(lote) >= size:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _existing_ids(model, ids):
+    """Ids del lote que ya existen en la tabla (una sola consulta)."""
+    if not ids:
+        return set()
+    filas = db.session.execute(select(model.id).where(model.id.in_(ids)))
+    return {f[0] for f in filas}
+
+
+def _upsert_lote(model, lote, stats):
+    """Escribe un lote (sin commit): una consulta de ids existentes y un executemany."""
+    table = model.__table__
+    # el último valor gana si el id se repite dentro del lote
+    por_id = {f["id"]: f for f in lote}
+    lote = list(por_id.values())
+    existentes = _existing_ids(model, list(por_id))
+
+    stmt = upsert_stmt(table, lote[0].keys())
+    if stmt is not None:
+        db.session.execute(stmt, lote)
+    else:
+        nuevas = [f for f in lote if f["id"] not in existentes]
+        viejas = [f for f in lote if f["id"] in existentes]
+        if nuevas:
+            db.session.execute(insert(table), nuevas)
+        if viejas:
+            db.session.execute(update(model), viejas)
+
+    stats["filas"] += len(lote)
+    stats["actualizadas"] += len(existentes)
+    stats["nuevas"] += len(lote) - len(existentes)
+
+
+# ---------- Esquemas CSV -> columnas ----------
+# Por cada columna de la tabla: alias aceptados en el CSV (el primero presente
+# en la cabecera gana), tipo, si es obligatoria y valor por defecto si falta.
+Columna = namedtuple("Columna", "alias tipo requerida defecto")
+
+ESQUEMA_CLIENTES = {
+    "id":     Columna(("id", "cliente_id"), "int", True, None),
+    "nombre": Columna(("nombre",), "str", False, ""),
+    "email":  Columna(("correo", "email"), "str", False, None),
+}
+ESQUEMA_PRODUCTOS = {
+    "id":     Columna(("id", "producto_id"), "int", True, None),
+    "nombre": Columna(("nombre",), "str", False, ""),
+    "precio": Columna(("precio", "valor", "price"), "float", False, 0.0),
+}
+ESQUEMA_VENTAS = {
+    "id":          Columna(("id",), "int", True, None),
+    "fecha":       Columna(("fecha",), "fecha", True, None),
+    "cliente_id":  Columna(("cliente_id", "id_cliente"), "int", True, None),
+    "producto_id": Columna(("producto_id", "id_producto"), "int", True, None),
+    "cantidad":    Columna(("cantidad", "qty"), "int", False, 0),
+    "total":       Columna(("total", "monto"), "float", False, 0.0),
+}
+
+FORMATOS_FECHA = (
+    "%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S",
+    "%Y/%m/%d", "%d/%m/%Y", "%d/%m/%Y %H:%M",
+)
+MUESTRA_FILAS = 500
+
 
-def cargar_productos(path):
-    for row in read_rows(path):
-        _id = row.get("id") or row.get("producto_id")
-        nombre = row.get("nombre")
-        precio = row.get("precio") or row.get("valor") or row.get("price")
-        if not _id:
-            raise KeyError(f"{path}: falta 'id' (o 'producto_id') en fila {row}")
-        p = Producto.query.get(int(_id))
-        if not p:
-            p = Producto(id=int(_id))
-        p.nombre = (nombre or "").strip()
-        p.precio = float(precio or 0)
-        db.session.add(p)
+def plan_columnas(campos, esquema, path):
+    """Resuelve una sola vez por archivo qué cabecera alimenta cada columna."""
+    plan = {}
+    for canon, col in esquema.items():
+        origen = next((a for a in col.alias if a in campos), None)
+        if origen is None and col.requerida:
+            raise KeyError(f"{path}: falta columna '{canon}' (alias: {', '.join(col.alias)})")
+        if origen is not None:
+            plan[canon] = campos.index(origen)
+    return plan
+
+
+def detectar_formato_fecha(valores):
+    """Formato de FORMATOS_FECHA que acepta más valores de la muestra, o None."""
+    valores = [v for v in valores if v]
+    mejor, aciertos_max = None, 0
+    for fmt in FORMATOS_FECHA:
+        aciertos = 0
+        for v in valores:
+            try:
+                datetime.strptime(v, fmt)
+                aciertos += 1
+            except ValueError:
+                pass
+        if aciertos > aciertos_max:
+            mejor, aciertos_max = fmt, aciertos
+    return mejor
+
+
+def _perfil(path, esquema):
+    """Cabecera, formato csv, plan de columnas y formato de fecha del archivo."""
+    campos, offset, fmt = _cabecera(path)
+    plan = plan_columnas(campos, esquema, path)
+    fmt_fecha = None
+    fechas = [c for c, col in esquema.items() if col.tipo == "fecha"]
+    if fechas:
+        origen = campos[plan[fechas[0]]]
+        muestra = itertools.islice(read_rows(path), MUESTRA_FILAS)
+        fmt_fecha = detectar_formato_fecha([r.get(origen, "") for r in muestra])
+    return campos, offset, fmt, plan, fmt_fecha
+
+
+def _coercionar(lineas, filas, plan, esquema, fmt_fecha):
+    """
+    Tipa un bloque de filas crudas columna por columna (pandas/numpy).
+    Devuelve (registros válidos, [(línea, motivo), ...]).
+    """
+    n = len(filas)
+    lineas = np.asarray(lineas)
+    malas = np.zeros(n, dtype=bool)
+    errores = []
+    columnas = list(zip(*filas))
+    salida = {}
+
+    def marcar(invalidas, canon, crudo):
+        nuevas = np.flatnonzero(invalidas & ~malas)
+        for i in nuevas:
+            motivo = f"falta {canon}" if not crudo[i] else f"valor inválido en {canon}: {crudo[i]!r}"
+            errores.append((int(lineas[i]), motivo))
+        malas[nuevas] = True
+
+    for canon, col in esquema.items():
+        if canon not in plan:
+            salida[canon] = [col.defecto] * n
+            continue
+        crudo = pd.Series(columnas[plan[canon]], dtype=object).str.strip()
+        vacio = (crudo == "").to_numpy()
+        if col.requerida:
+            marcar(vacio, canon, crudo)
+
+        if col.tipo == "str":
+            salida[canon] = crudo.where(~vacio, col.defecto).tolist()
+        elif col.tipo == "fecha":
+            conv = pd.to_datetime(crudo.where(~vacio), format=fmt_fecha or "ISO8601", errors="coerce")
+            valores = conv.to_numpy(dtype="datetime64[us]").tolist()
+            invalidas = np.zeros(n, dtype=bool)
+            # solo los valores que no encajan en el formato detectado pasan por la ruta lenta
+            for i in np.flatnonzero(conv.isna().to_numpy() & ~vacio):
+                try:
+                    valores[i] = parse_fecha(crudo[i])
+                except ValueError:
+                    invalidas[i] = True
+            marcar(invalidas, canon, crudo)
+            salida[canon] = valores
+        else:
+            num = pd.to_numeric(crudo.where(~vacio), errors="coerce").to_numpy(dtype=float)
+            invalidas = np.isnan(num) & ~vacio
+            if col.tipo == "int":
+                invalidas |= ~np.isnan(num) & (num % 1 != 0)
+            marcar(invalidas, canon, crudo)
+            num = np.where(np.isnan(num), col.defecto or 0, num)
+            salida[canon] = (num.astype(np.int64) if col.tipo == "int" else num).tolist()
+
+    claves = list(salida)
+    buenas = np.flatnonzero(~malas)
+    registros = [dict(zip(claves, vals)) for vals in zip(*salida.values())]
+    if len(buenas) < n:
+        registros = [registros[i] for i in buenas]
+    return registros, errores
+
+
+def _filas_crudas(reader, ancho):
+    """Itera (línea, valores) rellenando/recortando al ancho de la cabecera."""
+    for valores in reader:
+        if not valores or valores == [""]:
+            continue
+        if len(valores) != ancho:
+            valores = (valores + [""] * ancho)[:ancho]
+        yield reader.line_num, valores
+
+
+# ---------- Lectura por rangos de bytes (secuencial o --workers N) ----------
+def _cabecera(path):
+    """
+    Lee la cabecera del CSV.
+    Devuelve (campos normalizados, offset donde empiezan los datos, formato csv).
+    """
+    dialect = sniff_dialect(path)
+    fmt = {
+        "delimiter": dialect.delimiter,
+        "quotechar": dialect.quotechar or '"',
+        "doublequote": dialect.doublequote,
+        "skipinitialspace": dialect.skipinitialspace,
+    }
+    with open(path, "rb") as fb:
+        linea = fb.readline()
+        offset = fb.tell()
+    campos = next(csv.reader([linea.decode("utf-8-sig")], **fmt), [])
+    if not campos:
+        raise ValueError(f"{path}: no se detectaron cabeceras.")
+    return [normalize_key(c) for c in campos], offset, fmt
+
+
+def _tam_rango(path, inicio, chunk_size):
+    """Bytes por rango para que cada uno tenga ~chunk_size filas (según una muestra)."""
+    with open(path, "rb") as fb:
+        fb.seek(inicio)
+        muestra = fb.read(64 * 1024)
+    por_linea = len(muestra) / max(muestra.count(b"\n"), 1)
+    return max(int(chunk_size * por_linea), 64 * 1024)
+
+
+def _rangos_bytes(path, inicio, tam, quotechar='"', bloque=1 << 20):
+    """
+    Parte [inicio, EOF) en rangos de ~tam bytes, cortando siempre en fin de
+    registro: un '\n' con una cantidad par de comillas desde `inicio` (un
+    salto de línea dentro de un campo entre comillas no corta el rango).
+    """
+    comilla = quotechar.encode()
+    rangos = []
+    with open(path, "rb") as fb:
+        fb.seek(inicio)
+        a = pos = inicio
+        objetivo = inicio + tam
+        impar = 0                      # paridad de comillas vistas desde `inicio`
+        for datos in iter(lambda: fb.read(bloque), b""):
+            i = 0                      # comillas del bloque ya contadas hasta acá
+            while objetivo < pos + len(datos):
+                j = datos.find(b"\n", max(objetivo - pos, i))
+                if j < 0:
+                    break
+                impar ^= datos.count(comilla, i, j) & 1
+                i = j + 1
+                if impar:
+                    objetivo = pos + i     # '\n' dentro de comillas: probar el siguiente
+                else:
+                    rangos.append((a, pos + i))
+                    a, objetivo = pos + i, pos + i + tam
+            impar ^= datos.count(comilla, i) & 1
+            pos += len(datos)
+    if a < pos:
+        rangos.append((a, pos))
+    return rangos
+
+
+def _parse_rango(path, a, b, perfil, esquema):
+    """
+    Parsea y tipa las filas del rango [a, b) (en el proceso actual o en un worker).
+    Devuelve (registros, errores con línea relativa al rango, líneas leídas,
+    (segundos de parseo, segundos de coerción)).
+    """
+    campos, _, fmt, plan, fmt_fecha = perfil
+    t0 = time.perf_counter()
+    with open(path, "rb") as fb:
+        fb.seek(a)
+        texto = fb.read(b - a).decode("utf-8")
+    reader = csv.reader(io.StringIO(texto, newline=""), **fmt)
+    bloque = list(_filas_crudas(reader, len(campos)))
+    t1 = time.perf_counter()
+    if not bloque:
+        return [], [], texto.count("\n"), (t1 - t0, 0.0)
+    lineas, filas = zip(*bloque)
+    registros, errores = _coercionar(lineas, filas, plan, esquema, fmt_fecha)
+    return registros, errores, texto.count("\n"), (t1 - t0, time.perf_counter() - t1)
+
+
+def _bloques(path, perfil, esquema, rangos, workers=1):
+    """
+    Produce (rango, registros, errores, líneas, tiempos) por cada rango, en orden.
+    Con workers > 1 es un pipeline: los procesos parsean rangos mientras el
+    proceso principal (único escritor) consume los lotes ya tipados; se
+    mantienen como mucho 2*workers rangos en vuelo para acotar memoria.
+    """
+    if workers <= 1:
+        for a, b in rangos:
+            yield (a, b), *_parse_rango(path, a, b, perfil, esquema)
+        return
+
+    rangos = iter(rangos)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        en_vuelo = deque(
+            ((a, b), pool.submit(_parse_rango, path, a, b, perfil, esquema))
+            for a, b in itertools.islice(rangos, workers * 2)
+        )
+        while en_vuelo:
+            rango, futuro = en_vuelo.popleft()
+            siguiente = next(rangos, None)
+            if siguiente:
+                a, b = siguiente
+                en_vuelo.append(((a, b), pool.submit(_parse_rango, path, a, b, perfil, esquema)))
+            yield rango, *futuro.result()
+
+
+# ---------- Estado incremental (huellas y marcas de agua) ----------
+def _hash_prefijo(path, hasta, bloque=1 << 20):
+    """sha256 de los primeros `hasta` bytes (se devuelve el objeto para seguir acumulando)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as fb:
+        restante = hasta
+        while restante > 0:
+            datos = fb.read(min(bloque, restante))
+            if not datos:
+                break
+            h.update(datos)
+            restante -= len(datos)
+    return h
+
+
+def _punto_de_partida(path, estado, offset_datos):
+    """
+    Decide desde qué byte hay que leer el archivo según su estado guardado.
+    Devuelve (offset, líneas ya consumidas, hasher del prefijo).
+      - sin estado o archivo reescrito -> desde la cabecera (carga completa)
+      - mismo prefijo que lo ya cargado -> desde el offset guardado
+        (cola nueva de un archivo append-only, o reanudación tras un fallo)
+    """
+    if estado is not None and estado.offset and estado.offset <= os.path.getsize(path):
+        h = _hash_prefijo(path, estado.offset)
+        if h.hexdigest() == estado.hash:
+            return estado.offset, estado.lineas, h
+    return offset_datos, 1, _hash_prefijo(path, offset_datos)
+
+
+def _sin_cambios(path, estado):
+    """Atajo sin leer el archivo: misma huella (tamaño + mtime) y carga terminada."""
+    if estado is None or not estado.completo:
+        return False
+    st = os.stat(path)
+    return estado.tamano == st.st_size and estado.mtime == st.st_mtime
+
+
+def _actualizar_marcas(estado, registros):
+    if not registros:
+        return
+    max_id = max(r["id"] for r in registros)
+    estado.max_id = max(estado.max_id or max_id, max_id)
+    if "fecha" in registros[0]:
+        max_fecha = max(r["fecha"] for r in registros)
+        estado.max_fecha = max(estado.max_fecha or max_fecha, max_fecha)
+
+
+def _cargar(model, esquema, path, chunk_size, workers, incremental=True):
+    """
+    Carga un CSV en `model`; las filas inválidas se reportan y no detienen la carga.
+    Cada rango (~chunk_size filas) se confirma junto con el estado del archivo
+    (offset, hash del prefijo, marcas de agua), así una carga interrumpida se
+    retoma desde el último commit y un archivo que solo creció carga su cola.
+    """
+    archivo = os.path.abspath(path)
+    stats = {"filas": 0, "nuevas": 0, "actualizadas": 0, "errores": [], "omitido": False}
+    estado = db.session.get(EtlEstado, archivo)
+    if incremental and _sin_cambios(path, estado):
+        stats["omitido"] = True
+        return stats
+
+    perfil = _perfil(path, esquema)
+    offset, lineas, hasher = _punto_de_partida(path, estado if incremental else None, perfil[1])
+    st = os.stat(path)
+    if estado is None:
+        estado = EtlEstado(archivo=archivo, tabla=model.__tablename__)
+        db.session.add(estado)
+    if offset == perfil[1]:
+        estado.max_id = estado.max_fecha = None
+    if offset > perfil[1]:
+        stats["desde_byte"] = offset
+    estado.tamano, estado.mtime, estado.completo = st.st_size, st.st_mtime, False
+    estado.offset, estado.hash, estado.lineas = offset, hasher.hexdigest(), lineas
     db.session.commit()
 
-def cargar_ventas(path):
-    for row in read_rows(path):
-        _id = row.get("id")
-        if not _id:
-            raise KeyError(f"{path}: falta 'id' en fila {row}")
-        v = Venta.query.get(int(_id))
-        if not v:
-            v = Venta(id=int(_id))
-        v.fecha = parse_fecha(row.get("fecha"))
-        # aceptar variantes
-        v.cliente_id = int(row.get("cliente_id") or row.get("id_cliente") or 0) or None
-        v.producto_id = int(row.get("producto_id") or row.get("id_producto") or 0) or None
-        v.cantidad = int(row.get("cantidad") or row.get("qty") or 0)
-        v.total = float(row.get("total") or row.get("monto") or 0)
-        db.session.add(v)
+    rangos = _rangos_bytes(path, offset, _tam_rango(path, perfil[1], chunk_size), perfil[2]["quotechar"])
+    fases = metricas.Fases(model.__tablename__)
+    with open(path, "rb") as fb:
+        for (a, b), registros, errores, n_lineas, (t_parse, t_coercion) in \
+                _bloques(path, perfil, esquema, rangos, workers):
+            fases.sumar("parseo", t_parse)        # con --workers: tiempo de CPU en los procesos
+            fases.sumar("coercion", t_coercion)
+            with fases.medir("escritura"):
+                for lote in _chunks(registros, chunk_size):
+                    if model is Venta:
+                        derivados.registrar(lote)     # ids no monótonos / actualizadas: días pendientes
+                        rollups.aplicar_lote(lote)
+                        lote, n, previas, vuelven = particiones.enrutar(lote)
+                        # las que vuelven de una partición a `ventas` el upsert las ve como nuevas
+                        stats["filas"] += n
+                        stats["actualizadas"] += previas + vuelven
+                        stats["nuevas"] += n - previas - vuelven
+                    if lote:
+                        _upsert_lote(model, lote, stats)
+            stats["errores"].extend((lineas + linea, motivo) for linea, motivo in errores)
+            lineas += n_lineas
+            fb.seek(a)
+            hasher.update(fb.read(b - a))
+            estado.offset, estado.hash, estado.lineas = b, hasher.hexdigest(), lineas
+            _actualizar_marcas(estado, registros)
+            estado.actualizado = datetime.now()
+            bump_data_version()
+            with fases.medir("commit"):
+                db.session.commit()
+
+    estado.completo = True
     db.session.commit()
+    stats["errores"].sort()
+    stats["fases"] = dict(fases.segundos)
+    metricas.registro.sumar("insight_etl_filas_total", {"tabla": model.__tablename__}, stats["filas"])
+    return stats
+
+
+def cargar_clientes(path, chunk_size=CHUNK_SIZE, workers=1, incremental=True):
+    return _cargar(Cliente, ESQUEMA_CLIENTES, path, chunk_size, workers, incremental)
+
+def cargar_productos(path, chunk_size=CHUNK_SIZE, workers=1, incremental=True):
+    return _cargar(Producto, ESQUEMA_PRODUCTOS, path, chunk_size, workers, incremental)
+
+def cargar_ventas(path, chunk_size=CHUNK_SIZE, workers=1, incremental=True):
+    if not rollups_listos():
+        # primera carga con rollups (o BD previa a ellos): se calculan completos una vez
+        rollups.reconstruir()
+    return _cargar(Venta, ESQUEMA_VENTAS, path, chunk_size, workers, incremental)
+
+
+MAX_ERRORES_LISTADOS = 20
+
+
+def _cargar_y_medir(nombre, loader, path, chunk_size, workers=1, incremental=True):
+    """Ejecuta un loader e imprime filas/seg."""
+    t0 = time.perf_counter()
+    stats = loader(path, chunk_size=chunk_size, workers=workers, incremental=incremental)
+    if stats.get("omitido"):
+        print(f"{nombre}: sin cambios desde la última carga, se omite.")
+        return stats
+    if stats.get("desde_byte"):
+        print(f"{nombre}: continuando desde el byte {stats['desde_byte']:,}")
+    seg = time.perf_counter() - t0
+    ritmo = stats["filas"] / seg if seg > 0 else 0.0
+    print(f"{nombre}: {stats['filas']} filas ({stats['nuevas']} nuevas, "
+          f"{stats['actualizadas']} actualizadas) en {seg:.2f}s -> {ritmo:,.0f} filas/s")
+    if stats.get("fases"):
+        print("  fases: " + ", ".join(f"{f} {t:.2f}s" for f, t in stats["fases"].items()))
+    errores = stats.get("errores") or []
+    if errores:
+        print(f"  {len(errores)} filas con error (omitidas):")
+        for linea, motivo in errores[:MAX_ERRORES_LISTADOS]:
+            print(f"    línea {linea}: {motivo}")
+        if len(errores) > MAX_ERRORES_LISTADOS:
+            print(f"    ... y {len(errores) - MAX_ERRORES_LISTADOS} más")
+    return stats
 
 def main():
     parser = argparse.ArgumentParser()
@@ -108,24 +535,99 @@ def main():
     parser.add_argument("--productos", required=True)
     parser.add_argument("--ventas", required=True)
     parser.add_argument("--truncate", default="false")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="filas por lote/commit (por defecto %(default)s)")
+    parser.add_argument("--forzar", action="store_true",
+                        help="ignora el estado guardado y recarga los archivos completos")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="procesos para parsear en paralelo (0 = todos los núcleos)")
+    parser.add_argument("--tenant", default=None,
+                        help="empresa destino (crea su BD en TENANT_DIR si no existe)")
+    parser.add_argument("--metricas", default=None,
+                        help="escribe las métricas del ETL en este archivo (formato Prometheus)")
+    parser.add_argument("--jobs", default=None,
+                        help="jobs a correr al terminar, p. ej. segmentacion,clv (por defecto JOBS_TRAS_ETL)")
     args = parser.parse_args()
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
 
     app = create_app()
-    with app.app_context():
-        if str(args.truncate).lower() in ("true", "1", "yes", "y"):
+    tipos_jobs = [t.strip() for t in (args.jobs if args.jobs is not None else app.config.get("JOBS_TRAS_ETL", ""))
+                  .split(",") if t.strip()]
+    desconocidos = [t for t in tipos_jobs if t not in jobs.TIPOS]
+    if desconocidos:
+        parser.error(f"job desconocido: {desconocidos[0]} (válidos: {', '.join(sorted(jobs.TIPOS))})")
+    with app.app_context(), tenants.activar(args.tenant, crear=True):
+        truncado = str(args.truncate).lower() in ("true", "1", "yes", "y")
+        if truncado:
+            db.session.query(ClvCliente).delete()
+            db.session.query(PronosticoDemanda).delete()
+            db.session.query(SegmentoCliente).delete()
+            db.session.query(SketchDia).delete()
+            derivados.reiniciar()
+            db.session.query(Metadato).filter(Metadato.clave == columnar.OBSOLETO).delete()
             db.session.query(Venta).delete()
+            particiones.eliminar_todas()
             db.session.query(Producto).delete()
             db.session.query(Cliente).delete()
+            db.session.query(EtlEstado).delete()
+            db.session.query(VentaRollup).delete()
+            bump_data_version()
             db.session.commit()
 
-        cargar_clientes(args.clientes)
-        cargar_productos(args.productos)
-        cargar_ventas(args.ventas)
+        incremental = not args.forzar
+        _cargar_y_medir("Clientes", cargar_clientes, args.clientes, args.chunk_size, workers, incremental)
+        _cargar_y_medir("Productos", cargar_productos, args.productos, args.chunk_size, workers, incremental)
+        stats = _cargar_y_medir("Ventas", cargar_ventas, args.ventas, args.chunk_size, workers, incremental)
+        if app.config.get("PARTICIONES_MESES_ABIERTOS"):
+            t0 = time.perf_counter()
+            movidas = particiones.cerrar()
+            compactadas = particiones.compactar()
+            print(f"Particiones: {sum(movidas.values())} ventas a {len(movidas)} meses cerrados, "
+                  f"{len(compactadas)} compactados en {time.perf_counter() - t0:.2f}s")
+        # lo que se pidió con --jobs corre solo como job, al final (no dos veces);
+        # sketches y segmentación van incrementales: las actualizadas quedaron pendientes
+        completo = bool(stats["actualizadas"]) or truncado
+        parametros_jobs = {"pronosticos": {"workers": workers}}
+        if "clv" not in tipos_jobs and (stats["filas"] or not ClvCliente.query.first()):
+            t0 = time.perf_counter()
+            n = clv.recalcular()
+            print(f"CLV: {n} clientes recalculados en {time.perf_counter() - t0:.2f}s")
+        if app.config.get("COLUMNAR"):
+            # antes que los pronósticos, que lo leen si está al día
+            t0 = time.perf_counter()
+            res = columnar.refrescar(completo=completo)
+            print(f"Columnar ({res['modo']}): {res['nuevas']} ventas nuevas en "
+                  f"{time.perf_counter() - t0:.2f}s")
+        if "pronosticos" not in tipos_jobs and (stats["filas"] or not PronosticoDemanda.query.first()):
+            t0 = time.perf_counter()
+            n = pronosticos.recalcular(workers)
+            print(f"Pronósticos: {n} productos en {time.perf_counter() - t0:.2f}s")
+        if "sketches" not in tipos_jobs:
+            t0 = time.perf_counter()
+            res = sketches.refrescar()
+            print(f"Sketches ({res['modo']}): {res['dias']} días en {time.perf_counter() - t0:.2f}s")
 
         print("Clientes:", Cliente.query.count())
         print("Productos:", Producto.query.count())
-        print("Ventas:", Venta.query.count())
+        print("Ventas:", particiones.contar())
+        for tipo in tipos_jobs:
+            # mismo registro que /api/jobs: si ya hay uno idéntico en curso, no se repite
+            job, nuevo = jobs.solicitar(tipo, parametros_jobs.get(tipo, {}))
+            if nuevo and jobs.tomar(job.id, respetar_cupo=False):
+                job = jobs.correr(job.id)
+            print(f"Job {tipo} ({job.id}): {job.estado}"
+                  + (f" {job.resultado}" if job.resultado else "") + (f" — {job.error}" if job.error else ""))
+        # marca que revisa app/servidor.py para recargar sus workers
+        meta = db.session.get(Metadato, "etl_terminado") or Metadato(clave="etl_terminado")
+        meta.valor = datetime.now().isoformat()
+        db.session.add(meta)
+        db.session.commit()
         print("ETL terminado.")
 
+    if args.metricas:
+        # p. ej. para el textfile collector de node_exporter
+        with open(args.metricas, "w", encoding="utf-8") as f:
+            f.write(metricas.exportar())
+
 if __name__ == "__main__":
     main()
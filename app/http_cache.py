@@ -0,0 +1,84 @@
+# app/http_cache.py
+"""
+Caché HTTP para las APIs de lectura: ETag + 304, Cache-Control y gzip.
+
+Las vistas marcadas con @cacheable obtienen un ETag débil calculado con
+(endpoint, argumentos normalizados, data_version, fecha de hoy). Si el
+navegador o el proxy mandan If-None-Match con ese valor se responde 304
+antes de ejecutar la vista, sin consultar la BD.
+"""
+import gzip
+import hashlib
+from datetime import date
+
+from flask import current_app, g, request
+
+from .cache import data_version
+from . import tenants
+
+
+def cacheable(view):
+    """Marca una vista GET como cacheable por ETag (va debajo de @main.get)."""
+    view._http_cache = True
+    return view
+
+
+def _etag():
+    args = sorted((k, v) for k, v in request.args.items(multi=True) if v != "")
+    # la fecha entra porque algunos endpoints sin rango dependen del "mes actual"
+    base = repr((tenants.actual(), request.endpoint, sorted((request.view_args or {}).items()), args,
+                 data_version(), date.today().isoformat()))
+    return hashlib.sha1(base.encode("utf-8")).hexdigest()
+
+
+def _cache_control():
+    max_age = current_app.config.get("API_CACHE_MAX_AGE", 0)
+    return f"public, max-age={max_age}, must-revalidate"
+
+
+def _es_cacheable():
+    if request.method != "GET" or not request.endpoint:
+        return False
+    view = current_app.view_functions.get(request.endpoint)
+    return bool(getattr(view, "_http_cache", False))
+
+
+def _antes():
+    g.etag = None
+    if not _es_cacheable():
+        return None
+    g.etag = _etag()
+    if request.if_none_match.contains_weak(g.etag):
+        resp = current_app.response_class(status=304)
+        resp.set_etag(g.etag, weak=True)
+        resp.headers["Cache-Control"] = _cache_control()
+        resp.vary.add("Accept-Encoding")
+        return resp
+    return None
+
+
+def _despues(resp):
+    etag = g.get("etag")
+    if not etag or resp.status_code != 200:
+        return resp
+    resp.set_etag(etag, weak=True)
+    resp.headers["Cache-Control"] = _cache_control()
+    resp.vary.add("Accept-Encoding")
+
+    minimo = current_app.config.get("API_GZIP_MIN_BYTES", 0)
+    if (
+        minimo
+        and not resp.direct_passthrough
+        and "Content-Encoding" not in resp.headers
+        and "gzip" in request.accept_encodings
+        and resp.content_length and resp.content_length >= minimo
+    ):
+        resp.set_data(gzip.compress(resp.get_data(), compresslevel=6))
+        resp.headers["Content-Encoding"] = "gzip"
+    return resp
+
+
+def instalar(bp):
+    """Registra los hooks de caché HTTP en un blueprint."""
+    bp.before_request(_antes)
+    bp.after_request(_despues)
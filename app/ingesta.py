@@ -0,0 +1,320 @@
+# app/ingesta.py
+"""
+Ingesta en vivo de ventas (POST /api/ventas/batch) con escritura por lotes.
+
+Los terminales envían NDJSON o un arreglo JSON. Cada venta se valida (tipos,
+producto y cliente existentes) y las válidas pasan a una cola en memoria.
+Un hilo escritor por proceso las junta en transacciones de hasta
+INGESTA_LOTE ventas, o lo que haya llegado en INGESTA_VENTANA_MS. Así
+SQLite ve pocas transacciones grandes en vez de una por venta, que se
+serializarían en el lock de escritura.
+
+- El id de la venta es obligatorio y se escribe con upsert: reintentar un
+  envío no duplica ventas.
+- Cada transacción mantiene ventas_rollup (rollups.aplicar_lote) y sube la
+  versión de datos, así las cachés de analytics no quedan viejas.
+- En la misma transacción marca el almacén columnar como desactualizado y
+  registra las ventas con id menor o igual a las marcas de sketches y
+  segmentación (actualizaciones, terminales que envían fuera de orden; ver
+  app/derivados.py), que no se verían al refrescarlos.
+- Si la cola tiene INGESTA_COLA_MAX ventas pendientes, el POST responde 429.
+- Aceptado (202) significa encolado; con ?esperar=1 el POST espera el commit.
+- La cola vive en el proceso: al salir se drena (atexit y app/servidor.py).
+- Tras cada commit se avisa a app/stream.py para empujar el delta al tablero.
+- Las ventas de meses ya cerrados (app/particiones.py) se rechazan.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import select, insert, update
+
+from .models import db, Venta, Producto, Cliente
+from .analytics import rollups_listos
+from .cache import bump_data_version
+from .storage import upsert_stmt
+from . import columnar, derivados, metricas, particiones, rollups, stream, tenants
+
+log = logging.getLogger("insight.ingesta")
+
+CAMPOS_ENTEROS = ("id", "cliente_id", "producto_id")
+
+
+# ---------- Validación ----------
+def _entero(valor, campo):
+    if isinstance(valor, bool) or not isinstance(valor, (int, str)):
+        raise ValueError(f"{campo} debe ser entero")
+    try:
+        return int(valor)
+    except ValueError:
+        raise ValueError(f"{campo} debe ser entero") from None
+
+
+def _numero(valor, campo):
+    if isinstance(valor, bool) or not isinstance(valor, (int, float, str)):
+        raise ValueError(f"{campo} debe ser numérico")
+    try:
+        return float(valor)
+    except ValueError:
+        raise ValueError(f"{campo} debe ser numérico") from None
+
+
+def normalizar(obj) -> dict:
+    """Objeto JSON de una venta -> fila de `ventas` (sin precio/total si no vinieron)."""
+    if not isinstance(obj, dict):
+        raise ValueError("se esperaba un objeto")
+    faltan = [c for c in CAMPOS_ENTEROS if obj.get(c) in (None, "")]
+    if faltan:
+        raise ValueError(f"falta {faltan[0]}")
+    fila = {c: _entero(obj[c], c) for c in CAMPOS_ENTEROS}
+    if fila["id"] <= 0:
+        raise ValueError("id debe ser positivo")
+
+    fecha = obj.get("fecha")
+    if fecha in (None, ""):
+        fila["fecha"] = datetime.now()
+    else:
+        try:
+            fila["fecha"] = datetime.fromisoformat(str(fecha))
+        except ValueError:
+            raise ValueError(f"fecha inválida: {fecha!r}") from None
+        if fila["fecha"].tzinfo is not None:
+            raise ValueError("fecha con zona horaria: enviar hora local sin zona")
+
+    fila["cantidad"] = _entero(obj.get("cantidad", 1), "cantidad")
+    if fila["cantidad"] < 0:
+        raise ValueError("cantidad negativa")
+    for campo in ("precio_unitario", "total"):
+        if obj.get(campo) not in (None, ""):
+            fila[campo] = _numero(obj[campo], campo)
+    return fila
+
+
+def validar(objetos):
+    """
+    Lista de objetos -> (filas válidas, [{"linea", "error"}]). Verifica que
+    producto y cliente existan (una consulta por tabla) y que la venta no
+    caiga en un mes cerrado (app/particiones.py), y completa precio (el del
+    producto) y total (cantidad × precio) si no vinieron.
+    """
+    filas, rechazadas = [], []
+    for i, obj in enumerate(objetos, start=1):
+        try:
+            filas.append((i, normalizar(obj)))
+        except ValueError as e:
+            rechazadas.append({"linea": i, "error": str(e)})
+    if not filas:
+        return [], rechazadas
+
+    precios = dict(db.session.execute(
+        select(Producto.id, Producto.precio).where(Producto.id.in_({f["producto_id"] for _, f in filas}))
+    ).all())
+    clientes = set(db.session.execute(
+        select(Cliente.id).where(Cliente.id.in_({f["cliente_id"] for _, f in filas}))
+    ).scalars())
+    corte = particiones.corte()
+    cerrados = particiones.ids_cerrados(f["id"] for _, f in filas)
+
+    validas = []
+    for i, f in filas:
+        if corte is not None and f["fecha"] < corte:
+            rechazadas.append({"linea": i, "error": f"mes cerrado: {particiones.mes_de(f['fecha'])}"})
+        elif f["id"] in cerrados:
+            rechazadas.append({"linea": i, "error": f"venta {f['id']} ya está en un mes cerrado"})
+        elif f["producto_id"] not in precios:
+            rechazadas.append({"linea": i, "error": f"producto_id desconocido: {f['producto_id']}"})
+        elif f["cliente_id"] not in clientes:
+            rechazadas.append({"linea": i, "error": f"cliente_id desconocido: {f['cliente_id']}"})
+        else:
+            f.setdefault("precio_unitario", float(precios[f["producto_id"]] or 0.0))
+            f.setdefault("total", round(f["cantidad"] * f["precio_unitario"], 2))
+            validas.append(f)
+    rechazadas.sort(key=lambda r: r["linea"])
+    return validas, rechazadas
+
+
+# ---------- Escritura ----------
+def escribir(filas):
+    """Escribe un lote de ventas (sin commit), manteniendo el rollup, sketches y columnar."""
+    por_id = {f["id"]: f for f in filas}     # el último valor gana, como en el ETL
+    filas = list(por_id.values())
+    derivados.registrar(filas)
+    if rollups_listos():
+        rollups.aplicar_lote(filas)
+    stmt = upsert_stmt(Venta.__table__, filas[0].keys())
+    if stmt is not None:
+        db.session.execute(stmt, filas)
+    else:
+        existentes = set(db.session.execute(select(Venta.id).where(Venta.id.in_(list(por_id)))).scalars())
+        nuevas = [f for f in filas if f["id"] not in existentes]
+        viejas = [f for f in filas if f["id"] in existentes]
+        if nuevas:
+            db.session.execute(insert(Venta.__table__), nuevas)
+        if viejas:
+            db.session.execute(update(Venta), viejas)
+    columnar.marcar_obsoleto()
+    bump_data_version()
+
+
+class Ticket:
+    """Resultado de un POST: se completa cuando todas sus ventas se escribieron o fallaron."""
+
+    def __init__(self, n: int):
+        self.pendientes = n
+        self.escritas = 0
+        self.errores = []
+        self._lock = threading.Lock()
+        self._listo = threading.Event()
+
+    def _resolver(self, escritas: int, error: str | None = None, n: int | None = None):
+        with self._lock:
+            self.escritas += escritas
+            if error:
+                self.errores.append(error)
+            self.pendientes -= escritas if n is None else n
+            if self.pendientes <= 0:
+                self._listo.set()
+
+    def esperar(self, timeout: float) -> bool:
+        return self._listo.wait(timeout)
+
+
+class ColaIngesta:
+    """Cola acotada + hilo escritor que agrupa por tamaño o ventana de tiempo."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pendientes = []       # (empresa, fila, ticket, momento de encolado)
+        self._hilo = None
+        self._app = None
+        self._detener = False
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pendientes)
+
+    def encolar(self, app, tenant, filas) -> Ticket | None:
+        """Encola las filas; None si no caben (la cola está llena)."""
+        ticket = Ticket(len(filas))
+        ahora = time.monotonic()
+        with self._cond:
+            if len(self._pendientes) + len(filas) > app.config.get("INGESTA_COLA_MAX", 20_000):
+                return None
+            self._pendientes.extend((tenant, f, ticket, ahora) for f in filas)
+            self._app = app
+            self._detener = False
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._correr, name="ingesta", daemon=True)
+                self._hilo.start()
+            self._cond.notify()
+        return ticket
+
+    def _tomar(self):
+        """Espera un lote completo o la ventana; None si hay que terminar."""
+        with self._cond:
+            while not self._pendientes and not self._detener:
+                self._cond.wait()
+            if not self._pendientes:
+                return None
+            cfg = self._app.config
+            lote = cfg.get("INGESTA_LOTE", 500)
+            limite = time.monotonic() + cfg.get("INGESTA_VENTANA_MS", 250) / 1000.0
+            while len(self._pendientes) < lote and not self._detener:
+                resto = limite - time.monotonic()
+                if resto <= 0:
+                    break
+                self._cond.wait(resto)
+            tomadas = self._pendientes[:lote]
+            del self._pendientes[:lote]
+            return tomadas
+
+    def _correr(self):
+        while True:
+            tomadas = self._tomar()
+            if tomadas is None:
+                return
+            por_empresa = {}
+            for item in tomadas:
+                por_empresa.setdefault(item[0], []).append(item)
+            for tenant, items in por_empresa.items():
+                try:
+                    self._escribir(tenant, items)
+                except Exception:     # el hilo no puede morir: se registra y sigue
+                    log.exception("ingesta: fallo inesperado escribiendo %d ventas", len(items))
+                    for _, _, ticket, _ in items:
+                        ticket._resolver(0, "error interno", n=1)
+
+    def _escribir(self, tenant, items):
+        with self._app.app_context(), tenants.activar(tenant):
+            try:
+                escribir([f for _, f, _, _ in items])
+                db.session.commit()
+                fallidas = []
+                stream.avisar()
+            except Exception:
+                db.session.rollback()
+                log.warning("ingesta: lote de %d ventas rechazado; se reintenta una por una", len(items))
+                fallidas = self._una_por_una(items)
+            finally:
+                db.session.remove()
+
+        ahora = time.monotonic()
+        etiq = {"empresa": tenant or ""}
+        metricas.registro.sumar("insight_ingesta_ventas_total", {**etiq, "resultado": "escrita"},
+                                len(items) - len(fallidas))
+        if fallidas:
+            metricas.registro.sumar("insight_ingesta_ventas_total", {**etiq, "resultado": "fallida"},
+                                    len(fallidas))
+        metricas.registro.observar("insight_ingesta_lote_ventas", etiq, len(items), metricas.BUCKETS_CONSULTAS)
+        metricas.registro.observar("insight_ingesta_espera_segundos", etiq, ahora - min(t for *_, t in items))
+        fallidas = {id(x) for x in fallidas}
+        for item in items:
+            if id(item) not in fallidas:
+                item[2]._resolver(1)
+
+    @staticmethod
+    def _una_por_una(items):
+        """Aísla las ventas que rompen el lote (p. ej. un producto borrado entre medio)."""
+        fallidas = []
+        for item in items:
+            try:
+                escribir([item[1]])
+                db.session.commit()
+                stream.avisar()
+            except Exception as e:
+                db.session.rollback()
+                fallidas.append(item)
+                item[2]._resolver(0, f"venta {item[1]['id']}: {e.__class__.__name__}", n=1)
+        return fallidas
+
+    def drenar(self, timeout: float = 30.0):
+        """Escribe lo pendiente y detiene el hilo (al salir del proceso)."""
+        with self._cond:
+            self._detener = True
+            self._cond.notify_all()
+            hilo = self._hilo
+        if hilo is not None and hilo.is_alive():
+            hilo.join(timeout)
+
+
+cola = ColaIngesta()
+
+
+def _nueva_cola():
+    """El hilo escritor no sobrevive a un fork (app/servidor.py): cada worker arma su cola."""
+    global cola
+    cola = ColaIngesta()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_nueva_cola)
+
+
+def drenar(timeout: float = 30.0):
+    cola.drenar(timeout)
+
+
+atexit.register(drenar)
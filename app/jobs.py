@@ -0,0 +1,373 @@
+# app/jobs.py
+"""
+Trabajos pesados en segundo plano (segmentación, CLV, pronósticos, sketches).
+
+    POST /api/jobs/<tipo>   -> 202 con el job (o 200 con el que ya estaba en curso)
+    GET  /api/jobs/<id>     -> estado, progreso, resultado y tiempos
+
+- Cada job es una fila de `jobs`; sobrevive a reinicios y se consulta desde
+  cualquier worker. Dos pedidos idénticos (mismo tipo y parámetros) mientras
+  el primero no terminó devuelven el mismo job: la columna única `en_curso`
+  guarda tipo+parámetros hasta que termina.
+- Un hilo despachador por proceso toma los pendientes y corre cada uno en un
+  subproceso (`python -m app.jobs --correr ID`), así el cálculo no compite
+  por el GIL con los requests. Como máximo JOBS_MAX corriendo a la vez por
+  BD (se cuenta en la tabla al tomar uno, vale para todos los workers).
+- Un job que pasa JOBS_MAX_S corriendo se mata; uno cuyo proceso murió sin
+  cerrar su fila queda "fallido" la próxima vez que se pide un job.
+- Cada cálculo recibe `avance(fraccion, mensaje)`; el progreso se guarda en
+  la fila del job por una conexión aparte (a lo sumo cada JOBS_PROGRESO_S),
+  así GET /api/jobs/<id> lo ve mientras corre. Los cálculos lo llaman antes
+  de empezar a escribir: en SQLite, la conexión aparte esperaría el lock de
+  escritura de su propia transacción.
+- El ETL puede correrlos al terminar: `--jobs segmentacion,clv` o JOBS_TRAS_ETL.
+
+    python -m app.jobs segmentacion --completo    # a mano, en este proceso
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+from .models import db, Job
+from . import clv, metricas, pronosticos, segmentacion, sketches, tenants
+
+log = logging.getLogger("insight.jobs")
+
+PENDIENTE, CORRIENDO, TERMINADO, FALLIDO = "pendiente", "corriendo", "terminado", "fallido"
+EN_CURSO = (PENDIENTE, CORRIENDO)
+BUCKETS_JOBS = (1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+# ---------- Tipos ----------
+def _bool(valor) -> bool:
+    if isinstance(valor, bool):
+        return valor
+    if str(valor).lower() in ("1", "true", "yes"):
+        return True
+    if str(valor).lower() in ("0", "false", "no", ""):
+        return False
+    raise ValueError(f"se esperaba booleano: {valor!r}")
+
+
+def _entero(valor) -> int:
+    if isinstance(valor, bool):
+        raise ValueError(f"se esperaba entero: {valor!r}")
+    return int(valor)
+
+
+def _segmentacion(avance, completo=False):
+    return segmentacion.segmentar(completo=completo, avance=avance)
+
+
+def _clv(avance):
+    return {"clientes": clv.recalcular(avance=avance)}
+
+
+def _pronosticos(avance, workers=None):
+    return {"productos": pronosticos.recalcular(workers, avance=avance)}
+
+
+def _sketches(avance, completo=False):
+    return sketches.refrescar(completo=completo, avance=avance)
+
+
+# tipo -> (función, {parámetro: conversor})
+TIPOS = {
+    "segmentacion": (_segmentacion, {"completo": _bool}),
+    "clv": (_clv, {}),
+    "pronosticos": (_pronosticos, {"workers": _entero}),
+    "sketches": (_sketches, {"completo": _bool}),
+}
+
+
+def validar(tipo: str, parametros: dict) -> dict:
+    """Parámetros del body -> kwargs de la función del tipo (ValueError si no sirven)."""
+    _, conversores = TIPOS[tipo]
+    desconocidos = sorted(set(parametros) - set(conversores))
+    if desconocidos:
+        raise ValueError(f"parámetro desconocido para {tipo}: {desconocidos[0]}")
+    try:
+        return {k: conversores[k](v) for k, v in parametros.items() if v is not None}
+    except (TypeError, ValueError) as e:
+        raise ValueError(str(e)) from None
+
+
+# ---------- Tabla ----------
+def a_dict(job: Job) -> dict:
+    fin = job.terminado or (datetime.now() if job.iniciado else None)
+    return {
+        "id": job.id,
+        "tipo": job.tipo,
+        "parametros": json.loads(job.parametros or "{}"),
+        "estado": job.estado,
+        "progreso": job.progreso,
+        "mensaje": job.mensaje,
+        "resultado": json.loads(job.resultado) if job.resultado else None,
+        "error": job.error,
+        "creado": job.creado.isoformat(),
+        "iniciado": job.iniciado.isoformat() if job.iniciado else None,
+        "terminado": job.terminado.isoformat() if job.terminado else None,
+        "espera_s": round(((job.iniciado or datetime.now()) - job.creado).total_seconds(), 3),
+        "duracion_s": round((fin - job.iniciado).total_seconds(), 3) if job.iniciado else None,
+    }
+
+
+def _cerrar(job: Job, estado: str, **campos):
+    job.estado = estado
+    job.en_curso = None
+    job.terminado = datetime.now()
+    for k, v in campos.items():
+        setattr(job, k, v)
+
+
+def _vivo(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def liberar_abandonados():
+    """
+    Cierra como fallidos los jobs cuyo proceso ya no existe o que superaron
+    JOBS_MAX_S sin terminar (p. ej. se cayó el servidor): liberan su `en_curso`.
+    """
+    limite = current_app.config.get("JOBS_MAX_S", 3600)
+    ahora = datetime.now()
+    cambios = False
+    for job in db.session.execute(select(Job).where(Job.estado.in_(EN_CURSO))).scalars():
+        if job.estado == CORRIENDO and job.pid and not _vivo(job.pid):
+            _cerrar(job, FALLIDO, error="el proceso del job terminó sin registrar el resultado")
+            cambios = True
+        elif (ahora - (job.iniciado or job.creado)).total_seconds() > limite:
+            _cerrar(job, FALLIDO, error=f"abandonado: más de {limite:g}s sin terminar")
+            cambios = True
+    if cambios:
+        db.session.commit()
+
+
+def solicitar(tipo: str, parametros: dict) -> tuple[Job, bool]:
+    """Crea el job (pendiente) o devuelve el idéntico que sigue en curso: (job, nuevo)."""
+    clave = f"{tipo}:{json.dumps(parametros, sort_keys=True)}"
+    liberar_abandonados()
+    for _ in range(3):
+        existente = db.session.execute(select(Job).where(Job.en_curso == clave)).scalar_one_or_none()
+        if existente is not None:
+            return existente, False
+        job = Job(id=uuid.uuid4().hex, tipo=tipo, parametros=json.dumps(parametros), estado=PENDIENTE,
+                  en_curso=clave, progreso=0.0, creado=datetime.now())
+        db.session.add(job)
+        try:
+            db.session.commit()
+            return job, True
+        except IntegrityError:          # otro worker lo creó entre medio
+            db.session.rollback()
+    raise RuntimeError(f"no se pudo registrar el job {clave}")
+
+
+def tomar(job_id: str | None = None, respetar_cupo: bool = True) -> str | None:
+    """
+    Pasa a "corriendo" el job indicado (o el pendiente más antiguo) si sigue
+    pendiente y hay cupo (menos de JOBS_MAX corriendo). Devuelve su id o None.
+    El UPDATE condicional es atómico: dos workers no toman el mismo job.
+    """
+    if job_id is None:
+        job_id = db.session.execute(
+            select(Job.id).where(Job.estado == PENDIENTE).order_by(Job.creado).limit(1)
+        ).scalar()
+        if job_id is None:
+            return None
+    stmt = update(Job).where(Job.id == job_id, Job.estado == PENDIENTE)
+    if respetar_cupo:
+        corriendo = select(func.count()).select_from(Job).where(Job.estado == CORRIENDO).scalar_subquery()
+        stmt = stmt.where(corriendo < current_app.config.get("JOBS_MAX", 2))
+    res = db.session.execute(stmt.values(estado=CORRIENDO, iniciado=datetime.now(), mensaje="iniciando"))
+    db.session.commit()
+    return job_id if res.rowcount == 1 else None
+
+
+def _avance(job_id: str):
+    """
+    Callback de progreso de un job: escribe progreso y mensaje en su fila por
+    una conexión aparte (la sesión del cálculo no se confirma a medias), a lo
+    sumo cada JOBS_PROGRESO_S. Un fallo al escribirlo no corta el job.
+    """
+    intervalo = current_app.config.get("JOBS_PROGRESO_S", 1.0)
+    ultimo = [float("-inf")]
+
+    def avance(fraccion: float, mensaje: str):
+        ahora = time.monotonic()
+        if ahora - ultimo[0] < intervalo:
+            return
+        ultimo[0] = ahora
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(update(Job).where(Job.id == job_id, Job.estado == CORRIENDO)
+                             .values(progreso=round(min(max(fraccion, 0.0), 1.0), 3), mensaje=mensaje[:200]))
+        except DBAPIError:
+            log.warning("job %s: no se pudo guardar el progreso", job_id, exc_info=True)
+
+    return avance
+
+
+def correr(job_id: str) -> Job:
+    """Ejecuta un job ya tomado en este proceso y guarda resultado o error."""
+    job = db.session.get(Job, job_id)
+    funcion, _ = TIPOS[job.tipo]
+    job.pid = os.getpid()
+    job.mensaje = "calculando"
+    db.session.commit()
+
+    t0 = time.perf_counter()
+    try:
+        resultado = funcion(_avance(job_id), **json.loads(job.parametros or "{}"))
+    except Exception as e:
+        db.session.rollback()
+        log.exception("job %s (%s) falló", job_id, job.tipo)
+        job = db.session.get(Job, job_id)
+        _cerrar(job, FALLIDO, error=f"{e.__class__.__name__}: {e}", mensaje=None)
+    else:
+        job = db.session.get(Job, job_id)
+        _cerrar(job, TERMINADO, progreso=1.0, mensaje=f"listo en {time.perf_counter() - t0:.2f}s",
+                resultado=json.dumps(resultado, default=str))
+    db.session.commit()
+    return job
+
+
+# ---------- Despachador ----------
+class Despachador:
+    """Hilo que toma jobs pendientes y los corre en subprocesos."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._empresas = set()          # empresas con posibles pendientes
+        self._procesos = {}             # job_id -> (Popen, empresa, tipo, inicio)
+        self._hilo = None
+        self._app = None
+
+    def avisar(self, app, tenant):
+        """Hay (o puede haber) pendientes en la BD de `tenant`."""
+        with self._cond:
+            self._app = app
+            self._empresas.add(tenant)
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._correr, name="jobs", daemon=True)
+                self._hilo.start()
+            self._cond.notify()
+
+    def _correr(self):
+        while True:
+            with self._cond:
+                self._cond.wait(self._app.config.get("JOBS_INTERVALO_S", 1.0))
+                empresas = list(self._empresas)
+            try:
+                self._revisar_procesos()
+                for tenant in empresas:
+                    self._lanzar_pendientes(tenant)
+            except Exception:          # el hilo no puede morir: se registra y sigue
+                log.exception("jobs: fallo del despachador")
+
+    def _lanzar_pendientes(self, tenant):
+        with self._app.app_context(), tenants.activar(tenant):
+            try:
+                while (job_id := tomar()) is not None:
+                    tipo = db.session.get(Job, job_id).tipo
+                    self._procesos[job_id] = (self._lanzar(job_id, tenant), tenant, tipo, time.monotonic())
+                quedan = db.session.execute(
+                    select(func.count()).select_from(Job).where(Job.estado == PENDIENTE)).scalar()
+            finally:
+                db.session.remove()
+        if not quedan:
+            with self._cond:
+                self._empresas.discard(tenant)
+
+    def _lanzar(self, job_id, tenant):
+        cfg = self._app.config
+        raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, DATABASE_URL=cfg["SQLALCHEMY_DATABASE_URI"], TENANT_DIR=cfg["TENANT_DIR"])
+        env["PYTHONPATH"] = os.pathsep.join(p for p in (raiz, env.get("PYTHONPATH")) if p)
+        cmd = [sys.executable, "-m", "app.jobs", "--correr", job_id]
+        if tenant:
+            cmd += ["--tenant", tenant]
+        log.info("job %s: lanzado", job_id)
+        return subprocess.Popen(cmd, env=env, cwd=raiz)
+
+    def _revisar_procesos(self):
+        limite = self._app.config.get("JOBS_MAX_S", 3600)
+        for job_id, (proc, tenant, tipo, inicio) in list(self._procesos.items()):
+            codigo = proc.poll()
+            if codigo is None:
+                if time.monotonic() - inicio > limite:
+                    log.warning("job %s: más de %gs, se termina", job_id, limite)
+                    proc.kill()
+                continue
+            del self._procesos[job_id]
+            with self._app.app_context(), tenants.activar(tenant):
+                try:
+                    job = db.session.get(Job, job_id)
+                    if job.estado in EN_CURSO:      # el subproceso murió sin cerrar su fila
+                        _cerrar(job, FALLIDO, error=f"el proceso del job terminó con código {codigo}")
+                        db.session.commit()
+                    etiq = {"tipo": tipo, "empresa": tenant or ""}
+                    metricas.registro.sumar("insight_jobs_total", {**etiq, "resultado": job.estado})
+                    metricas.registro.observar("insight_jobs_segundos", etiq, time.monotonic() - inicio,
+                                               BUCKETS_JOBS)
+                finally:
+                    db.session.remove()
+
+
+despachador = Despachador()
+
+
+def _nuevo_despachador():
+    """El hilo no sobrevive a un fork (app/servidor.py): cada worker arma el suyo."""
+    global despachador
+    despachador = Despachador()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_nuevo_despachador)
+
+
+def main():
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Corre un job de analítica")
+    parser.add_argument("tipo", nargs="?", choices=sorted(TIPOS))
+    parser.add_argument("--completo", action="store_true", help="segmentacion/sketches: recalcular todo")
+    parser.add_argument("--correr", metavar="ID", help="ejecuta un job ya registrado (lo usa el despachador)")
+    parser.add_argument("--tenant", default=None)
+    args = parser.parse_args()
+    if not args.tipo and not args.correr:
+        parser.error("indicar un tipo o --correr ID")
+
+    app = create_app()
+    with app.app_context(), tenants.activar(args.tenant):
+        if args.correr:
+            return 0 if correr(args.correr).estado == TERMINADO else 1
+        parametros = {"completo": True} if args.completo and "completo" in TIPOS[args.tipo][1] else {}
+        job, nuevo = solicitar(args.tipo, parametros)
+        if not nuevo or not tomar(job.id, respetar_cupo=False):
+            print(f"Ya hay un job {args.tipo} en curso: {job.id} ({job.estado})")
+            return 1
+        job = correr(job.id)
+        print(json.dumps(a_dict(job), ensure_ascii=False, indent=2))
+        return 0 if job.estado == TERMINADO else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
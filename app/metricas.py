@@ -0,0 +1,272 @@
+# app/metricas.py
+"""
+Instrumentación en proceso: latencia por endpoint, SQL por request, objetos
+ORM materializados, consultas lentas y tiempos por fase del ETL.
+
+- Hooks en el blueprint `main` (instalar) miden cada request; los eventos
+  del Engine (todos los engines, también los de cada empresa) suman nº y
+  tiempo de sentencias SQL a la medición del request en curso.
+- La medición vive en una ContextVar, así los paneles de /api/dashboard
+  (hilos con copy_context) suman al mismo request.
+- `exportar()` devuelve el registro en formato de texto de Prometheus
+  (/api/metrics). Con METRICAS_SERVER_TIMING=1 cada respuesta lleva además
+  el header Server-Timing.
+- Consultas que tardan METRICAS_SQL_LENTA_MS o más se registran en el
+  logger "insight.sql".
+
+Los valores son por proceso: con varios workers, cada uno expone los suyos.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log_sql = logging.getLogger("insight.sql")
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+AYUDA = {
+    "insight_http_request_duration_seconds": ("histogram", "Latencia de los requests por endpoint"),
+    "insight_http_requests_total": ("counter", "Requests por endpoint y código de estado"),
+    "insight_sql_consultas_por_request": ("histogram", "Sentencias SQL por request"),
+    "insight_sql_consultas_total": ("counter", "Sentencias SQL ejecutadas"),
+    "insight_sql_segundos_total": ("counter", "Tiempo total en sentencias SQL"),
+    "insight_sql_lentas_total": ("counter", "Sentencias SQL por encima del umbral de lentitud"),
+    "insight_orm_objetos_total": ("counter", "Objetos ORM materializados"),
+    "insight_etl_fase_segundos_total": ("counter", "Tiempo del ETL por tabla y fase"),
+    "insight_etl_filas_total": ("counter", "Filas escritas por el ETL"),
+    "insight_ingesta_ventas_total": ("counter", "Ventas de /api/ventas/batch escritas o fallidas"),
+    "insight_ingesta_lote_ventas": ("histogram", "Ventas por transacción del escritor de ingesta"),
+    "insight_ingesta_espera_segundos": ("histogram", "Espera en cola hasta el commit (la más antigua del lote)"),
+    "insight_ingesta_rechazos_total": ("counter", "POST de ingesta rechazados por cola llena"),
+    "insight_jobs_total": ("counter", "Jobs en segundo plano terminados por tipo y resultado"),
+    "insight_jobs_segundos": ("histogram", "Duración de los jobs en segundo plano (proceso incluido)"),
+}
+
+
+# ---------- Registro ----------
+class Registro:
+    """Contadores e histogramas con etiquetas, protegidos por un lock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = defaultdict(float)      # (nombre, etiquetas) -> valor
+        self._histogramas = {}                     # (nombre, etiquetas) -> [buckets, conteos, suma, n]
+
+    def sumar(self, nombre, etiquetas: dict, valor: float = 1.0):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] += valor
+
+    def observar(self, nombre, etiquetas: dict, valor: float, buckets=BUCKETS_SEGUNDOS):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            h = self._histogramas.get(clave)
+            if h is None:
+                h = self._histogramas[clave] = [buckets, [0] * len(buckets), 0.0, 0]
+            for i, limite in enumerate(buckets):
+                if valor <= limite:
+                    h[1][i] += 1
+            h[2] += valor
+            h[3] += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._contadores.clear()
+            self._histogramas.clear()
+
+    def exportar(self) -> str:
+        """Formato de texto de Prometheus (version 0.0.4)."""
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            histogramas = sorted((k, (b, list(c), s, n)) for k, (b, c, s, n) in self._histogramas.items())
+
+        lineas, vistos = [], set()
+
+        def cabecera(nombre):
+            if nombre not in vistos:
+                vistos.add(nombre)
+                tipo, ayuda = AYUDA.get(nombre, ("untyped", nombre))
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+
+        for (nombre, etiquetas), valor in contadores:
+            cabecera(nombre)
+            lineas.append(f"{nombre}{_etiquetas(etiquetas)} {valor:g}")
+        for (nombre, etiquetas), (buckets, conteos, suma, n) in histogramas:
+            cabecera(nombre)
+            for limite, c in zip(buckets, conteos):
+                lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas + (('le', f'{limite:g}'),))} {c}")
+            lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas + (('le', '+Inf'),))} {n}")
+            lineas.append(f"{nombre}_sum{_etiquetas(etiquetas)} {suma:g}")
+            lineas.append(f"{nombre}_count{_etiquetas(etiquetas)} {n}")
+        return "\n".join(lineas) + "\n"
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(pares) -> str:
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+registro = Registro()
+
+
+def exportar() -> str:
+    return registro.exportar()
+
+
+# ---------- Medición del request en curso ----------
+class Medicion:
+    """Acumulados de un request (pueden sumar varios hilos)."""
+
+    __slots__ = ("inicio", "consultas", "sql_s", "objetos", "lentas", "_lock")
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.sql_s = 0.0
+        self.objetos = 0
+        self.lentas = 0
+        self._lock = threading.Lock()
+
+    def objeto(self):
+        with self._lock:
+            self.objetos += 1
+
+    def sql(self, segundos, lenta):
+        with self._lock:
+            self.consultas += 1
+            self.sql_s += segundos
+            self.lentas += lenta
+
+
+_medicion = contextvars.ContextVar("medicion", default=None)
+_umbral_lento_s = [0.2]
+
+
+# ---------- Eventos de SQLAlchemy ----------
+def _antes_sql(conn, cursor, statement, params, context, executemany):
+    conn.info.setdefault("metricas_t0", []).append(time.perf_counter())
+
+
+def _despues_sql(conn, cursor, statement, params, context, executemany):
+    pila = conn.info.get("metricas_t0")
+    if not pila:
+        return
+    seg = time.perf_counter() - pila.pop()
+    lenta = seg >= _umbral_lento_s[0]
+    m = _medicion.get()
+    if m is not None:
+        m.sql(seg, lenta)
+    if lenta:
+        log_sql.warning("SQL lenta (%.1f ms)%s: %s", seg * 1000.0,
+                        f" en {request.endpoint}" if has_request_context() else "",
+                        " ".join(statement.split())[:500])
+
+
+def _al_cargar(target, context):
+    m = _medicion.get()
+    if m is not None:
+        m.objeto()
+
+
+def _instalar_eventos(modelo_base):
+    """Listeners globales (idempotente)."""
+    if not event.contains(Engine, "before_cursor_execute", _antes_sql):
+        event.listen(Engine, "before_cursor_execute", _antes_sql)
+        event.listen(Engine, "after_cursor_execute", _despues_sql)
+        event.listen(modelo_base, "load", _al_cargar, propagate=True)
+
+
+# ---------- Hooks del blueprint ----------
+def _antes():
+    g.metricas_token = _medicion.set(Medicion())
+
+
+def _despues(resp):
+    m = _medicion.get()
+    if m is None:
+        return resp
+    total = time.perf_counter() - m.inicio
+    endpoint = request.endpoint or "sin_ruta"
+    etiq = {"endpoint": endpoint, "metodo": request.method}
+
+    registro.observar("insight_http_request_duration_seconds", etiq, total)
+    registro.sumar("insight_http_requests_total", {**etiq, "estado": resp.status_code})
+    registro.observar("insight_sql_consultas_por_request", {"endpoint": endpoint}, m.consultas,
+                      BUCKETS_CONSULTAS)
+    registro.sumar("insight_sql_consultas_total", {"endpoint": endpoint}, m.consultas)
+    registro.sumar("insight_sql_segundos_total", {"endpoint": endpoint}, m.sql_s)
+    registro.sumar("insight_orm_objetos_total", {"endpoint": endpoint}, m.objetos)
+    if m.lentas:
+        registro.sumar("insight_sql_lentas_total", {"endpoint": endpoint}, m.lentas)
+
+    if current_app.config.get("METRICAS_SERVER_TIMING"):
+        resp.headers["Server-Timing"] = (
+            f'app;dur={total * 1000.0:.2f}, '
+            f'sql;dur={m.sql_s * 1000.0:.2f};desc="{m.consultas} consultas"'
+        )
+    return resp
+
+
+def _al_terminar(_exc):
+    token = g.pop("metricas_token", None)
+    if token is not None:
+        _medicion.reset(token)
+
+
+def instalar(bp, modelo_base):
+    """
+    Registra los hooks en el blueprint (llamar antes que los de caché HTTP,
+    así la latencia incluye los 304 y el gzip) y los eventos de SQLAlchemy.
+    """
+    _instalar_eventos(modelo_base)
+    bp.before_request(_antes)
+    bp.after_request(_despues)
+    bp.teardown_request(_al_terminar)
+
+    @bp.record_once
+    def _config(state):
+        _umbral_lento_s[0] = state.app.config.get("METRICAS_SQL_LENTA_MS", 200) / 1000.0
+
+
+# ---------- ETL ----------
+class Fases:
+    """Acumula segundos por fase del ETL y los vuelca al registro."""
+
+    def __init__(self, tabla: str):
+        self.tabla = tabla
+        self.segundos = defaultdict(float)
+
+    def medir(self, fase: str):
+        return _Cronometro(self, fase)
+
+    def sumar(self, fase: str, segundos: float):
+        self.segundos[fase] += segundos
+        registro.sumar("insight_etl_fase_segundos_total", {"tabla": self.tabla, "fase": fase}, segundos)
+
+
+class _Cronometro:
+    __slots__ = ("fases", "fase", "t0")
+
+    def __init__(self, fases, fase):
+        self.fases, self.fase = fases, fase
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.fases.sumar(self.fase, time.perf_counter() - self.t0)
+        return False
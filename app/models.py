@@ -1,7 +1,7 @@
 # app/models.py
-from flask_sqlalchemy import SQLAlchemy
+from .tenants import SQLAlchemyTenants
 
-db = SQLAlchemy()
+db = SQLAlchemyTenants()   # SQLAlchemy de Flask; con MULTI_TENANT usa la BD de cada empresa
 
 class Cliente(db.Model):
     __tablename__ = "clientes"
@@ -22,6 +22,13 @@ class Producto(db.Model):
 
 class Venta(db.Model):
     __tablename__ = "ventas"
+    __table_args__ = (
+        # rango por fecha con todo lo que agregan KPIs/gráficas/top (índice cubriente)
+        db.Index("ix_ventas_fecha_cubre", "fecha", "producto_id", "cliente_id", "total", "cantidad"),
+        # historial por cliente (segmentación, CLV) y por producto (demanda)
+        db.Index("ix_ventas_cliente_fecha", "cliente_id", "fecha"),
+        db.Index("ix_ventas_producto_fecha", "producto_id", "fecha"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     cliente_id = db.Column(db.Integer, db.ForeignKey("clientes.id"), nullable=False)
     producto_id = db.Column(db.Integer, db.ForeignKey("productos.id"), nullable=False)
@@ -29,3 +36,108 @@ class Venta(db.Model):
     cantidad = db.Column(db.Integer, default=0)
     precio_unitario = db.Column(db.Float, default=0.0)
     total = db.Column(db.Float, default=0.0)
+
+class EtlEstado(db.Model):
+    """Huella y avance de cada CSV cargado por el ETL (cargas incrementales)."""
+    __tablename__ = "etl_estado"
+    archivo = db.Column(db.String(500), primary_key=True)   # ruta absoluta
+    tabla = db.Column(db.String(40), nullable=False)
+    tamano = db.Column(db.BigInteger, default=0)
+    mtime = db.Column(db.Float)
+    hash = db.Column(db.String(64))                         # sha256 de los bytes [0, offset)
+    offset = db.Column(db.BigInteger, default=0)            # fin del último lote confirmado
+    lineas = db.Column(db.Integer, default=1)               # líneas consumidas hasta offset
+    max_id = db.Column(db.Integer)                          # marcas de agua
+    max_fecha = db.Column(db.DateTime)
+    completo = db.Column(db.Boolean, default=False)
+    actualizado = db.Column(db.DateTime)
+
+class VentaRollup(db.Model):
+    """Ventas pre-agregadas por día × hora × producto (las mantiene el ETL)."""
+    __tablename__ = "ventas_rollup"
+    fecha = db.Column(db.Date, primary_key=True)
+    hora = db.Column(db.Integer, primary_key=True)
+    producto_id = db.Column(db.Integer, primary_key=True)
+    total = db.Column(db.Float, default=0.0)
+    cantidad = db.Column(db.Integer, default=0)
+    n = db.Column(db.Integer, default=0)                    # número de ventas
+
+class Metadato(db.Model):
+    """Pares clave/valor internos (banderas de mantenimiento, versiones)."""
+    __tablename__ = "metadatos"
+    clave = db.Column(db.String(60), primary_key=True)
+    valor = db.Column(db.String(200))
+
+class SegmentoCliente(db.Model):
+    """Agregados RFM y segmento vigente de cada cliente (ver app/segmentacion.py)."""
+    __tablename__ = "segmentos_clientes"
+    cliente_id = db.Column(db.Integer, db.ForeignKey("clientes.id"), primary_key=True)
+    ultima_compra = db.Column(db.DateTime)
+    frecuencia = db.Column(db.Integer, default=0)
+    monto = db.Column(db.Float, default=0.0)
+    segmento = db.Column(db.String(20), index=True)
+    actualizado = db.Column(db.DateTime)
+
+class ClvCliente(db.Model):
+    """CLV estimado por cliente, recalculado en lote (ver app/clv.py)."""
+    __tablename__ = "clv_clientes"
+    cliente_id = db.Column(db.Integer, db.ForeignKey("clientes.id"), primary_key=True)
+    compras = db.Column(db.Integer, default=0)
+    total = db.Column(db.Float, default=0.0)
+    primera_compra = db.Column(db.DateTime)
+    ultima_compra = db.Column(db.DateTime)
+    clv = db.Column(db.Float, default=0.0, index=True)
+    actualizado = db.Column(db.DateTime)
+
+class PronosticoDemanda(db.Model):
+    """Pronóstico por producto y horizonte (días desde el último día con datos)."""
+    __tablename__ = "pronosticos_demanda"
+    producto_id = db.Column(db.Integer, db.ForeignKey("productos.id"), primary_key=True)
+    horizonte = db.Column(db.Integer, primary_key=True)
+    demanda_dia = db.Column(db.Float, default=0.0)
+    demanda_acumulada = db.Column(db.Float, default=0.0)
+    generado = db.Column(db.DateTime)
+
+class SketchDia(db.Model):
+    """Resumen de un día para el modo aproximado: sumas, HLL de clientes y top-K (ver app/sketches.py)."""
+    __tablename__ = "sketches_dia"
+    fecha = db.Column(db.Date, primary_key=True)
+    total = db.Column(db.Float, default=0.0)
+    cantidad = db.Column(db.Integer, default=0)
+    n = db.Column(db.Integer, default=0)
+    clientes = db.Column(db.LargeBinary)                    # HLL disperso: uint32 (registro << 8 | rho)
+    top = db.Column(db.LargeBinary)                         # K productos de mayor ingreso del día
+    top_error = db.Column(db.Float, default=0.0)            # ingreso del primero que quedó afuera
+
+class Job(db.Model):
+    """Trabajo pesado en segundo plano con su estado y tiempos (ver app/jobs.py)."""
+    __tablename__ = "jobs"
+    id = db.Column(db.String(32), primary_key=True)
+    tipo = db.Column(db.String(40), nullable=False)
+    parametros = db.Column(db.Text, default="{}")           # JSON
+    estado = db.Column(db.String(20), nullable=False, index=True)   # pendiente/corriendo/terminado/fallido
+    en_curso = db.Column(db.String(200), unique=True)       # tipo+parámetros mientras no termina (deduplica)
+    progreso = db.Column(db.Float, default=0.0)
+    mensaje = db.Column(db.String(200))
+    resultado = db.Column(db.Text)                          # JSON
+    error = db.Column(db.Text)
+    pid = db.Column(db.Integer)
+    creado = db.Column(db.DateTime, nullable=False)
+    iniciado = db.Column(db.DateTime)
+    terminado = db.Column(db.DateTime)
+
+
+class ParticionVentas(db.Model):
+    """Mes cerrado de ventas guardado en su propia tabla (ver app/particiones.py)."""
+    __tablename__ = "ventas_particiones"
+    mes = db.Column(db.String(7), primary_key=True)        # AAAA-MM
+    tabla = db.Column(db.String(40), nullable=False)
+    desde = db.Column(db.DateTime, nullable=False)         # [desde, hasta)
+    hasta = db.Column(db.DateTime, nullable=False)
+    filas = db.Column(db.Integer, default=0)
+    min_id = db.Column(db.Integer)
+    max_id = db.Column(db.Integer)
+    fecha_min = db.Column(db.DateTime)
+    fecha_max = db.Column(db.DateTime)
+    cerrada = db.Column(db.DateTime)
+    compactada = db.Column(db.DateTime)                    # None: escrita desde la última compactación
@@ -0,0 +1,416 @@
+# app/particiones.py
+"""
+Particiones mensuales de ventas (SQLite).
+
+`ventas` guarda solo los meses abiertos; cada mes cerrado pasa a su propia
+tabla `ventas_AAAA_MM` (mismas columnas e índices), registrada en
+`ventas_particiones` con su rango de fechas e ids. Los meses se cierran en
+orden, así todo lo cerrado es anterior al `corte` y `ventas` no tiene filas
+anteriores a él.
+
+- Lectura: `ventas(desde, hasta_excl)` devuelve la entidad a consultar, que
+  se usa igual que `Venta` (V.fecha, V.total…): `Venta` si el rango no toca
+  meses cerrados (el tablero: últimos 30–90 días), o un UNION ALL de solo las
+  tablas que se solapan, con el filtro de rango dentro de cada rama.
+- Escritura: el ETL reparte cada lote por fecha (`enrutar`). La ingesta en
+  vivo rechaza ventas de meses cerrados.
+- Un mes cerrado es de solo lectura (triggers que abortan INSERT/UPDATE/
+  DELETE); solo `enrutar` los suspende, y si agregó o quitó filas deja la
+  partición marcada para compactar: reescribirla sin huecos (tabla e
+  índices densos, páginas contiguas).
+- Con PARTICIONES_MESES_ABIERTOS = N (> 0) el ETL cierra al terminar todo lo
+  anterior a los últimos N meses calendario y compacta lo que escribió.
+
+    python -m app.particiones estado
+    python -m app.particiones cerrar [--meses-abiertos N]
+    python -m app.particiones compactar [--todas] [--vacuum]
+"""
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy import func, select, insert, delete, text
+from sqlalchemy.orm import aliased
+
+from .models import db, Venta, ParticionVentas
+from .cache import bump_data_version, data_version
+from .storage import upsert_stmt
+
+COLUMNAS = [c.name for c in Venta.__table__.columns]
+OPERACIONES = ("insert", "update", "delete")
+
+_meta = sa.MetaData()          # fuera de db.metadata: create_all no las toca
+_lock = threading.Lock()
+_catalogos = {}                # url del engine -> (data_version, particiones)
+
+
+# ---------- Meses y tablas ----------
+def mes_de(dt: datetime) -> str:
+    return f"{dt.year:04d}-{dt.month:02d}"
+
+
+def inicio_mes(mes: str) -> datetime:
+    return datetime(int(mes[:4]), int(mes[5:7]), 1)
+
+
+def mes_siguiente(mes: str) -> str:
+    a, m = int(mes[:4]), int(mes[5:7])
+    return f"{a + m // 12:04d}-{m % 12 + 1:02d}"
+
+
+def nombre_tabla(mes: str) -> str:
+    return "ventas_" + mes.replace("-", "_")
+
+
+def _definir(nombre: str, meta: sa.MetaData, indices: bool = True) -> sa.Table:
+    """Tabla con las columnas de `ventas` y, si se pide, sus índices (renombrados)."""
+    cols = [sa.Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+            for c in Venta.__table__.columns]
+    idx = [sa.Index(i.name.replace("ix_ventas", f"ix_{nombre}", 1), *[c.name for c in i.columns])
+           for i in Venta.__table__.indexes] if indices else []
+    return sa.Table(nombre, meta, *cols, *idx)
+
+
+def tabla(nombre: str) -> sa.Table:
+    with _lock:
+        return _meta.tables.get(nombre) if nombre in _meta.tables else _definir(nombre, _meta)
+
+
+def _solo_sqlite():
+    if db.engine.dialect.name != "sqlite":
+        raise RuntimeError("Las particiones de ventas son para SQLite (en Postgres: particionado declarativo).")
+
+
+# ---------- Catálogo ----------
+def catalogo():
+    """Particiones (filas de ventas_particiones) ordenadas por fecha; memo por versión de datos."""
+    clave = str(db.engine.url)
+    version = data_version()
+    memo = _catalogos.get(clave)
+    if memo is not None and memo[0] == version:
+        return memo[1]
+    filas = tuple(db.session.execute(select(
+        ParticionVentas.mes, ParticionVentas.tabla, ParticionVentas.desde, ParticionVentas.hasta,
+        ParticionVentas.filas, ParticionVentas.min_id, ParticionVentas.max_id,
+        ParticionVentas.fecha_min, ParticionVentas.fecha_max, ParticionVentas.compactada,
+    ).order_by(ParticionVentas.desde)).all())
+    _catalogos[clave] = (version, filas)
+    return filas
+
+
+def corte() -> datetime | None:
+    """Inicio del primer mes abierto: `ventas` no tiene filas anteriores (None si no hay particiones)."""
+    cat = catalogo()
+    return cat[-1].hasta if cat else None
+
+
+def _solapa(p, desde, hasta_excl, ids):
+    if hasta_excl is not None and p.desde >= hasta_excl:
+        return False
+    if desde is not None and p.hasta <= desde:
+        return False
+    if ids is not None:
+        lo, hi = ids
+        if p.min_id is None or (lo is not None and p.max_id < lo) or (hi is not None and p.min_id > hi):
+            return False
+    return True
+
+
+def _filtrar(stmt, t, desde, hasta_excl, ids):
+    if desde is not None:
+        stmt = stmt.where(t.c.fecha >= desde)
+    if hasta_excl is not None:
+        stmt = stmt.where(t.c.fecha < hasta_excl)
+    if ids is not None:
+        if ids[0] is not None:
+            stmt = stmt.where(t.c.id >= ids[0])
+        if ids[1] is not None:
+            stmt = stmt.where(t.c.id <= ids[1])
+    return stmt
+
+
+def _tablas(desde=None, hasta_excl=None, ids=None):
+    """Tablas que pueden tener ventas en el rango, de la más nueva a la más vieja."""
+    cat = catalogo()
+    c = cat[-1].hasta if cat else None
+    res = [Venta.__table__] if c is None or hasta_excl is None or hasta_excl > c else []
+    res += [tabla(p.tabla) for p in reversed(cat) if _solapa(p, desde, hasta_excl, ids)]
+    return res
+
+
+# ---------- Lectura ----------
+def ventas(desde: datetime | None = None, hasta_excl: datetime | None = None, ids=None):
+    """
+    Entidad para consultar las ventas de [desde, hasta_excl) (ids = (mínimo,
+    máximo) inclusive, cualquiera None). `Venta` si alcanza con los meses
+    abiertos; si no, UNION ALL de las tablas que se solapan con el rango.
+    """
+    tablas = _tablas(desde, hasta_excl, ids)
+    if tablas == [Venta.__table__]:
+        return Venta
+    selects = [_filtrar(select(*[t.c[c] for c in COLUMNAS]), t, desde, hasta_excl, ids) for t in tablas]
+    if not selects:     # rango anterior a todo: una rama vacía de ventas
+        selects = [select(*Venta.__table__.c).where(sa.false())]
+    union = selects[0] if len(selects) == 1 else sa.union_all(*selects)
+    # nombre propio: en EXPLAIN, "SCAN ventas_union" es la co-rutina, no la tabla
+    return aliased(Venta, union.subquery("ventas_union"), adapt_on_names=True)
+
+
+def ramas(desde: datetime | None = None, hasta_excl: datetime | None = None):
+    """
+    Una entidad por tabla, de la más nueva a la más vieja (meses disjuntos):
+    para recorrer en orden de fecha descendente sin ordenar el UNION entero.
+    """
+    return [Venta if t is Venta.__table__ else aliased(Venta, t, adapt_on_names=True)
+            for t in _tablas(desde, hasta_excl)]
+
+
+def max_id() -> int:
+    """Mayor id de venta en todas las tablas (el de las particiones sale del catálogo)."""
+    abierto = db.session.query(func.max(Venta.id)).scalar() or 0
+    return max([abierto] + [p.max_id or 0 for p in catalogo()])
+
+
+def rango_fechas():
+    """(primera, última) fecha de venta en todas las tablas."""
+    fechas = [f for f in db.session.query(func.min(Venta.fecha), func.max(Venta.fecha)).one() if f]
+    for p in catalogo():
+        fechas += [f for f in (p.fecha_min, p.fecha_max) if f]
+    return (min(fechas), max(fechas)) if fechas else (None, None)
+
+
+def contar() -> int:
+    return (db.session.query(func.count(Venta.id)).scalar() or 0) + sum(p.filas or 0 for p in catalogo())
+
+
+def ids_cerrados(ids) -> set:
+    """Ids (de los dados) que ya están en un mes cerrado."""
+    ids = list(ids)
+    if not ids or not catalogo():
+        return set()
+    encontrados = set()
+    for p in catalogo():
+        if _solapa(p, None, None, (min(ids), max(ids))):
+            t = tabla(p.tabla)
+            encontrados |= set(db.session.execute(select(t.c.id).where(t.c.id.in_(ids))).scalars())
+    return encontrados
+
+
+# ---------- Escritura ----------
+def _triggers(nombre: str, crear: bool):
+    for op in OPERACIONES:
+        trig = f"{nombre}_solo_lectura_{op}"
+        if crear:
+            db.session.execute(text(
+                f'CREATE TRIGGER IF NOT EXISTS "{trig}" BEFORE {op.upper()} ON "{nombre}" '
+                f"BEGIN SELECT RAISE(ABORT, 'partición cerrada: {nombre}'); END"
+            ))
+        else:
+            db.session.execute(text(f'DROP TRIGGER IF EXISTS "{trig}"'))
+
+
+@contextmanager
+def _escritura(nombre: str):
+    """Suspende el solo-lectura de una partición dentro de la transacción en curso."""
+    _triggers(nombre, crear=False)
+    yield tabla(nombre)
+    _triggers(nombre, crear=True)
+
+
+def _registrar(mes: str, compactada: bool | None):
+    """Crea o actualiza la fila del catálogo con los datos actuales de la tabla (compactada None: sin cambio)."""
+    t = tabla(nombre_tabla(mes))
+    n, lo, hi, fmin, fmax = db.session.execute(
+        select(func.count(), func.min(t.c.id), func.max(t.c.id), func.min(t.c.fecha), func.max(t.c.fecha))
+    ).one()
+    p = db.session.get(ParticionVentas, mes) or ParticionVentas(
+        mes=mes, tabla=t.name, desde=inicio_mes(mes), hasta=inicio_mes(mes_siguiente(mes)), cerrada=datetime.now())
+    p.filas, p.min_id, p.max_id, p.fecha_min, p.fecha_max = n, lo, hi, fmin, fmax
+    if compactada is not None:
+        p.compactada = datetime.now() if compactada else None
+    db.session.add(p)
+
+
+def enrutar(filas):
+    """
+    Reparte un lote del ETL por fecha (sin commit). Las filas de meses
+    cerrados se escriben en su partición; los ids que cambian de tabla (otra
+    fecha) se borran de la anterior. Devuelve (filas para `ventas`,
+    escritas en particiones, cuántas de esas ya existían, cuántas de las
+    filas para `ventas` estaban en una partición).
+    """
+    c = corte()
+    if c is None or not filas:
+        return filas, 0, 0, 0
+    por_id = {f["id"]: f for f in filas}
+    destino = {i: (nombre_tabla(mes_de(f["fecha"])) if f["fecha"] < c else None) for i, f in por_id.items()}
+    ids = list(por_id)
+
+    existian, vuelven, quedan, tocadas = 0, 0, set(), {}   # tocadas: mes -> ¿agregó/quitó filas?
+    for p in catalogo():
+        if not _solapa(p, None, None, (min(ids), max(ids))):
+            continue
+        t = tabla(p.tabla)
+        presentes = set(db.session.execute(select(t.c.id).where(t.c.id.in_(ids))).scalars())
+        mover = [i for i in presentes if destino[i] != p.tabla]
+        quedan |= presentes.difference(mover)
+        vuelven += sum(destino[i] is None for i in mover)
+        existian += len(presentes) - sum(destino[i] is None for i in mover)
+        if mover:
+            with _escritura(p.tabla):
+                db.session.execute(delete(t).where(t.c.id.in_(mover)))
+            tocadas[p.mes] = True
+    a_particion = [i for i, d in destino.items() if d is not None]
+    if a_particion:
+        existian += db.session.execute(delete(Venta.__table__).where(Venta.id.in_(a_particion))).rowcount
+
+    por_mes = {}
+    for i in a_particion:
+        por_mes.setdefault(mes_de(por_id[i]["fecha"]), []).append(por_id[i])
+    for mes, lote in por_mes.items():
+        t = tabla(nombre_tabla(mes))
+        t.create(bind=db.session.connection(), checkfirst=True)   # mes sin ventas al cerrarse
+        with _escritura(t.name):
+            db.session.execute(upsert_stmt(t, lote[0].keys()), lote)
+        # actualizar filas que ya estaban no la fragmenta
+        tocadas[mes] = tocadas.get(mes, False) or any(f["id"] not in quedan for f in lote)
+    for mes, cambio in tocadas.items():
+        _registrar(mes, compactada=False if cambio else None)
+    return [f for i, f in por_id.items() if destino[i] is None], len(a_particion), existian, vuelven
+
+
+def cerrar_mes(mes: str) -> int:
+    """Mueve las ventas del mes de `ventas` a su partición (una transacción). Devuelve filas movidas."""
+    _solo_sqlite()
+    desde, hasta = inicio_mes(mes), inicio_mes(mes_siguiente(mes))
+    t = tabla(nombre_tabla(mes))
+    t.create(bind=db.session.connection(), checkfirst=True)
+    origen = select(*[Venta.__table__.c[c] for c in COLUMNAS]) \
+        .where(Venta.fecha >= desde, Venta.fecha < hasta).order_by(Venta.id)
+    with _escritura(t.name):
+        db.session.execute(insert(t).prefix_with("OR REPLACE").from_select(COLUMNAS, origen))
+        n = db.session.execute(delete(Venta.__table__).where(Venta.fecha >= desde, Venta.fecha < hasta)).rowcount
+    previa = db.session.get(ParticionVentas, mes)
+    # recién cerrada queda escrita en orden de id; si se le agregaron filas, no
+    _registrar(mes, compactada=previa is None or (n == 0 and previa.compactada is not None))
+    bump_data_version()
+    db.session.commit()
+    return n
+
+
+def cerrar(meses_abiertos: int | None = None) -> dict:
+    """
+    Cierra, en orden, todos los meses anteriores a los últimos `meses_abiertos`
+    meses calendario (incluido el actual). Devuelve {mes: filas movidas}.
+    """
+    if meses_abiertos is None:
+        meses_abiertos = current_app.config.get("PARTICIONES_MESES_ABIERTOS", 0)
+    meses_abiertos = max(int(meses_abiertos), 1)
+    limite = mes_de(datetime.now())
+    for _ in range(meses_abiertos - 1):
+        a, m = int(limite[:4]), int(limite[5:7])
+        limite = f"{a - (m == 1):04d}-{(m - 2) % 12 + 1:02d}"
+    limite = inicio_mes(limite)
+
+    primera = db.session.query(func.min(Venta.fecha)).filter(Venta.fecha < limite).scalar()
+    if primera is None:
+        return {}
+    movidas = {}
+    mes = mes_de(primera)
+    while inicio_mes(mes) < limite:
+        hay = db.session.query(Venta.id).filter(
+            Venta.fecha >= inicio_mes(mes), Venta.fecha < inicio_mes(mes_siguiente(mes))).first()
+        if hay is not None:
+            movidas[mes] = cerrar_mes(mes)
+        mes = mes_siguiente(mes)
+    return movidas
+
+
+def compactar(todas: bool = False) -> list[str]:
+    """
+    Reescribe las particiones a las que se agregaron o quitaron filas desde
+    su última compactación (o todas): tabla nueva copiada en orden de id
+    (páginas llenas y contiguas), luego índices y triggers.
+    """
+    _solo_sqlite()
+    hechas = []
+    for p in catalogo():
+        if p.compactada is not None and not todas:
+            continue
+        nueva = _definir(p.tabla + "__nueva", sa.MetaData(), indices=False)
+        nueva.create(bind=db.session.connection())
+        vieja = tabla(p.tabla)
+        db.session.execute(insert(nueva).from_select(
+            COLUMNAS, select(*[vieja.c[c] for c in COLUMNAS]).order_by(vieja.c.id)))
+        db.session.execute(text(f'DROP TABLE "{p.tabla}"'))          # se lleva índices y triggers
+        db.session.execute(text(f'ALTER TABLE "{nueva.name}" RENAME TO "{p.tabla}"'))
+        for indice in vieja.indexes:
+            indice.create(bind=db.session.connection())
+        _triggers(p.tabla, crear=True)
+        _registrar(p.mes, compactada=True)
+        bump_data_version()
+        db.session.commit()
+        hechas.append(p.mes)
+    return hechas
+
+
+def eliminar_todas():
+    """Borra particiones y catálogo (ETL --truncate); sin commit."""
+    for p in catalogo():
+        db.session.execute(text(f'DROP TABLE IF EXISTS "{p.tabla}"'))
+    db.session.execute(delete(ParticionVentas))
+    bump_data_version()
+
+
+def estado() -> dict:
+    c = corte()
+    fuera = db.session.query(func.count(Venta.id)).filter(Venta.fecha < c).scalar() if c else 0
+    return {
+        "corte": c.isoformat() if c else None,
+        "abiertas": db.session.query(func.count(Venta.id)).scalar() or 0,
+        "abiertas_antes_del_corte": fuera,
+        "particiones": [
+            {"mes": p.mes, "tabla": p.tabla, "filas": p.filas, "ids": [p.min_id, p.max_id],
+             "compactada": p.compactada.isoformat() if p.compactada else None}
+            for p in catalogo()
+        ],
+    }
+
+
+def main():
+    import json
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Particiones mensuales de ventas")
+    sub = parser.add_subparsers(dest="accion", required=True)
+    sub.add_parser("estado")
+    p_cerrar = sub.add_parser("cerrar", help="mueve a su partición los meses anteriores a los abiertos")
+    p_cerrar.add_argument("--meses-abiertos", type=int, default=None,
+                          help="meses que quedan en `ventas` (por defecto PARTICIONES_MESES_ABIERTOS, mín. 1)")
+    p_comp = sub.add_parser("compactar", help="reescribe sin huecos las particiones modificadas")
+    p_comp.add_argument("--todas", action="store_true")
+    p_comp.add_argument("--vacuum", action="store_true", help="después, VACUUM del archivo (devuelve espacio al disco)")
+    parser.add_argument("--tenant", default=None)
+    args = parser.parse_args()
+
+    from app import tenants
+    app = create_app()
+    with app.app_context(), tenants.activar(args.tenant):
+        if args.accion == "cerrar":
+            for mes, n in cerrar(args.meses_abiertos).items():
+                print(f"{mes}: {n} ventas movidas a {nombre_tabla(mes)}")
+        elif args.accion == "compactar":
+            hechas = compactar(args.todas)
+            print(f"Compactadas: {', '.join(hechas) or 'ninguna'}")
+            if args.vacuum:
+                db.session.remove()
+                with db.engine.connect() as conn:
+                    conn.exec_driver_sql("VACUUM")
+        print(json.dumps(estado(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# app/pronosticos.py
+"""
+Pronósticos de demanda precalculados (tabla pronosticos_demanda).
+
+Todos los productos se ajustan a la vez sobre una matriz producto × día
+(cantidades, días sin ventas = 0) con suavizado exponencial de nivel y
+estacionalidad semanal aditiva (Holt-Winters sin tendencia). Cada fila
+empieza a contar desde la primera venta del producto. Las filas se reparten
+en un pool de procesos (PRONOSTICO_WORKERS).
+
+Se guardan los horizontes 1..PRONOSTICO_HORIZONTE; /api/demanda solo lee
+por clave primaria. El ETL lo refresca al cargar ventas; a mano:
+
+    python -m app.pronosticos [--workers N]
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select, delete, insert
+
+from .models import db, VentaRollup, PronosticoDemanda
+from .cache import bump_data_version
+from . import columnar, particiones
+
+TEMPORADA = 7
+MIN_FILAS_POR_PROCESO = 256
+
+
+def _a_date(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+def _cantidades_por_dia():
+    """
+    Arrays (producto_id, día, cantidad): del almacén columnar si está activo;
+    si no, una sola consulta (al rollup si está al día).
+    """
+    from .analytics import rollups_listos
+    from .rollups import _dia_expr
+
+    tienda = columnar.activo()
+    if tienda is not None:
+        return tienda.cantidades_por_dia()
+    if rollups_listos():
+        q = select(VentaRollup.producto_id, VentaRollup.fecha, func.sum(VentaRollup.cantidad)) \
+            .group_by(VentaRollup.producto_id, VentaRollup.fecha)
+    else:
+        v = particiones.ventas()
+        dia = _dia_expr(v)
+        q = select(v.producto_id, dia, func.sum(v.cantidad)) \
+            .where(v.producto_id.isnot(None)) \
+            .group_by(v.producto_id, dia)
+    filas = db.session.execute(q).all()
+    return (
+        np.array([f[0] for f in filas], dtype=np.int64),
+        np.array([_a_date(f[1]) for f in filas], dtype="datetime64[D]"),
+        np.array([f[2] or 0 for f in filas], dtype=float),
+    )
+
+
+def matriz_demanda(ids, dias, cant):
+    """
+    Arrays (producto_id, día, cantidad) -> (ids, primer_dia, matriz P × D, inicio).
+    inicio[i] es la columna de la primera venta del producto i.
+    """
+    productos, fila = np.unique(ids, return_inverse=True)
+    primer_dia = dias.min()
+    col = (dias - primer_dia).astype(np.int64)
+    matriz = np.zeros((len(productos), int(col.max()) + 1))
+    np.add.at(matriz, (fila, col), cant)
+
+    inicio = np.full(len(productos), matriz.shape[1], dtype=np.int64)
+    np.minimum.at(inicio, fila, col)
+    return productos, primer_dia, matriz, inicio
+
+
+def suavizado_estacional(matriz, inicio, horizonte, alfa, gamma, m=TEMPORADA):
+    """
+    Holt-Winters aditivo sin tendencia, vectorizado por filas.
+    Devuelve P × horizonte con la demanda diaria pronosticada (>= 0).
+    La estación de cada columna es t % m, así todas las filas comparten calendario.
+    """
+    p, d = matriz.shape
+    filas = np.arange(p)
+
+    # inicialización con la primera temporada de cada producto
+    ventana = np.minimum(inicio[:, None] + np.arange(m), d - 1)
+    valores = matriz[filas[:, None], ventana]
+    validos = (inicio[:, None] + np.arange(m)) < d
+    nivel = np.where(validos, valores, 0.0).sum(axis=1) / np.maximum(validos.sum(axis=1), 1)
+    estacion = np.zeros((p, m))
+    estacion[filas[:, None], ventana % m] = np.where(validos, valores - nivel[:, None], 0.0)
+
+    for t in range(int(inicio.min()) + m, d):
+        activo = t >= inicio + m
+        if not activo.any():
+            continue
+        s = t % m
+        y = matriz[:, t]
+        nuevo_nivel = alfa * (y - estacion[:, s]) + (1 - alfa) * nivel
+        nueva_est = gamma * (y - nuevo_nivel) + (1 - gamma) * estacion[:, s]
+        nivel = np.where(activo, nuevo_nivel, nivel)
+        estacion[:, s] = np.where(activo, nueva_est, estacion[:, s])
+
+    futuras = (d + np.arange(horizonte)) % m
+    return np.maximum(nivel[:, None] + estacion[:, futuras], 0.0)
+
+
+def _ajustar_bloque(args):
+    """Función de proceso: (matriz, inicio, horizonte, alfa, gamma) -> pronósticos."""
+    return suavizado_estacional(*args)
+
+
+def pronosticar(matriz, inicio, horizonte, alfa, gamma, workers=1, avance=lambda fraccion: None):
+    """
+    Reparte las filas en `workers` procesos (si vale la pena) y junta los
+    resultados; `avance` recibe la fracción de bloques terminados.
+    """
+    p = matriz.shape[0]
+    bloques = min(workers, max(p // MIN_FILAS_POR_PROCESO, 1))
+    if bloques <= 1:
+        return suavizado_estacional(matriz, inicio, horizonte, alfa, gamma)
+    cortes = np.array_split(np.arange(p), bloques)
+    tareas = [(matriz[c], inicio[c], horizonte, alfa, gamma) for c in cortes]
+    partes = []
+    with ProcessPoolExecutor(max_workers=bloques) as pool:
+        for parte in pool.map(_ajustar_bloque, tareas):
+            partes.append(parte)
+            avance(len(partes) / bloques)
+    return np.vstack(partes)
+
+
+def recalcular(workers: int | None = None, avance=lambda fraccion, mensaje: None) -> int:
+    """
+    Reemplaza pronosticos_demanda en una transacción. Devuelve nº de productos.
+    `avance(fraccion, mensaje)` informa el progreso antes de escribir.
+    """
+    cfg = current_app.config
+    horizonte = cfg.get("PRONOSTICO_HORIZONTE", 90)
+    if workers is None:
+        workers = cfg.get("PRONOSTICO_WORKERS", 1)
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+
+    avance(0.05, "leyendo cantidades por día")
+    ids, dias, cant = _cantidades_por_dia()
+    n = 0
+    if len(ids):
+        productos, _, matriz, inicio = matriz_demanda(ids, dias, cant)
+        mensaje = f"ajustando {len(productos)} productos"
+        avance(0.3, mensaje)
+        diario = pronosticar(matriz, inicio, horizonte,
+                             cfg.get("PRONOSTICO_ALFA", 0.3), cfg.get("PRONOSTICO_GAMMA", 0.1), workers,
+                             lambda f: avance(0.3 + 0.6 * f, mensaje))
+        acumulado = np.cumsum(diario, axis=1)
+    avance(0.9, "guardando")
+    db.session.execute(delete(PronosticoDemanda))
+    if len(ids):
+        ahora = datetime.now()
+        db.session.execute(insert(PronosticoDemanda), [
+            {"producto_id": int(productos[i]), "horizonte": h + 1,
+             "demanda_dia": float(diario[i, h]), "demanda_acumulada": float(acumulado[i, h]),
+             "generado": ahora}
+            for i in range(len(productos)) for h in range(horizonte)
+        ])
+        n = len(productos)
+    bump_data_version()
+    db.session.commit()
+    return n
+
+
+def consultar(producto_id: int, dias: int):
+    """
+    Demanda acumulada a `dias` por clave primaria. Más allá del horizonte guardado
+    se extiende por semanas completas (el pronóstico es periódico de período 7).
+    """
+    if dias <= 0:
+        return None
+    guardado = db.session.get(PronosticoDemanda, (producto_id, dias))
+    if guardado is not None:
+        return guardado.demanda_acumulada
+    semana = db.session.execute(
+        select(PronosticoDemanda.horizonte, PronosticoDemanda.demanda_dia)
+        .where(PronosticoDemanda.producto_id == producto_id, PronosticoDemanda.horizonte <= TEMPORADA)
+        .order_by(PronosticoDemanda.horizonte)
+    ).all()
+    if len(semana) < TEMPORADA:
+        return None
+    diario = np.array([d for _, d in semana])
+    return float(diario.sum() * (dias // TEMPORADA) + diario[: dias % TEMPORADA].sum())
+
+
+def main():
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Recalcula los pronósticos de demanda")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="procesos (0 = todos los núcleos; por defecto PRONOSTICO_WORKERS)")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        n = recalcular(args.workers)
+        print(f"Pronósticos recalculados para {n} productos "
+              f"({app.config.get('PRONOSTICO_HORIZONTE', 90)} días).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# app/rollups.py
+"""
+Mantenimiento de ventas_rollup (ventas por día × hora × producto).
+
+El ETL llama a `aplicar_lote` en la misma transacción en la que escribe
+cada lote (suma lo nuevo y resta la versión anterior de las filas que ya
+existían), así el rollup nunca queda a medias. Para reconstruir y verificar:
+
+    python -m app.rollups            # reconstruye todo y verifica
+    python -m app.rollups --verificar  # solo compara rollup vs ventas crudas
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, datetime
+
+from sqlalchemy import func, delete, insert, cast, Date
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import db, Venta, VentaRollup, Metadato
+from .analytics import _dim_expr
+from .cache import bump_data_version
+from . import particiones
+
+
+def _dia_expr(fuente=Venta):
+    """Día de la fecha de venta como DATE (en SQLite, texto 'YYYY-MM-DD')."""
+    if db.engine.dialect.name == "sqlite":
+        return func.date(fuente.fecha)
+    return cast(fuente.fecha, Date)
+
+
+def _select_agregado():
+    """SELECT día, hora, producto_id, sum(total), sum(cantidad), count(*) desde ventas (todas las particiones)."""
+    v = particiones.ventas()
+    dia = _dia_expr(v)
+    hora = _dim_expr("hora", db.engine.dialect.name, v)
+    q = db.select(
+        dia,
+        hora,
+        v.producto_id,
+        func.coalesce(func.sum(v.total), 0.0),
+        func.coalesce(func.sum(v.cantidad), 0),
+        func.count(v.id),
+    )
+    return q.group_by(dia, hora, v.producto_id)
+
+
+def _insertar_desde(q):
+    cols = [VentaRollup.fecha, VentaRollup.hora, VentaRollup.producto_id,
+            VentaRollup.total, VentaRollup.cantidad, VentaRollup.n]
+    db.session.execute(insert(VentaRollup).from_select([c.key for c in cols], q))
+
+
+def _a_date(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+def _upsert_sumando():
+    """INSERT ... ON CONFLICT DO UPDATE que acumula sobre la fila existente."""
+    dialecto = db.engine.dialect.name
+    if dialecto == "sqlite":
+        stmt = sqlite_insert(VentaRollup)
+    elif dialecto == "postgresql":
+        stmt = pg_insert(VentaRollup)
+    else:
+        return None
+    t = VentaRollup.__table__.c
+    return stmt.on_conflict_do_update(
+        index_elements=[t.fecha, t.hora, t.producto_id],
+        set_={
+            "total": t.total + stmt.excluded.total,
+            "cantidad": t.cantidad + stmt.excluded.cantidad,
+            "n": t.n + stmt.excluded.n,
+        },
+    )
+
+
+def aplicar_lote(registros):
+    """
+    Mantiene el rollup (sin commit) para un lote de ventas que se va a escribir.
+    Debe llamarse ANTES del upsert: lee por id la versión anterior de las filas
+    que ya existen para restarla. Solo usa búsquedas por clave primaria.
+    """
+    stmt = _upsert_sumando()
+    if stmt is None:
+        # dialecto sin ON CONFLICT: se desactiva el rollup hasta reconstruirlo
+        marcar(False)
+        return
+
+    por_id = {r["id"]: r for r in registros}   # el último valor gana, como en el upsert
+    delta = defaultdict(lambda: [0.0, 0, 0])
+    if por_id:
+        v = particiones.ventas(ids=(min(por_id), max(por_id)))
+        anteriores = db.session.query(v.fecha, v.producto_id, v.total, v.cantidad) \
+            .filter(v.id.in_(list(por_id)))
+        for fecha, producto_id, total, cantidad in anteriores:
+            d = delta[(fecha.date(), fecha.hour, producto_id)]
+            d[0] -= total or 0.0
+            d[1] -= cantidad or 0
+            d[2] -= 1
+    for r in por_id.values():
+        d = delta[(r["fecha"].date(), r["fecha"].hour, r["producto_id"])]
+        d[0] += r["total"] or 0.0
+        d[1] += r["cantidad"] or 0
+        d[2] += 1
+
+    filas = [
+        {"fecha": k[0], "hora": k[1], "producto_id": k[2], "total": v[0], "cantidad": v[1], "n": v[2]}
+        for k, v in delta.items() if any(v)
+    ]
+    if filas:
+        db.session.execute(stmt, filas)
+
+
+def marcar(listo: bool):
+    """Marca el rollup como utilizable (o no) por AnalyticsEngine."""
+    meta = db.session.get(Metadato, "rollups") or Metadato(clave="rollups")
+    meta.valor = "ok" if listo else "pendiente"
+    db.session.add(meta)
+
+
+def reconstruir():
+    """Vacía y recalcula todo el rollup en una sola transacción."""
+    db.session.execute(delete(VentaRollup))
+    _insertar_desde(_select_agregado())
+    marcar(True)
+    bump_data_version()
+    db.session.commit()
+
+
+def verificar():
+    """
+    Compara por día (total, cantidad, nº de ventas) rollup vs ventas crudas.
+    Devuelve la lista de días que no cuadran: [(dia, crudo, rollup), ...].
+    """
+    crudo = {}
+    v = particiones.ventas()
+    dia_expr = _dia_expr(v)
+    for dia, total, cant, n in db.session.query(
+        dia_expr, func.sum(v.total), func.sum(v.cantidad), func.count(v.id),
+    ).group_by(dia_expr):
+        crudo[_a_date(dia)] = (round(total or 0.0, 2), int(cant or 0), int(n))
+
+    rollup = {}
+    for dia, total, cant, n in db.session.query(
+        VentaRollup.fecha, func.sum(VentaRollup.total), func.sum(VentaRollup.cantidad), func.sum(VentaRollup.n),
+    ).group_by(VentaRollup.fecha):
+        rollup[_a_date(dia)] = (round(total or 0.0, 2), int(cant or 0), int(n or 0))
+
+    vacio = (0.0, 0, 0)
+    return [
+        (dia, crudo.get(dia, vacio), rollup.get(dia, vacio))
+        for dia in sorted(set(crudo) | set(rollup))
+        if crudo.get(dia, vacio) != rollup.get(dia, vacio)
+    ]
+
+
+def main():
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Reconstruye/verifica ventas_rollup")
+    parser.add_argument("--verificar", action="store_true", help="solo verifica, no reconstruye")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if not args.verificar:
+            reconstruir()
+            print("Rollup reconstruido:", VentaRollup.query.count(), "filas")
+        diferencias = verificar()
+        for dia, crudo, roll in diferencias[:20]:
+            print(f"  {dia}: ventas={crudo} rollup={roll}")
+        if diferencias:
+            print(f"Rollup con {len(diferencias)} días distintos a las ventas crudas.")
+            raise SystemExit(1)
+        print("Rollup verificado: coincide con las ventas crudas.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,20 @@
 # app/routes.py
+import base64
+import csv
+import io
+import json
 from datetime import datetime, timedelta
-from flask import Blueprint, jsonify, request, render_template
-from sqlalchemy import func
+from flask import Blueprint, Response, current_app, jsonify, request, render_template, stream_with_context
+from sqlalchemy import select, or_, and_
 
-from .models import db, Cliente, Producto, Venta
+from .models import db, Cliente, Producto
 from .analytics import AnalyticsEngine
+from .http_cache import cacheable, instalar as instalar_cache_http
+from . import clv, jobs, metricas, particiones, segmentacion, stream, tenants
 
 main = Blueprint("main", __name__)
+metricas.instalar(main, db.Model)   # primero: su latencia incluye caché HTTP y gzip
+instalar_cache_http(main)
 
 
 # ----------------------------
@@ -27,6 +35,11 @@ def _end_of_day(dt):
     return dt + timedelta(days=1) if dt else None
 
 
+def _approx() -> bool:
+    """?approx=1: respuesta desde los sketches diarios (ver app/sketches.py)."""
+    return request.args.get("approx", "").lower() in ("1", "true", "yes")
+
+
 # ----------------------------
 # PÁGINA
 # ----------------------------
@@ -36,7 +49,7 @@ def home():
     productos = db.session.query(Producto).order_by(Producto.nombre.asc()).all()
 
     # Rango de fechas disponible en la BD (opcional para el template)
-    minmax = db.session.query(func.min(Venta.fecha), func.max(Venta.fecha)).first()
+    minmax = particiones.rango_fechas()
     min_fecha = minmax[0].date().isoformat() if minmax and minmax[0] else None
     max_fecha = minmax[1].date().isoformat() if minmax and minmax[1] else None
 
@@ -54,36 +67,46 @@ def health():
     return jsonify({"ok": True, "msg": "API Insight-PYME"})
 
 
+# Métricas del proceso en formato Prometheus (ver app/metricas.py)
+@main.get("/api/metrics")
+def api_metrics():
+    return Response(metricas.exportar(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
 # ----------------------------
 # APIS DE NEGOCIO
 # ----------------------------
 @main.get("/api/kpis")
+@cacheable
 def api_kpis():
     """
     KPIs con rango opcional:
-      GET /api/kpis?desde=YYYY-MM-DD&hasta=YYYY-MM-DD
+      GET /api/kpis?desde=YYYY-MM-DD&hasta=YYYY-MM-DD[&approx=1]
     Si no se envía rango, usa el comportamiento original (mes actual vs anterior).
+    Con approx=1 los clientes únicos salen de HLL y "aprox" trae su intervalo.
     """
     desde = request.args.get("desde")
     hasta = request.args.get("hasta")
-    data = AnalyticsEngine.get_kpis(desde=desde, hasta=hasta)
+    data = AnalyticsEngine.get_kpis(desde=desde, hasta=hasta, approx=_approx())
     return jsonify(data)
 
 
 @main.get("/api/top-productos")
+@cacheable
 def api_top_productos():
     """
     Top productos con rango opcional:
-      GET /api/top-productos?limite=5&desde=YYYY-MM-DD&hasta=YYYY-MM-DD
+      GET /api/top-productos?limite=5&desde=YYYY-MM-DD&hasta=YYYY-MM-DD[&approx=1]
     """
     limite = int(request.args.get("limite", 5))
     desde = request.args.get("desde")
     hasta = request.args.get("hasta")
 
     data = AnalyticsEngine.get_top_productos(
-        limite=limite, desde=desde, hasta=hasta
+        limite=limite, desde=desde, hasta=hasta, approx=_approx()
     )
     # Estructura: [{"producto": "...", "cantidad": N, "ingreso": 123.45}, ...]
+    # con approx=1: {"productos": [... + "ingreso_max"], "aprox": {"ingreso_max_no_listados": X}}
     return jsonify(data)
 
 
@@ -103,40 +126,202 @@ def api_demanda():
 
 # (opcional) versión GET de la predicción (para pruebas rápidas por URL)
 @main.get("/api/demanda/<int:producto_id>")
+@cacheable
 def api_demanda_get(producto_id):
     dias = int(request.args.get("dias", 30))
     res = AnalyticsEngine.predecir_demanda(producto_id, dias_futuro=dias)
     return jsonify(res)
 
 
+# Listado / exportación de ventas (paginación por cursor sobre fecha, id)
+VENTAS_LIMITE_MAX = 1000
+EXPORT_LOTE = 2000
+
+
+def _cursor_encode(fecha, _id):
+    return base64.urlsafe_b64encode(f"{fecha.isoformat()}|{_id}".encode()).decode()
+
+
+def _cursor_decode(token):
+    """Devuelve (fecha, id) o None si el cursor no es válido."""
+    try:
+        fecha, _id = base64.urlsafe_b64decode(token.encode()).decode().split("|")
+        return datetime.fromisoformat(fecha), int(_id)
+    except Exception:
+        return None
+
+
+def _ventas_select(V, desde, hasta):
+    """Solo las columnas del listado, con los nombres vía JOIN (sin cargas perezosas)."""
+    stmt = (
+        select(V.id, V.fecha, Cliente.nombre.label("cliente"),
+               Producto.nombre.label("producto"), V.cantidad, V.total)
+        .outerjoin(Cliente, V.cliente_id == Cliente.id)
+        .outerjoin(Producto, V.producto_id == Producto.id)
+        .order_by(V.fecha.desc(), V.id.desc())
+    )
+    if desde:
+        stmt = stmt.where(V.fecha >= desde)
+    if hasta:
+        stmt = stmt.where(V.fecha < _end_of_day(hasta))
+    return stmt
+
+
+def _venta_dict(f):
+    return {
+        "id": f.id,
+        "fecha": f.fecha.isoformat(),
+        "cliente": f.cliente,
+        "producto": f.producto,
+        "cantidad": int(f.cantidad or 0),
+        "total": float(f.total or 0.0),
+    }
+
+
+def _lotes(stmts):
+    """Lotes de filas de cada consulta, una tras otra (una por partición, ya en orden)."""
+    for stmt in stmts:
+        yield from db.session.execute(stmt.execution_options(yield_per=EXPORT_LOTE)).partitions()
+
+
+def _exportar_ventas(stmts, formato):
+    """Genera el export fila a fila desde un cursor del lado del servidor (memoria constante)."""
+    if formato == "csv":
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        w.writerow(["id", "fecha", "cliente", "producto", "cantidad", "total"])
+        for lote in _lotes(stmts):
+            for f in lote:
+                w.writerow([f.id, f.fecha.isoformat(), f.cliente or "", f.producto or "",
+                            int(f.cantidad or 0), float(f.total or 0.0)])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        yield buf.getvalue()
+    else:
+        for lote in _lotes(stmts):
+            yield "".join(json.dumps(_venta_dict(f), ensure_ascii=False) + "\n" for f in lote)
+
+
 @main.get("/api/ventas")
+@cacheable
 def api_listar_ventas():
     """
-    Listado simple (máx 1000) con filtro opcional por fecha (INCLUSIVO):
-      GET /api/ventas?desde=YYYY-MM-DD&hasta=YYYY-MM-DD
+    Listado con filtro opcional por fecha (INCLUSIVO), más reciente primero:
+      GET /api/ventas?desde=YYYY-MM-DD&hasta=YYYY-MM-DD&limite=1000&cursor=...
+    Devuelve hasta `limite` (máx 1000) ventas; si hay más, el header
+    X-Siguiente-Cursor trae el valor para pedir la página siguiente.
+    Exportación completa del rango, en streaming:
+      GET /api/ventas?desde=...&hasta=...&format=csv|ndjson
     """
-    q = db.session.query(Venta).order_by(Venta.fecha.desc())
-
     d = _parse_date(request.args.get("desde"))
     h = _parse_date(request.args.get("hasta"))
-    if d:
-        q = q.filter(Venta.fecha >= d)
-    if h:
-        q = q.filter(Venta.fecha < _end_of_day(h))
-
-    q = q.limit(1000)
-    data = [{
-        "id": v.id,
-        "fecha": v.fecha.isoformat(),
-        "cliente": v.cliente.nombre if v.cliente else None,
-        "producto": v.producto.nombre if v.producto else None,
-        "cantidad": int(v.cantidad or 0),
-        "total": float(v.total or 0.0),
-    } for v in q.all()]
-    return jsonify(data)
+
+    # una consulta por tabla (meses disjuntos, de la más nueva a la más vieja):
+    # concatenadas ya salen ordenadas por fecha descendente
+    ramas = particiones.ramas(d, _end_of_day(h))
+    stmts = [_ventas_select(V, d, h) for V in ramas]
+
+    formato = request.args.get("format", "json")
+    if formato in ("csv", "ndjson"):
+        mimetype = "text/csv" if formato == "csv" else "application/x-ndjson"
+        resp = Response(stream_with_context(_exportar_ventas(stmts, formato)), mimetype=mimetype)
+        resp.headers["Content-Disposition"] = f"attachment; filename=ventas.{formato}"
+        return resp
+
+    cursor = None
+    token = request.args.get("cursor")
+    if token:
+        cursor = _cursor_decode(token)
+        if cursor is None:
+            return jsonify({"error": "cursor inválido"}), 400
+
+    limite = max(1, min(request.args.get("limite", VENTAS_LIMITE_MAX, type=int), VENTAS_LIMITE_MAX))
+    filas = []
+    for V, stmt in zip(ramas, stmts):
+        if cursor:
+            fecha, _id = cursor
+            stmt = stmt.where(or_(V.fecha < fecha, and_(V.fecha == fecha, V.id < _id)))
+        filas += db.session.execute(stmt.limit(limite + 1 - len(filas))).all()
+        if len(filas) > limite:
+            break
+    resp = jsonify([_venta_dict(f) for f in filas[:limite]])
+    if len(filas) > limite:
+        ultima = filas[limite - 1]
+        resp.headers["X-Siguiente-Cursor"] = _cursor_encode(ultima.fecha, ultima.id)
+    return resp
+
+
+@main.post("/api/ventas/batch")
+def api_ventas_batch():
+    """
+    Ingesta en vivo desde los puntos de venta (ver app/ingesta.py):
+      POST /api/ventas/batch[?esperar=1]
+      Content-Type: application/x-ndjson (una venta por línea) o application/json (arreglo)
+      {"id", "fecha", "cliente_id", "producto_id", "cantidad", "precio_unitario", "total"}
+    202 {aceptadas, rechazadas: [{linea, error}]}: encoladas. Con esperar=1,
+    201 {escritas, errores} cuando se confirmaron. 429 si la cola está llena.
+    """
+    from . import ingesta   # import local: arranca su hilo solo si se usa
+
+    cfg = current_app.config
+    cuerpo = request.get_data(cache=False, as_text=True)
+    if request.mimetype == "application/json":
+        try:
+            datos = json.loads(cuerpo or "null")
+        except ValueError:
+            return jsonify({"error": "JSON inválido"}), 400
+        objetos = datos if isinstance(datos, list) else [datos]
+    else:
+        objetos = []
+        for linea in cuerpo.splitlines():
+            if not linea.strip():
+                continue
+            try:
+                objetos.append(json.loads(linea))
+            except ValueError:
+                objetos.append(None)          # se reporta como rechazada en su línea
+    if not objetos:
+        return jsonify({"error": "sin ventas"}), 400
+    if len(objetos) > cfg["INGESTA_MAX_FILAS"]:
+        return jsonify({"error": f"máximo {cfg['INGESTA_MAX_FILAS']} ventas por envío"}), 413
+
+    filas, rechazadas = ingesta.validar(objetos)
+    if not filas:
+        return jsonify({"aceptadas": 0, "rechazadas": rechazadas}), 400
+
+    ticket = ingesta.cola.encolar(current_app._get_current_object(), tenants.actual(), filas)
+    if ticket is None:
+        metricas.registro.sumar("insight_ingesta_rechazos_total", {})
+        resp = jsonify({"error": "cola de ingesta llena, reintentar"})
+        resp.headers["Retry-After"] = str(max(1, round(cfg["INGESTA_VENTANA_MS"] / 1000.0 * 4)))
+        return resp, 429
+
+    if request.args.get("esperar", "").lower() in ("1", "true", "yes") and ticket.esperar(cfg["INGESTA_ESPERA_S"]):
+        return jsonify({"escritas": ticket.escritas, "errores": ticket.errores,
+                        "rechazadas": rechazadas}), 201
+    return jsonify({"aceptadas": len(filas), "rechazadas": rechazadas}), 202
+
+
+@main.get("/api/stream")
+def api_stream():
+    """
+    Server-Sent Events con la vista por defecto del tablero:
+      GET /api/stream   (Accept: text/event-stream)
+    Primero un evento "foto" con todo; luego "delta" con lo que cambió en
+    cada commit (ver app/stream.py).
+    """
+    sus = stream.difusor.suscribir(current_app._get_current_object(), tenants.actual())
+    db.session.remove()     # la conexión no queda tomada mientras dure el stream
+    resp = Response(stream.eventos(sus, current_app.config["STREAM_LATIDO_S"]),
+                    mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
 
 
 @main.get("/api/ventas-por-hora")
+@cacheable
 def api_ventas_por_hora():
     """
     Barras por hora con rango opcional:
@@ -149,6 +334,7 @@ def api_ventas_por_hora():
 
 
 @main.get("/api/ventas-por-dia")
+@cacheable
 def api_ventas_por_dia():
     """
     Barras por día de la semana con rango opcional:
@@ -160,10 +346,132 @@ def api_ventas_por_dia():
     return jsonify(data)
 
 
+@main.get("/api/dashboard")
+@cacheable
+def api_dashboard():
+    """
+    Todos los paneles del tablero en un solo JSON (se calculan en paralelo):
+      GET /api/dashboard?desde=YYYY-MM-DD&hasta=YYYY-MM-DD&limite=10[&approx=1]
+    Estructura: {kpis, top_productos, ventas_por_hora, ventas_por_dia, tiempos_ms}
+    """
+    desde = request.args.get("desde")
+    hasta = request.args.get("hasta")
+    limite = max(request.args.get("limite", 10, type=int), 1)
+    data = AnalyticsEngine.get_dashboard(desde=desde, hasta=hasta, limite=limite, approx=_approx())
+    return jsonify(data)
+
+
+@main.get("/api/serie")
+@cacheable
+def api_serie():
+    """
+    Serie de tiempo densa con media móvil y variación contra el periodo anterior:
+      GET /api/serie?granularidad=dia|semana|mes&metric=total|cantidad|ventas&ventana=7
+                    &desde=YYYY-MM-DD&hasta=YYYY-MM-DD
+    Estructura: {granularidad, metric, ventana, desde, hasta,
+                 periodos, valores, media_movil, delta, delta_pct} (listas alineadas)
+    """
+    try:
+        data = AnalyticsEngine.get_serie(
+            granularidad=request.args.get("granularidad", "dia"),
+            metrica=request.args.get("metric", "total"),
+            ventana=request.args.get("ventana", 7, type=int),
+            desde=request.args.get("desde"),
+            hasta=request.args.get("hasta"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(data)
+
+
+@main.get("/api/heatmap-hora-dia")
+@cacheable
+def api_heatmap_hora_dia():
+    """
+    Matriz día de la semana × hora (ventas) con rango opcional:
+      GET /api/heatmap-hora-dia?desde=YYYY-MM-DD&hasta=YYYY-MM-DD
+    """
+    desde = request.args.get("desde")
+    hasta = request.args.get("hasta")
+    data = AnalyticsEngine.get_heatmap_hora_dia(desde=desde, hasta=hasta)
+    return jsonify(data)
+
+
+@main.get("/api/segmentos")
+@cacheable
+def api_segmentos():
+    """
+    Segmentación RFM guardada (no recalcula; ver `python -m app.segmentacion`):
+      GET /api/segmentos?segmento=VIP&limite=100&offset=0
+    Estructura: {"resumen": {"VIP": N, ...}, "clientes": [...]}
+    """
+
+    segmento = request.args.get("segmento") or None
+    limite = max(1, min(request.args.get("limite", 100, type=int), 1000))
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    return jsonify({
+        "resumen": segmentacion.resumen(),
+        "clientes": segmentacion.listar(segmento=segmento, limite=limite, offset=offset),
+    })
+
+
+@main.get("/api/clv")
+@cacheable
+def api_clv():
+    """
+    Clientes ordenados por CLV (tabla clv_clientes, la refresca el ETL):
+      GET /api/clv?limite=100&offset=0
+    """
+
+    limite = max(1, min(request.args.get("limite", 100, type=int), 1000))
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    return jsonify(clv.listar(limite=limite, offset=offset))
+
+
+@main.post("/api/jobs/<tipo>")
+def api_jobs_crear(tipo):
+    """
+    Encola un recálculo pesado (segmentacion, clv, pronosticos, sketches):
+      POST /api/jobs/segmentacion   body opcional {"completo": true}
+    202 con el job nuevo; 200 con el idéntico que ya estaba en curso.
+    """
+
+    if tipo not in jobs.TIPOS:
+        return jsonify({"error": f"tipo de job desconocido: {tipo}", "tipos": sorted(jobs.TIPOS)}), 404
+    cuerpo = request.get_json(silent=True)
+    if cuerpo is None:
+        cuerpo = {}
+    if not isinstance(cuerpo, dict):
+        return jsonify({"error": "se esperaba un objeto JSON con los parámetros"}), 400
+    try:
+        parametros = jobs.validar(tipo, cuerpo)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    job, nuevo = jobs.solicitar(tipo, parametros)
+    jobs.despachador.avisar(current_app._get_current_object(), tenants.actual())
+    resp = jsonify({**jobs.a_dict(job), "duplicado": not nuevo})
+    resp.status_code = 202 if nuevo else 200
+    resp.headers["Location"] = f"/api/jobs/{job.id}"
+    return resp
+
+
+@main.get("/api/jobs/<job_id>")
+def api_jobs_estado(job_id):
+    """Estado de un job: GET /api/jobs/<id>"""
+    from .models import Job
+
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({"error": "job no encontrado"}), 404
+    return jsonify(jobs.a_dict(job))
+
+
 # ----------------------------
 # APIS DE APOYO PARA EL FRONT
 # ----------------------------
 @main.get("/api/productos")
+@cacheable
 def api_productos():
     """Lista simple de productos para poblar selects en el front."""
     prods = db.session.query(Producto.id, Producto.nombre).order_by(Producto.nombre.asc()).all()
@@ -171,12 +479,13 @@ def api_productos():
 
 
 @main.get("/api/rango-fechas")
+@cacheable
 def api_rango_fechas():
     """
     Devuelve la fecha mínima y máxima existentes en ventas,
     útil para inicializar datepickers en el front.
     """
-    row = db.session.query(func.min(Venta.fecha), func.max(Venta.fecha)).first()
+    row = particiones.rango_fechas()
     return jsonify({
         "min": row[0].date().isoformat() if row and row[0] else None,
         "max": row[1].date().isoformat() if row and row[1] else None,
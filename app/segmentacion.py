@@ -0,0 +1,175 @@
+# app/segmentacion.py
+"""
+Segmentación RFM persistida en segmentos_clientes.
+
+Cada corrida:
+  1. Recalcula los agregados (última compra, frecuencia, monto) solo de los
+     clientes con ventas nuevas desde la corrida anterior (marca de agua por
+     Venta.id en metadatos) y de los pendientes: los que tuvieron ventas
+     escritas con id menor o igual a la marca (actualizadas o fuera de
+     orden; los registra app/derivados.py). Con `completo=True`, o más de
+     MAX_CLIENTES_PENDIENTES pendientes, recalcula todos.
+  2. Clasifica a todos los clientes con numpy sobre los agregados guardados
+     (la recencia cambia con el tiempo aunque no haya ventas nuevas).
+  3. Escribe con un solo UPDATE masivo únicamente los segmentos que cambiaron.
+
+    python -m app.segmentacion [--completo]
+"""
+import argparse
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, select, update, delete, insert, or_
+
+from .models import db, Cliente, SegmentoCliente, Metadato
+from .cache import bump_data_version
+from . import derivados, particiones
+
+MARCA = derivados.MARCA_SEGMENTOS
+PENDIENTE = derivados.CLIENTE_PENDIENTE
+
+
+def _agregados(desde_id: int | None, pendientes=()):
+    """
+    Una consulta GROUP BY cliente; si `desde_id`, solo clientes con ventas
+    id > desde_id y los `pendientes`.
+    """
+    v = particiones.ventas()
+    q = select(
+        v.cliente_id,
+        func.max(v.fecha),
+        func.count(v.id),
+        func.coalesce(func.sum(v.total), 0.0),
+    ).where(v.cliente_id.isnot(None))
+    if desde_id:
+        recientes = particiones.ventas(ids=(desde_id + 1, None))
+        nuevos = select(recientes.cliente_id).where(recientes.id > desde_id).distinct()
+        q = q.where(or_(v.cliente_id.in_(nuevos), v.cliente_id.in_(list(pendientes))) if pendientes
+                    else v.cliente_id.in_(nuevos))
+    return db.session.execute(q.group_by(v.cliente_id)).all()
+
+
+def _guardar_agregados(filas, ahora, completo, pendientes=()):
+    """
+    Reemplaza los agregados de esos clientes (borrado + insert masivo). Un
+    pendiente sin ventas (todas pasaron a otro cliente) queda borrado.
+    """
+    if completo:
+        db.session.execute(delete(SegmentoCliente))
+    elif filas or pendientes:
+        ids = sorted({f[0] for f in filas}.union(pendientes))
+        for i in range(0, len(ids), 5000):
+            db.session.execute(delete(SegmentoCliente).where(SegmentoCliente.cliente_id.in_(ids[i:i + 5000])))
+    if filas:
+        db.session.execute(insert(SegmentoCliente), [
+            {"cliente_id": cid, "ultima_compra": ultima, "frecuencia": int(freq),
+             "monto": float(monto), "segmento": None, "actualizado": ahora}
+            for cid, ultima, freq, monto in filas
+        ])
+
+
+def clasificar(recencia, frecuencia, monto):
+    """
+    Reglas RFM vectorizadas. Umbrales: mediana de frecuencia y percentil 75 de
+    monto, con el mismo criterio de siempre (elemento k = int(n*q) del orden).
+    """
+    n = len(frecuencia)
+    p50_freq = np.partition(frecuencia, n // 2)[n // 2]
+    k75 = min(int(n * 0.75), n - 1)
+    p75_monto = np.partition(monto, k75)[k75]
+    return np.select(
+        [(monto > p75_monto) & (frecuencia > p50_freq), recencia > 90, frecuencia > p50_freq],
+        ["VIP", "En Riesgo", "Regular"],
+        default="Ocasional",
+    )
+
+
+def segmentar(completo: bool = False, avance=lambda fraccion, mensaje: None):
+    """
+    Ejecuta una corrida; devuelve {"recalculados", "cambiados", "clientes"}.
+    `avance(fraccion, mensaje)` informa el progreso antes de escribir.
+    """
+    ahora = datetime.now()
+    marca = db.session.get(Metadato, MARCA)
+    pendientes = derivados.pendientes(PENDIENTE)
+    completo = completo or marca is None or len(pendientes) > derivados.MAX_CLIENTES_PENDIENTES
+    desde_id = None if completo else int(marca.valor)
+    clientes = [] if completo else [int(c[len(PENDIENTE):]) for c in pendientes]
+    max_id = particiones.max_id()
+
+    avance(0.05, "agregando ventas por cliente" + ("" if completo else " (incremental)"))
+    filas = _agregados(desde_id, clientes) if desde_id is None or max_id > desde_id or clientes else []
+    avance(0.7, f"guardando {len(filas)} clientes y clasificando")
+    _guardar_agregados(filas, ahora, desde_id is None, clientes)
+
+    guardados = db.session.execute(select(
+        SegmentoCliente.cliente_id, SegmentoCliente.ultima_compra,
+        SegmentoCliente.frecuencia, SegmentoCliente.monto, SegmentoCliente.segmento,
+    )).all()
+    cambiados = 0
+    if guardados:
+        ids, ultimas, freq, monto, actual = zip(*guardados)
+        ultimas = np.array(ultimas, dtype="datetime64[s]")
+        recencia = (np.datetime64(ahora, "s") - ultimas).astype("timedelta64[D]").astype(np.int64)
+        nuevo = clasificar(recencia, np.array(freq, dtype=np.int64), np.array(monto, dtype=float))
+        distintos = np.flatnonzero(nuevo != np.array(actual, dtype=object))
+        if len(distintos):
+            db.session.execute(update(SegmentoCliente), [
+                {"cliente_id": ids[i], "segmento": str(nuevo[i]), "actualizado": ahora} for i in distintos
+            ])
+        cambiados = len(distintos)
+
+    derivados.borrar(pendientes)
+    marca = marca or Metadato(clave=MARCA)
+    marca.valor = str(max_id)
+    db.session.add(marca)
+    bump_data_version()
+    db.session.commit()
+    return {"recalculados": len(filas), "cambiados": cambiados, "clientes": len(guardados)}
+
+
+def listar(segmento: str | None = None, limite: int = 1000, offset: int = 0):
+    """Lee la segmentación guardada (no recalcula)."""
+    q = db.session.query(
+        SegmentoCliente.cliente_id, Cliente.nombre, SegmentoCliente.ultima_compra,
+        SegmentoCliente.frecuencia, SegmentoCliente.monto, SegmentoCliente.segmento,
+    ).join(Cliente, Cliente.id == SegmentoCliente.cliente_id)
+    if segmento:
+        q = q.filter(SegmentoCliente.segmento == segmento)
+    q = q.order_by(SegmentoCliente.monto.desc(), SegmentoCliente.cliente_id).offset(offset).limit(limite)
+
+    ahora = datetime.now()
+    return [{
+        "cliente_id": cid,
+        "nombre": nombre,
+        "recencia": (ahora - ultima).days if ultima else 9999,
+        "frecuencia": int(freq or 0),
+        "monto": float(round(monto or 0.0, 2)),
+        "segmento": seg,
+    } for cid, nombre, ultima, freq, monto, seg in q.all()]
+
+
+def resumen():
+    """Clientes por segmento."""
+    filas = db.session.query(SegmentoCliente.segmento, func.count()) \
+        .group_by(SegmentoCliente.segmento).all()
+    return {seg: int(n) for seg, n in filas if seg}
+
+
+def main():
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Segmentación RFM de clientes")
+    parser.add_argument("--completo", action="store_true", help="recalcula todos los clientes")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        res = segmentar(completo=args.completo)
+        print(f"Clientes recalculados: {res['recalculados']}, segmentos cambiados: "
+              f"{res['cambiados']} de {res['clientes']}")
+        print("Resumen:", resumen())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# app/servidor.py
+"""
+Servidor de producción con prefork (Linux/macOS).
+
+El proceso maestro crea la app una sola vez, calienta las cachés de
+analytics (lista de productos, rango de fechas, KPIs y dashboard del rango
+por defecto), cierra sus conexiones y hace fork de N workers que comparten
+esa memoria copy-on-write y aceptan sobre el mismo socket. Con MULTI_TENANT
+toda ruta /api/ necesita empresa: se calientan solo las de --calentar-empresas
+(ninguna si no se indica).
+
+Recarga en caliente (nueva generación de workers ya calentada; los viejos
+terminan sus requests en curso y salen):
+  - al recibir SIGHUP;
+  - cuando el ETL termina (marca `etl_terminado` en metadatos, revisada cada
+    SERVIDOR_REVISAR_ETL segundos).
+
+    python -m app.servidor --workers 4 --port 8000
+
+En Windows (sin fork) corre un único proceso con hilos.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+log = logging.getLogger("insight.servidor")
+
+RUTAS_CALENTAR = ("/api/productos", "/api/rango-fechas", "/api/kpis", "/api/dashboard")
+
+
+def crear_y_calentar(empresas=()):
+    """
+    Crea la app, ejecuta las rutas de RUTAS_CALENTAR (con MULTI_TENANT, una vez
+    por cada empresa de `empresas`) y deja el proceso listo para fork.
+    """
+    from app import create_app
+    from app import metricas, tenants
+    from app.models import db
+
+    app = create_app()
+    cliente = app.test_client()
+    if app.config.get("MULTI_TENANT"):
+        cabecera = app.config.get("TENANT_HEADER", "X-Tenant")
+        pedidos = [(e, {cabecera: e}) for e in empresas]
+        if not pedidos:
+            log.info("MULTI_TENANT sin --calentar-empresas: no se calientan cachés")
+    else:
+        pedidos = [(None, {})]
+    for empresa, cabeceras in pedidos:
+        for ruta in RUTAS_CALENTAR:
+            t0 = time.perf_counter()
+            resp = cliente.get(ruta, headers=cabeceras)
+            if empresa and resp.status_code == 404:
+                log.warning("empresa %s desconocida: no se calienta", empresa)
+                break
+            log.info("calentado %s%s -> %s en %.1f ms", ruta, f" ({empresa})" if empresa else "",
+                     resp.status_code, (time.perf_counter() - t0) * 1000)
+    metricas.registro.limpiar()          # el calentamiento no cuenta como tráfico
+    with app.app_context():
+        db.engine.dispose()              # ninguna conexión abierta cruza el fork
+    tenants.pool.cerrar_todos()
+    return app
+
+
+def marca_etl(app):
+    """Valor de la marca que deja el ETL al terminar (None si nunca corrió)."""
+    from app.models import db, Metadato
+
+    with app.app_context():
+        meta = db.session.get(Metadato, "etl_terminado")
+        valor = meta.valor if meta else None
+        db.session.remove()
+        db.engine.dispose()
+    return valor
+
+
+# ---------- Worker ----------
+def _worker(app, sock, host, port):
+    """Atiende requests hasta recibir SIGTERM; luego espera los que están en curso."""
+    servidor = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    servidor.daemon_threads = False      # server_close() espera a los requests en curso
+
+    def _terminar(_sig, _frame):
+        from app import stream
+        stream.cerrar()                  # los /api/stream abiertos no terminan solos
+        threading.Thread(target=servidor.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _terminar)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    try:
+        servidor.serve_forever()
+    finally:
+        servidor.server_close()
+        from app import ingesta
+        ingesta.drenar()                 # os._exit no corre atexit
+    os._exit(0)
+
+
+# ---------- Maestro ----------
+class Maestro:
+    def __init__(self, host, port, workers, gracia, revisar_etl, empresas=()):
+        self.host, self.port = host, port
+        self.n_workers = workers
+        self.gracia = gracia
+        self.revisar_etl = revisar_etl
+        self.empresas = empresas
+        self.sock = socket.create_server((host, port), backlog=1024)
+        self.sock.set_inheritable(True)
+        self.workers = set()
+        self.app = None
+        self._recargar = False
+        self._salir = False
+
+    def _fork_workers(self, app, n):
+        nuevos = set()
+        for _ in range(n):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    _worker(app, self.sock, self.host, self.port)
+                finally:
+                    os._exit(1)
+            nuevos.add(pid)
+        return nuevos
+
+    def _detener(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        limite = time.monotonic() + self.gracia
+        pendientes = set(pids)
+        while pendientes and time.monotonic() < limite:
+            for pid in list(pendientes):
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    pendientes.discard(pid)
+            time.sleep(0.05)
+        for pid in pendientes:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+    def recargar(self):
+        """Nueva generación calentada con los datos actuales; luego se retira la vieja."""
+        t0 = time.perf_counter()
+        app = crear_y_calentar(self.empresas)
+        viejos = self.workers
+        self.workers = self._fork_workers(app, self.n_workers)
+        self.app = app
+        self._detener(viejos)
+        log.info("recarga lista en %.2fs (workers %s)", time.perf_counter() - t0, sorted(self.workers))
+
+    def correr(self):
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "_recargar", True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "_salir", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "_salir", True))
+
+        self.app = crear_y_calentar(self.empresas)
+        marca = marca_etl(self.app)
+        self.workers = self._fork_workers(self.app, self.n_workers)
+        log.info("escuchando en http://%s:%s con %d workers", self.host, self.port, self.n_workers)
+
+        proxima_revision = time.monotonic() + self.revisar_etl
+        while not self._salir:
+            # reponer workers caídos
+            for pid in list(self.workers):
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    self.workers.discard(pid)
+                    log.warning("worker %s terminó; se reemplaza", pid)
+                    self.workers |= self._fork_workers(self.app, 1)
+
+            if self.revisar_etl and time.monotonic() >= proxima_revision:
+                proxima_revision = time.monotonic() + self.revisar_etl
+                nueva = marca_etl(self.app)
+                if nueva != marca:
+                    log.info("el ETL terminó (%s): recargando", nueva)
+                    marca = nueva
+                    self._recargar = True
+
+            if self._recargar:
+                self._recargar = False
+                self.recargar()
+            time.sleep(0.2)
+
+        self._detener(self.workers)
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de producción (prefork)")
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SERVIDOR_WORKERS", 0)),
+                        help="procesos (0 = nº de núcleos)")
+    parser.add_argument("--gracia", type=float, default=30.0,
+                        help="segundos para que un worker termine sus requests al recargar/salir")
+    parser.add_argument("--revisar-etl", type=float,
+                        default=float(os.environ.get("SERVIDOR_REVISAR_ETL", 5)),
+                        help="cada cuántos segundos revisar si terminó el ETL (0 = nunca)")
+    parser.add_argument("--calentar-empresas", default=os.environ.get("SERVIDOR_CALENTAR_EMPRESAS", ""),
+                        help="con MULTI_TENANT: empresas a calentar, separadas por coma")
+    args = parser.parse_args()
+    empresas = [e.strip().lower() for e in args.calentar_empresas.split(",") if e.strip()]
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(name)s: %(message)s")
+    if not hasattr(os, "fork"):
+        app = crear_y_calentar(empresas)
+        log.info("sin fork en esta plataforma: un solo proceso en http://%s:%s", args.host, args.port)
+        make_server(args.host, args.port, app, threaded=True).serve_forever()
+        return
+
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    Maestro(args.host, args.port, workers, args.gracia, args.revisar_etl, empresas).correr()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+# app/sketches.py
+"""
+Resúmenes por día para el modo aproximado (approx=1) de KPIs y top productos.
+
+Cada fila de `sketches_dia` guarda, para un día:
+- total, cantidad y nº de ventas (exactos: sumar días da lo mismo que el rollup);
+- un HyperLogLog de los clientes (2^SKETCH_HLL_P registros) en formato
+  disperso: un uint32 por registro no nulo, `registro << 8 | rho`;
+- los SKETCH_TOP_K productos de mayor ingreso del día con su ingreso y
+  cantidad exactos, y como cota de error el ingreso del primer producto que
+  quedó afuera (ningún producto no guardado vendió más que eso ese día).
+
+Un rango se responde fusionando solo los días que cubre: máximo por registro
+para el HLL y suma por producto para el top. Los errores vuelven en la
+respuesta: ±2σ (≈95 %) del HLL, σ = 1,04 / √(2^p), y para cada producto la
+suma de las cotas de los días en que no estuvo entre los K guardados.
+
+El ETL los refresca al terminar, solo los días de las ventas nuevas (id
+mayor a la marca) y los pendientes: las ventas que el ETL o la ingesta en
+vivo escriben con id menor o igual (actualizaciones, envíos fuera de orden,
+CSV con ids no monótonos) dejan su día pendiente (app/derivados.py), y hasta
+recalcularlo `listos()` da False. A mano:
+
+    python -m app.sketches [--completo]
+"""
+import argparse
+import math
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select, delete, insert
+
+from .models import db, Metadato, SketchDia
+from .cache import bump_data_version
+from . import derivados, particiones
+
+MARCA = derivados.MARCA_SKETCHES
+PARAMETROS = "sketches_parametros"
+PENDIENTE = derivados.DIA_PENDIENTE
+LOTE_LECTURA = 50_000
+CONFIANZA_SIGMAS = 2.0
+
+# fila del top guardado: producto, ingreso, cantidad
+TOP_DTYPE = np.dtype([("producto_id", "<i4"), ("total", "<f8"), ("cantidad", "<i8")])
+
+
+def parametros():
+    """(p del HLL, k del top) según la configuración."""
+    cfg = current_app.config
+    p = int(cfg.get("SKETCH_HLL_P", 16))
+    if not 4 <= p <= 18:
+        raise ValueError(f"SKETCH_HLL_P fuera de rango (4..18): {p}")
+    return p, int(cfg.get("SKETCH_TOP_K", 500))
+
+
+# ---------- HyperLogLog ----------
+def _hash64(valores):
+    """splitmix64 vectorizado (ids enteros -> uint64 bien mezclados)."""
+    with np.errstate(over="ignore"):
+        z = np.asarray(valores, dtype=np.int64).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def hll_pares(clientes, p):
+    """Registro (p bits altos) y rho (1 + ceros a la izquierda de los 32 bits siguientes)."""
+    h = _hash64(clientes)
+    registro = (h >> np.uint64(64 - p)).astype(np.uint32)
+    resto = ((h << np.uint64(p)) >> np.uint64(32)).astype(np.float64)   # 32 bits: exacto en float
+    rho = (33 - np.frexp(resto)[1]).astype(np.uint32)                  # resto == 0 -> 33
+    return registro, rho
+
+
+def hll_estimar(registros: np.ndarray) -> float:
+    """Estimador de HLL con corrección de rango bajo (linear counting)."""
+    m = len(registros)
+    alfa = 0.7213 / (1 + 1.079 / m)
+    estimado = alfa * m * m / float(np.sum(np.ldexp(1.0, -registros.astype(np.int64))))
+    ceros = int(np.count_nonzero(registros == 0))
+    if estimado <= 2.5 * m and ceros:
+        estimado = m * math.log(m / ceros)
+    return estimado
+
+
+def hll_error_relativo(p: int) -> float:
+    return 1.04 / math.sqrt(1 << p)
+
+
+def _fusionar_hll(blobs, p) -> np.ndarray:
+    """Máximo por registro de varios HLL dispersos."""
+    registros = np.zeros(1 << p, dtype=np.uint8)
+    pares = np.frombuffer(b"".join(b for b in blobs if b), dtype="<u4")
+    if len(pares):
+        np.maximum.at(registros, pares >> 8, (pares & 0xFF).astype(np.uint8))
+    return registros
+
+
+# ---------- Construcción ----------
+def _leer(desde=None, hasta_excl=None):
+    """(día epoch, cliente, producto, cantidad, total) de las ventas en [desde, hasta_excl)."""
+    v = particiones.ventas(desde, hasta_excl)
+    stmt = select(v.fecha, v.cliente_id, v.producto_id, v.cantidad, v.total) \
+        .where(v.fecha.isnot(None))
+    if desde is not None:
+        stmt = stmt.where(v.fecha >= desde)
+    if hasta_excl is not None:
+        stmt = stmt.where(v.fecha < hasta_excl)
+    partes = [[], [], [], [], []]
+    for lote in db.session.execute(stmt.execution_options(yield_per=LOTE_LECTURA)).partitions():
+        fecha, cli, prod, cant, total = zip(*lote)
+        partes[0].append(np.array(fecha, dtype="datetime64[D]").astype(np.int64))
+        partes[1].append(np.array([-1 if v is None else v for v in cli], dtype=np.int64))
+        partes[2].append(np.array([-1 if v is None else v for v in prod], dtype=np.int64))
+        partes[3].append(np.array([v or 0 for v in cant], dtype=np.int64))
+        partes[4].append(np.array([v or 0.0 for v in total], dtype=np.float64))
+    tipos = (np.int64, np.int64, np.int64, np.int64, np.float64)
+    return [np.concatenate(c) if c else np.empty(0, dtype=t) for c, t in zip(partes, tipos)]
+
+
+def construir(dia, cliente, producto, cantidad, total, p, k):
+    """Arrays de ventas -> lista de filas de sketches_dia, una por día presente."""
+    if not len(dia):
+        return []
+    dias, d_idx = np.unique(dia, return_inverse=True)
+    n_dias = len(dias)
+    tot_dia = np.bincount(d_idx, weights=total, minlength=n_dias)
+    cant_dia = np.bincount(d_idx, weights=cantidad, minlength=n_dias)
+    n_dia = np.bincount(d_idx, minlength=n_dias)
+
+    # HLL: máximo rho por (día, registro); clientes nulos no cuentan
+    con_cliente = cliente >= 0
+    registro, rho = hll_pares(cliente[con_cliente], p)
+    clave = d_idx[con_cliente].astype(np.int64) << 32 | (registro.astype(np.int64) << 8 | rho)
+    clave.sort()
+    dia_reg = clave >> 8
+    ultimo = np.r_[dia_reg[1:] != dia_reg[:-1], True] if len(clave) else np.zeros(0, bool)
+    clave = clave[ultimo]
+    hll_dia = clave >> 32
+    pares = (clave & 0xFFFFFFFF).astype("<u4")
+    cortes_hll = np.searchsorted(hll_dia, np.arange(n_dias + 1))
+
+    # top: ingreso y cantidad por (día, producto), los k mayores de cada día
+    base = int(producto.max()) + 2
+    dp, dp_idx = np.unique(d_idx.astype(np.int64) * base + (producto + 1), return_inverse=True)
+    dp_dia, dp_prod = dp // base, dp % base - 1
+    dp_total = np.bincount(dp_idx, weights=total, minlength=len(dp))
+    dp_cant = np.bincount(dp_idx, weights=cantidad, minlength=len(dp))
+    orden = np.lexsort((dp_prod, -dp_total, dp_dia))
+    dp_dia = dp_dia[orden]
+    cortes_top = np.searchsorted(dp_dia, np.arange(n_dias + 1))
+    rango = np.arange(len(orden)) - cortes_top[dp_dia]
+
+    top = np.empty(len(orden), dtype=TOP_DTYPE)
+    top["producto_id"] = dp_prod[orden]
+    top["total"] = dp_total[orden]
+    top["cantidad"] = np.rint(dp_cant[orden]).astype(np.int64)
+    error = np.zeros(n_dias)
+    afuera = rango == k
+    error[dp_dia[afuera]] = top["total"][afuera]
+
+    filas = []
+    for i in range(n_dias):
+        a, b = cortes_top[i], min(cortes_top[i] + k, cortes_top[i + 1])
+        filas.append({
+            "fecha": date(1970, 1, 1) + timedelta(days=int(dias[i])),
+            "total": float(tot_dia[i]),
+            "cantidad": int(round(cant_dia[i])),
+            "n": int(n_dia[i]),
+            "clientes": pares[cortes_hll[i]:cortes_hll[i + 1]].tobytes(),
+            "top": top[a:b].tobytes(),
+            "top_error": float(error[i]),
+        })
+    return filas
+
+
+def refrescar(completo: bool = False, avance=lambda fraccion, mensaje: None) -> dict:
+    """
+    Pone sketches_dia al día con ventas. Devuelve {"modo", "dias"}.
+    `avance(fraccion, mensaje)` informa el progreso antes de escribir.
+    """
+    p, k = parametros()
+    firma = f"p={p},k={k}"
+    marca = db.session.get(Metadato, MARCA)
+    guardados = db.session.get(Metadato, PARAMETROS)
+    max_id = particiones.max_id()
+    pendientes = derivados.pendientes(PENDIENTE)
+    completo = completo or marca is None or guardados is None or guardados.valor != firma
+
+    if completo:
+        avance(0.05, "leyendo ventas")
+        cols = _leer()
+        avance(0.6, "construyendo sketches")
+        filas = construir(*cols, p, k)
+        avance(0.9, "guardando")
+        db.session.execute(delete(SketchDia))
+        modo = "completo"
+    else:
+        desde_id = int(marca.valor)
+        if max_id <= desde_id and not pendientes:
+            return {"modo": "sin cambios", "dias": 0}
+        v = particiones.ventas(ids=(desde_id + 1, None))
+        nuevas = db.session.execute(
+            select(v.fecha).where(v.id > desde_id, v.fecha.isnot(None))
+        ).scalars().all() if max_id > desde_id else []
+        dias = np.unique(np.concatenate([
+            np.array(nuevas, dtype="datetime64[D]"),
+            np.array([c[len(PENDIENTE):] for c in pendientes], dtype="datetime64[D]"),
+        ]))
+        filas = []
+        if len(dias):
+            avance(0.05, f"leyendo {len(dias)} días")
+            # una lectura por tramo de días consecutivos (no todo lo que hay entre el primero y el último)
+            cols = []
+            for tramo in np.split(dias, np.flatnonzero(np.diff(dias) > np.timedelta64(1, "D")) + 1):
+                cols.append(_leer(datetime.combine(tramo[0].astype(datetime), datetime.min.time()),
+                                  datetime.combine(tramo[-1].astype(datetime) + timedelta(days=1),
+                                                   datetime.min.time())))
+            filas = construir(*(np.concatenate(c) for c in zip(*cols)), p, k)
+            avance(0.9, "guardando")
+            db.session.execute(delete(SketchDia).where(SketchDia.fecha.in_(dias.astype(datetime).tolist())))
+        modo = "incremental"
+
+    derivados.borrar(pendientes)
+    if filas:
+        db.session.execute(insert(SketchDia), filas)
+    marca = marca or Metadato(clave=MARCA)
+    marca.valor = str(max_id)
+    guardados = guardados or Metadato(clave=PARAMETROS)
+    guardados.valor = firma
+    db.session.add_all([marca, guardados])
+    bump_data_version()
+    db.session.commit()
+    return {"modo": modo, "dias": len(filas)}
+
+
+# ---------- Consultas ----------
+def listos() -> bool:
+    """True si los sketches cubren todas las ventas, sin días pendientes, y usan la configuración vigente."""
+    marca = db.session.get(Metadato, MARCA)
+    guardados = db.session.get(Metadato, PARAMETROS)
+    if marca is None or guardados is None or guardados.valor != "p={},k={}".format(*parametros()):
+        return False
+    if derivados.hay_pendientes(PENDIENTE):
+        return False
+    return int(marca.valor) >= particiones.max_id()
+
+
+def _filtrar(q, desde, hasta_excl):
+    if desde is not None:
+        q = q.where(SketchDia.fecha >= desde.date())
+    if hasta_excl is not None:
+        q = q.where(SketchDia.fecha < hasta_excl.date())
+    return q
+
+
+def kpis(desde, hasta_excl, prev_desde):
+    """
+    Igual que _kpis_una_pasada (límites alineados a días), con clientes únicos
+    del HLL. Devuelve ((total, cantidad, nº ventas, clientes, total anterior), error).
+    """
+    p, _ = parametros()
+    filas = db.session.execute(_filtrar(
+        select(SketchDia.fecha, SketchDia.total, SketchDia.cantidad, SketchDia.n, SketchDia.clientes),
+        prev_desde or desde, hasta_excl,
+    )).all()
+    limite = desde.date() if desde is not None else None
+    actuales = [f for f in filas if limite is None or f[0] >= limite]
+    anterior = sum(f[1] or 0.0 for f in filas if prev_desde is not None and f[0] < limite)
+
+    estimado = hll_estimar(_fusionar_hll([f[4] for f in actuales], p)) if actuales else 0.0
+    relativo = hll_error_relativo(p)
+    clientes = int(round(estimado))
+    margen = CONFIANZA_SIGMAS * relativo * estimado
+    error = {
+        "clientes_unicos": {
+            "error_relativo": round(relativo, 5),
+            "min": max(int(math.floor(estimado - margen)), 0),
+            "max": int(math.ceil(estimado + margen)),
+            "confianza": 0.95,
+        },
+        "dias": len(actuales),
+    }
+    return (
+        float(sum(f[1] or 0.0 for f in actuales)),
+        int(sum(f[2] or 0 for f in actuales)),
+        int(sum(f[3] or 0 for f in actuales)),
+        clientes,
+        float(anterior),
+    ), error
+
+
+def top_productos(limite, desde, hasta_excl):
+    """
+    Top por ingreso fusionando los top-K diarios. Devuelve (ids, cantidad,
+    ingreso, ingreso_max, error_fuera): `ingreso` suma solo los días en que el
+    producto estuvo entre los K (cota inferior), `ingreso_max` le agrega las
+    cotas de los demás días y `error_fuera` acota a cualquier producto no listado.
+    """
+    filas = db.session.execute(_filtrar(select(SketchDia.top, SketchDia.top_error), desde, hasta_excl)).all()
+    if not filas:
+        return [], [], [], [], 0.0
+    blobs = [f[0] or b"" for f in filas]
+    errores = np.array([f[1] or 0.0 for f in filas])
+    top = np.frombuffer(b"".join(blobs), dtype=TOP_DTYPE)
+    err_fila = np.repeat(errores, [len(b) // TOP_DTYPE.itemsize for b in blobs])
+    error_total = float(errores.sum())
+
+    ids, inv = np.unique(top["producto_id"], return_inverse=True)
+    ingreso = np.bincount(inv, weights=top["total"], minlength=len(ids))
+    cantidad = np.bincount(inv, weights=top["cantidad"], minlength=len(ids))
+    ingreso_max = ingreso + (error_total - np.bincount(inv, weights=err_fila, minlength=len(ids)))
+
+    orden = np.lexsort((ids, -ingreso))
+    elegidos, resto = orden[:limite], orden[limite:]
+    # lo que queda afuera puede ser un producto guardado algún día o uno nunca guardado
+    error_fuera = max(float(ingreso_max[resto].max()) if len(resto) else 0.0, error_total)
+    return (ids[elegidos].tolist(), np.rint(cantidad[elegidos]).astype(np.int64).tolist(),
+            ingreso[elegidos].tolist(), ingreso_max[elegidos].tolist(), error_fuera)
+
+
+def main():
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Recalcula los sketches diarios (approx=1)")
+    parser.add_argument("--completo", action="store_true", help="recalcula todos los días")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        res = refrescar(completo=args.completo)
+        print(f"Sketches ({res['modo']}): {res['dias']} días.")
+
+
+if __name__ == "__main__":
+    main()
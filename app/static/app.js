@@ -27,6 +27,21 @@ document.addEventListener("DOMContentLoaded", () => {
   // Gráficos: manejamos referencias para destruir/recrear
   let chartHora = null, chartDia = null;
 
+  // GET condicional: guardamos ETag + JSON por URL y reenviamos If-None-Match;
+  // si el servidor responde 304 reutilizamos el JSON guardado.
+  const cacheHttp = new Map();
+  async function getJSON(url) {
+    const previo = cacheHttp.get(url);
+    const headers = previo ? { "If-None-Match": previo.etag } : {};
+    const r = await fetch(url, { headers, cache: "no-store" });
+    if (r.status === 304 && previo) return previo.data;
+    if (!r.ok) throw new Error(`${url}: HTTP ${r.status}`);
+    const data = await r.json();
+    const etag = r.headers.get("ETag");
+    if (etag) cacheHttp.set(url, { etag, data });
+    return data;
+  }
+
   function qs() {
     const p = new URLSearchParams();
     if (state.desde) p.set("desde", state.desde);
@@ -35,68 +50,44 @@ document.addEventListener("DOMContentLoaded", () => {
     return s ? `?${s}` : "";
   }
 
-  async function pintarKPIs() {
-    try {
-      const r = await fetch(`/api/kpis${qs()}`);
-      const k = await r.json();
-      document.getElementById("kpi-ventas-mes").textContent = fmtMoney(k.ventas_mes);
-      document.getElementById("kpi-crecimiento").textContent = fmtPercent(k.crecimiento);
-      document.getElementById("kpi-ticket").textContent = fmtMoney(k.ticket_promedio);
-      document.getElementById("kpi-clientes").textContent = Number(k.clientes_unicos ?? 0).toLocaleString("es-CO");
-    } catch (e) {
-      console.error(e);
-    }
+  function pintarKPIs(k) {
+    document.getElementById("kpi-ventas-mes").textContent = fmtMoney(k.ventas_mes);
+    document.getElementById("kpi-crecimiento").textContent = fmtPercent(k.crecimiento);
+    document.getElementById("kpi-ticket").textContent = fmtMoney(k.ticket_promedio);
+    document.getElementById("kpi-clientes").textContent = Number(k.clientes_unicos ?? 0).toLocaleString("es-CO");
   }
 
-  async function pintarTopProductos() {
+  function pintarTopProductos(arr) {
     const body = document.getElementById("top-body");
-    body.innerHTML = `<tr><td colspan="2" class="text-center text-secondary">Cargando…</td></tr>`;
-    try {
-      const r = await fetch(`/api/top-productos${qs()}&limite=10`);
-      const arr = await r.json();
-      if (!arr.length) {
-        body.innerHTML = `<tr><td colspan="2" class="text-center text-secondary">Sin datos</td></tr>`;
-        return;
-      }
-      body.innerHTML = arr.map(x =>
-        `<tr><td>${x.producto || x.nombre}</td><td class="text-end">${fmtMoney(x.monto || x.ingreso || 0)}</td></tr>`
-      ).join("");
-    } catch (e) {
-      body.innerHTML = `<tr><td colspan="2" class="text-center text-danger">Error</td></tr>`;
+    if (!arr.length) {
+      body.innerHTML = `<tr><td colspan="2" class="text-center text-secondary">Sin datos</td></tr>`;
+      return;
     }
+    body.innerHTML = arr.map(x =>
+      `<tr><td>${x.producto || x.nombre}</td><td class="text-end">${fmtMoney(x.monto || x.ingreso || 0)}</td></tr>`
+    ).join("");
   }
 
-  async function pintarGraficas() {
-    try {
-      const [hRes, dRes] = await Promise.all([
-        fetch(`/api/ventas-por-hora${qs()}`),
-        fetch(`/api/ventas-por-dia${qs()}`)
-      ]);
-      const horas = await hRes.json();
-      const dias  = await dRes.json();
-
-      // Hora
-      if (chartHora) chartHora.destroy();
-      chartHora = new Chart(document.getElementById("chart-hora"), {
-        type: "bar",
-        data: {
-          labels: horas.map(x => x.hora),
-          datasets: [{ label: "Ventas", data: horas.map(x => x.ventas) }]
-        }
-      });
-
-      // Día
-      if (chartDia) chartDia.destroy();
-      chartDia = new Chart(document.getElementById("chart-dia"), {
-        type: "bar",
-        data: {
-          labels: dias.map(x => x.dia),
-          datasets: [{ label: "Ventas", data: dias.map(x => x.ventas) }]
-        }
-      });
-    } catch (e) {
-      console.error(e);
-    }
+  function pintarGraficas(horas, dias) {
+    // Hora
+    if (chartHora) chartHora.destroy();
+    chartHora = new Chart(document.getElementById("chart-hora"), {
+      type: "bar",
+      data: {
+        labels: horas.map(x => x.hora),
+        datasets: [{ label: "Ventas", data: horas.map(x => x.ventas) }]
+      }
+    });
+
+    // Día
+    if (chartDia) chartDia.destroy();
+    chartDia = new Chart(document.getElementById("chart-dia"), {
+      type: "bar",
+      data: {
+        labels: dias.map(x => x.dia),
+        datasets: [{ label: "Ventas", data: dias.map(x => x.ventas) }]
+      }
+    });
   }
 
   function prepararFormulario() {
@@ -131,8 +122,58 @@ document.addEventListener("DOMContentLoaded", () => {
     });
   }
 
+  // En vivo (/api/stream): solo para la vista por defecto, sin rango de fechas.
+  // "foto" trae todo; "delta" solo lo que cambió ({índice: valor} en las barras).
+  let stream = null, ultimaFoto = null;
+  function conectarStream() {
+    if (state.desde || state.hasta) {
+      if (stream) { stream.close(); stream = null; }
+      return;
+    }
+    if (stream || !window.EventSource) return;
+    stream = new EventSource("/api/stream");
+    stream.addEventListener("foto", ev => {
+      ultimaFoto = JSON.parse(ev.data);
+      pintarKPIs(ultimaFoto.kpis);
+      pintarTopProductos(ultimaFoto.top_productos);
+      actualizarBarras(chartHora, ultimaFoto.ventas_por_hora);
+      actualizarBarras(chartDia, ultimaFoto.ventas_por_dia);
+    });
+    stream.addEventListener("delta", ev => {
+      const d = JSON.parse(ev.data);
+      if (!ultimaFoto) return;
+      if (d.kpis) {
+        Object.assign(ultimaFoto.kpis, d.kpis);
+        pintarKPIs(ultimaFoto.kpis);
+      }
+      if (d.top_productos) pintarTopProductos(d.top_productos);
+      actualizarBarras(chartHora, d.ventas_por_hora);
+      actualizarBarras(chartDia, d.ventas_por_dia);
+    });
+  }
+
+  // valores: arreglo completo u objeto {índice: valor}
+  function actualizarBarras(chart, valores) {
+    if (!chart || !valores) return;
+    const data = chart.data.datasets[0].data;
+    for (const [i, v] of Object.entries(valores)) data[Number(i)] = v;
+    chart.update();
+  }
+
+  // Un solo request trae todos los paneles (/api/dashboard)
   async function refreshAll() {
-    await Promise.all([pintarKPIs(), pintarTopProductos(), pintarGraficas()]);
+    const body = document.getElementById("top-body");
+    body.innerHTML = `<tr><td colspan="2" class="text-center text-secondary">Cargando…</td></tr>`;
+    try {
+      const d = await getJSON(`/api/dashboard${qs()}`);
+      pintarKPIs(d.kpis);
+      pintarTopProductos(d.top_productos);
+      pintarGraficas(d.ventas_por_hora, d.ventas_por_dia);
+    } catch (e) {
+      console.error(e);
+      body.innerHTML = `<tr><td colspan="2" class="text-center text-danger">Error</td></tr>`;
+    }
+    conectarStream();
   }
 
   // Primera carga
@@ -0,0 +1,216 @@
+# app/storage.py
+"""
+Perfil de almacenamiento: opciones del engine, PRAGMAs de SQLite al conectar,
+índices gestionados y diagnóstico de planes de consulta.
+
+    python -m app.storage --indices   # crea los índices que falten + ANALYZE
+    python -m app.storage --explain   # EXPLAIN QUERY PLAN de cada consulta de analytics
+"""
+import argparse
+import hashlib
+import re
+from datetime import timedelta
+
+from sqlalchemy import event, func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+
+from .models import db, Producto, Cliente, Metadato
+
+
+def opciones_engine(uri: str, config) -> dict:
+    """SQLALCHEMY_ENGINE_OPTIONS según la BD (SQLite en memoria no admite pool por tamaño)."""
+    if uri.startswith("sqlite") and (":memory:" in uri or uri.rstrip("/") == "sqlite:"):
+        return {}
+    return {
+        "pool_size": config.get("DB_POOL_SIZE", 5),
+        "max_overflow": config.get("DB_MAX_OVERFLOW", 10),
+        "pool_recycle": config.get("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": True,
+    }
+
+
+def _aplicar_pragmas(engine, pragmas: dict):
+    """Registra un listener que aplica los PRAGMAs en cada conexión nueva."""
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _al_conectar(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for nombre, valor in pragmas.items():
+            cur.execute(f"PRAGMA {nombre}={valor}")
+        cur.close()
+
+
+def upsert_stmt(table, columnas):
+    """INSERT ... ON CONFLICT(id) DO UPDATE según el dialecto, o None si no lo soporta."""
+    dialecto = db.engine.dialect.name
+    if dialecto == "sqlite":
+        stmt = sqlite_insert(table)
+    elif dialecto == "postgresql":
+        stmt = pg_insert(table)
+    else:
+        return None
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={c: stmt.excluded[c] for c in columnas if c != "id"},
+    )
+
+
+def asegurar_indices(engine=None):
+    """Crea los índices declarados en los modelos que todavía no existan en la BD."""
+    engine = engine or db.engine
+    creados = []
+    inspector = db.inspect(engine)
+    for tabla in db.metadata.sorted_tables:
+        existentes = {i["name"] for i in inspector.get_indexes(tabla.name)}
+        for indice in tabla.indexes:
+            if indice.name not in existentes:
+                indice.create(bind=engine, checkfirst=True)
+                creados.append(indice.name)
+    return creados
+
+
+def version_esquema() -> str:
+    """Huella del esquema declarado en los modelos (tablas, columnas, tipos e índices)."""
+    partes = []
+    for tabla in db.metadata.sorted_tables:
+        partes.append(tabla.name)
+        partes += [f"{c.name}:{c.type!r}:{c.nullable}:{c.primary_key}" for c in tabla.columns]
+        partes += sorted(f"{i.name}:{[c.name for c in i.columns]}" for i in tabla.indexes)
+    return hashlib.sha1("|".join(partes).encode("utf-8")).hexdigest()[:16]
+
+
+def asegurar_esquema(engine=None) -> bool:
+    """
+    Crea tablas e índices solo si la versión guardada en metadatos no coincide
+    con la de los modelos. Devuelve True si tuvo que migrar.
+    """
+    engine = engine or db.engine
+    version = version_esquema()
+    try:
+        with engine.connect() as conn:
+            guardada = conn.execute(
+                text("SELECT valor FROM metadatos WHERE clave = 'esquema_version'")
+            ).scalar()
+    except DBAPIError:
+        guardada = None          # BD nueva: todavía no hay tabla metadatos
+    if guardada == version:
+        return False
+
+    db.metadata.create_all(engine)
+    asegurar_indices(engine)   # create_all no agrega índices nuevos a tablas existentes
+    with engine.begin() as conn:
+        tabla = Metadato.__table__
+        conn.execute(tabla.delete().where(tabla.c.clave == "esquema_version"))
+        conn.execute(tabla.insert().values(clave="esquema_version", valor=version))
+    return True
+
+
+def preparar(app):
+    """Aplica el perfil al engine de la app (llamar dentro de un app context)."""
+    _aplicar_pragmas(db.engine, app.config.get("SQLITE_PRAGMAS", {}))
+
+
+# ---------- Diagnóstico: EXPLAIN QUERY PLAN ----------
+def _capturar_consultas(fn):
+    """Ejecuta fn() y devuelve las (sql, params) que lanzó contra la BD."""
+    capturadas = []
+
+    def _antes(conn, cursor, statement, params, context, executemany):
+        if "metadatos" not in statement:
+            capturadas.append((statement, params))
+
+    event.listen(db.engine, "before_cursor_execute", _antes)
+    try:
+        fn()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", _antes)
+    return capturadas
+
+
+_TABLA_VENTAS = re.compile(r"SCAN ventas(_\d{4}_\d{2})?( |$)")
+
+
+def explicar(desde: str | None = None, hasta: str | None = None):
+    """
+    Corre cada consulta de AnalyticsEngine y muestra su plan (solo SQLite).
+    Devuelve las consultas que recorren `ventas` o una partición completa
+    (SCAN sin índice); el UNION ALL de particiones (`ventas_union`) no cuenta.
+    """
+    from .analytics import AnalyticsEngine as A, _cache_kpis
+    from .particiones import rango_fechas
+
+    if db.engine.dialect.name != "sqlite":
+        raise SystemExit("EXPLAIN QUERY PLAN solo está disponible para SQLite.")
+
+    if not (desde and hasta):
+        fin = rango_fechas()[1]
+        if fin is None:
+            raise SystemExit("No hay ventas para diagnosticar.")
+        hasta = fin.date().isoformat()
+        desde = (fin - timedelta(days=29)).date().isoformat()
+    producto_id = db.session.query(func.min(Producto.id)).scalar()
+    cliente_id = db.session.query(func.min(Cliente.id)).scalar()
+    no_alineado = desde + "T00:00:01"   # fuerza el camino de ventas crudas
+
+    casos = {
+        "get_kpis": lambda: A.get_kpis(desde, hasta),
+        "get_kpis (crudo)": lambda: A.get_kpis(no_alineado, hasta),
+        "get_top_productos": lambda: A.get_top_productos(10, desde, hasta),
+        "get_top_productos (crudo)": lambda: A.get_top_productos(10, no_alineado, hasta),
+        "get_ventas_por_hora": lambda: A.get_ventas_por_hora(desde, hasta),
+        "get_ventas_por_hora (crudo)": lambda: A.get_ventas_por_hora(no_alineado, hasta),
+        "get_ventas_por_dia_semana": lambda: A.get_ventas_por_dia_semana(desde, hasta),
+        "get_heatmap_hora_dia": lambda: A.get_heatmap_hora_dia(desde, hasta),
+        "calcular_clv": lambda: A.calcular_clv(cliente_id),
+        "predecir_demanda": lambda: A.predecir_demanda(producto_id, 30),
+    }
+
+    completos = []
+    with db.engine.connect() as conn:
+        for nombre, fn in casos.items():
+            _cache_kpis.clear()
+            print(f"== {nombre}")
+            for sql, params in _capturar_consultas(fn):
+                plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, params).all()
+                print("   " + " ".join(sql.split())[:140])
+                for fila in plan:
+                    detalle = fila[-1]
+                    print("     -", detalle)
+                    if _TABLA_VENTAS.match(detalle) and "INDEX" not in detalle:
+                        completos.append((nombre, detalle))
+    return completos
+
+
+def main():
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Índices y diagnóstico de consultas")
+    parser.add_argument("--indices", action="store_true", help="crea índices faltantes y ejecuta ANALYZE")
+    parser.add_argument("--explain", action="store_true", help="EXPLAIN QUERY PLAN de analytics")
+    parser.add_argument("--desde")
+    parser.add_argument("--hasta")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.indices:
+            creados = asegurar_indices()
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql("ANALYZE")
+            print("Índices creados:", ", ".join(creados) or "ninguno (ya existían)")
+        if args.explain:
+            completos = explicar(args.desde, args.hasta)
+            if completos:
+                print(f"\n{len(completos)} consultas recorren ventas completa:")
+                for nombre, detalle in completos:
+                    print(f"  {nombre}: {detalle}")
+                raise SystemExit(1)
+            print("\nNinguna consulta recorre ventas completa.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+# app/stream.py
+"""
+Actualizaciones en vivo del tablero por Server-Sent Events (GET /api/stream).
+
+Un hilo vigía por proceso detecta commits nuevos y, solo entonces, arma
+una foto de la vista por defecto del tablero (KPIs del mes, ventas por
+hora y por día de la semana, top productos). Compara esa foto con la
+anterior y manda el mismo delta a todos los suscriptores de la empresa.
+Con decenas de pantallas abiertas el trabajo es una foto por commit, no
+una por pantalla.
+
+- En SQLite los commits se detectan por tamaño/mtime del archivo y de su
+  -wal (un stat, sin consultar la BD); solo si cambiaron se lee la versión
+  de datos. En otros motores se lee la versión cada STREAM_INTERVALO_S.
+- La ingesta (app/ingesta.py) despierta al vigía apenas confirma un lote.
+- Eventos: "foto" al conectar (estado completo) y "delta" con solo lo que
+  cambió; cada STREAM_LATIDO_S sin novedades se manda un comentario.
+- Un suscriptor que no consume (cola llena) recibe una foto nueva en vez de
+  los deltas que se perdió.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+
+from .cache import data_version
+from . import tenants
+
+log = logging.getLogger("insight.stream")
+
+COLA_SUSCRIPTOR = 64
+_FIN = object()
+
+
+# ---------- Foto y deltas ----------
+def foto(limite_top: int = 10) -> dict:
+    """Vista por defecto del tablero (sin rango); usa las cachés de analytics."""
+    from .analytics import AnalyticsEngine
+
+    return {
+        "kpis": AnalyticsEngine.get_kpis(),
+        "ventas_por_hora": [x["ventas"] for x in AnalyticsEngine.get_ventas_por_hora()],
+        "ventas_por_dia": [x["ventas"] for x in AnalyticsEngine.get_ventas_por_dia_semana()],
+        "top_productos": AnalyticsEngine.get_top_productos(limite=limite_top),
+    }
+
+
+def diferencias(anterior: dict | None, nueva: dict) -> dict:
+    """
+    Delta compacto entre dos fotos: KPIs que cambiaron, {índice: valor} de
+    los buckets de hora/día que cambiaron y el top completo si cambió.
+    """
+    if anterior is None:
+        return dict(nueva)
+    delta = {}
+    kpis = {k: v for k, v in nueva["kpis"].items() if anterior["kpis"].get(k) != v}
+    if kpis:
+        delta["kpis"] = kpis
+    for serie in ("ventas_por_hora", "ventas_por_dia"):
+        viejo = anterior[serie]
+        cambios = {str(i): v for i, v in enumerate(nueva[serie]) if i >= len(viejo) or viejo[i] != v}
+        if cambios:
+            delta[serie] = cambios
+    if nueva["top_productos"] != anterior["top_productos"]:
+        delta["top_productos"] = nueva["top_productos"]
+    return delta
+
+
+def _evento(tipo: str, datos: dict) -> str:
+    return f"event: {tipo}\ndata: {json.dumps(datos, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+def _firma_bd(url):
+    """(tamaño, mtime) del archivo SQLite y de su -wal; None si no es un archivo."""
+    if url.get_backend_name() != "sqlite" or not url.database or url.database == ":memory:":
+        return None
+    firma = []
+    for ruta in (url.database, url.database + "-wal"):
+        try:
+            st = os.stat(ruta)
+            firma.append((st.st_size, st.st_mtime_ns))
+        except OSError:
+            firma.append(None)
+    return tuple(firma)
+
+
+# ---------- Suscriptores ----------
+class Suscriptor:
+    def __init__(self, canal):
+        self.canal = canal
+        self.cola = queue.Queue(maxsize=COLA_SUSCRIPTOR)
+
+    def enviar(self, texto):
+        try:
+            self.cola.put_nowait(texto)
+        except queue.Full:
+            # se atrasó: descartar lo pendiente y mandarle el estado completo
+            while True:
+                try:
+                    self.cola.get_nowait()
+                except queue.Empty:
+                    break
+            self.cola.put_nowait(self.canal.evento_foto())
+
+    def siguiente(self, timeout: float):
+        """Próximo evento (texto), None si no hubo novedades, _FIN si se cerró."""
+        try:
+            return self.cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Canal:
+    """Suscriptores de una empresa y la última foto enviada."""
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.suscriptores = set()
+        self.foto = None
+        self.version = None
+        self.firma = None
+        self.lock = threading.Lock()
+
+    def evento_foto(self) -> str:
+        return _evento("foto", {"version": self.version, **self.foto})
+
+    def revisar(self, app, limite_top):
+        """Si hubo un commit desde la última revisión, calcula el delta y lo difunde."""
+        with app.app_context(), tenants.activar(self.tenant):
+            from .models import db
+
+            firma = _firma_bd(db.engine.url)
+            if firma is not None and firma == self.firma:
+                return
+            version = data_version(fresca=True)
+            self.firma = firma
+            if version == self.version:
+                db.session.remove()
+                return
+            nueva = foto(limite_top)
+            db.session.remove()
+        with self.lock:
+            delta = diferencias(self.foto, nueva)
+            self.foto, self.version = nueva, version
+            if not delta:
+                return
+            texto = _evento("delta", {"version": version, **delta})
+            for s in list(self.suscriptores):
+                s.enviar(texto)
+
+
+class Difusor:
+    """Canales por empresa y el hilo vigía que los revisa."""
+
+    def __init__(self):
+        self.canales = {}
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+        self._app = None
+
+    def suscribir(self, app, tenant) -> Suscriptor:
+        """Alta de un suscriptor; su primer evento es la foto actual (se calcula si hace falta)."""
+        with self._lock:
+            canal = self.canales.get(tenant)
+            if canal is None:
+                canal = self.canales[tenant] = Canal(tenant)
+            self._app = app
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._vigilar, name="stream", daemon=True)
+                self._hilo.start()
+        with canal.lock:
+            if not canal.suscriptores:
+                # sin suscriptores nadie la mantuvo al día: se rehace (una vez)
+                from .models import db
+                canal.firma = _firma_bd(db.engine.url)
+                canal.version = data_version(fresca=True)
+                canal.foto = foto(app.config.get("STREAM_TOP", 10))
+            sus = Suscriptor(canal)
+            sus.cola.put_nowait(canal.evento_foto())
+            canal.suscriptores.add(sus)
+        return sus
+
+    def desuscribir(self, sus: Suscriptor):
+        with sus.canal.lock:
+            sus.canal.suscriptores.discard(sus)
+
+    def avisar(self):
+        """Revisar ya (p. ej. la ingesta acaba de confirmar un lote)."""
+        self._despertar.set()
+
+    def cerrar(self):
+        """Termina todas las conexiones abiertas (al apagar un worker)."""
+        with self._lock:
+            canales = list(self.canales.values())
+        for canal in canales:
+            with canal.lock:
+                for s in canal.suscriptores:
+                    try:
+                        s.cola.put_nowait(_FIN)
+                    except queue.Full:
+                        s.cola.get_nowait()
+                        s.cola.put_nowait(_FIN)
+
+    def _vigilar(self):
+        while True:
+            intervalo = self._app.config.get("STREAM_INTERVALO_S", 0.5)
+            self._despertar.wait(intervalo)
+            self._despertar.clear()
+            with self._lock:
+                activos = [c for c in self.canales.values() if c.suscriptores]
+            for canal in activos:
+                try:
+                    canal.revisar(self._app, self._app.config.get("STREAM_TOP", 10))
+                except Exception:
+                    log.exception("stream: no se pudo revisar la empresa %r", canal.tenant)
+
+
+difusor = Difusor()
+
+
+def _nuevo_difusor():
+    """El hilo vigía no sobrevive a un fork (app/servidor.py): cada worker arma el suyo."""
+    global difusor
+    difusor = Difusor()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_nuevo_difusor)
+
+
+def avisar():
+    difusor.avisar()
+
+
+def cerrar():
+    difusor.cerrar()
+
+
+def eventos(sus: Suscriptor, latido: float):
+    """Generador del cuerpo text/event-stream de un suscriptor."""
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            texto = sus.siguiente(latido)
+            if texto is _FIN:
+                return
+            yield texto if texto is not None else ": latido\n\n"
+    finally:
+        difusor.desuscribir(sus)
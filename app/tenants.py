@@ -0,0 +1,189 @@
+# app/tenants.py
+"""
+Modo multi-empresa (MULTI_TENANT=1): cada empresa tiene su propio archivo
+SQLite en TENANT_DIR y cada request queda ligado al de su empresa.
+
+- La empresa sale del header TENANT_HEADER (X-Tenant) o del subdominio de
+  TENANT_DOMAIN (acme.insightpyme.com -> "acme").
+- `db.engine` y la sesión resuelven el engine de la empresa activa (una
+  ContextVar), así el resto del código no cambia. Todo lo que ya usa la url
+  del engine como clave (versión de datos, caché de KPIs) queda separado.
+- Los engines abiertos viven en una LRU acotada (TENANT_MAX_ENGINES); los que
+  no se usan hace más de TENANT_IDLE_SECONDS se cierran (dispose).
+
+    python -m app.etl --tenant acme --clientes ... --productos ... --ventas ...
+"""
+import contextvars
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from flask import current_app, g, jsonify, request
+from flask_sqlalchemy import SQLAlchemy
+
+_tenant = contextvars.ContextVar("tenant", default=None)
+
+NOMBRE_VALIDO = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+# endpoints /api/* que no dependen de una empresa
+SIN_EMPRESA = {"main.health", "main.api_metrics"}
+
+
+class TenantDesconocido(LookupError):
+    """La empresa no tiene base de datos (y no se pidió crearla)."""
+
+
+def actual() -> str | None:
+    """Empresa activa en este contexto (None = BD por defecto)."""
+    return _tenant.get()
+
+
+def ruta_bd(app, tenant: str) -> str:
+    return os.path.join(app.config["TENANT_DIR"], f"{tenant}.db")
+
+
+# ---------- Pool de engines por empresa ----------
+class PoolEngines:
+    """LRU de engines por empresa, acotada por cantidad y por inactividad."""
+
+    def __init__(self):
+        self._engines = OrderedDict()   # tenant -> (engine, último uso)
+        self._lock = threading.Lock()
+
+    def engine(self, app, tenant: str, crear: bool = False) -> sa.engine.Engine:
+        ahora = time.monotonic()
+        with self._lock:
+            item = self._engines.get(tenant)
+            if item is not None:
+                self._engines[tenant] = (item[0], ahora)
+                self._engines.move_to_end(tenant)
+                self._evictar(app, ahora)
+                return item[0]
+
+        engine = self._abrir(app, tenant, crear)
+        with self._lock:
+            if tenant in self._engines:          # otro hilo lo abrió primero
+                engine.dispose()
+                engine = self._engines[tenant][0]
+            self._engines[tenant] = (engine, ahora)
+            self._engines.move_to_end(tenant)
+            self._evictar(app, ahora)
+        return engine
+
+    def _evictar(self, app, ahora):
+        """Cierra los engines inactivos y los que sobran (los menos usados primero)."""
+        maximo = app.config.get("TENANT_MAX_ENGINES", 64)
+        inactivo = app.config.get("TENANT_IDLE_SECONDS", 300)
+        while self._engines:
+            tenant, (engine, uso) = next(iter(self._engines.items()))
+            if len(self._engines) <= maximo and ahora - uso < inactivo:
+                break
+            del self._engines[tenant]
+            # las conexiones prestadas siguen vivas hasta devolverse
+            engine.dispose()
+
+    @staticmethod
+    def _abrir(app, tenant, crear):
+        from .storage import opciones_engine, _aplicar_pragmas, asegurar_esquema
+
+        path = ruta_bd(app, tenant)
+        if not os.path.exists(path):
+            if not crear:
+                raise TenantDesconocido(tenant)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        url = "sqlite:///" + path
+        engine = sa.create_engine(url, **opciones_engine(url, app.config))
+        _aplicar_pragmas(engine, app.config.get("SQLITE_PRAGMAS", {}))
+        asegurar_esquema(engine)
+        return engine
+
+    def abiertos(self) -> list[str]:
+        with self._lock:
+            return list(self._engines)
+
+    def cerrar_todos(self):
+        with self._lock:
+            for engine, _ in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+
+
+pool = PoolEngines()
+
+
+class SQLAlchemyTenants(SQLAlchemy):
+    """SQLAlchemy de Flask cuyo engine por defecto es el de la empresa activa."""
+
+    @property
+    def engines(self):
+        tenant = _tenant.get()
+        if tenant is None:
+            return super().engines
+        app = current_app._get_current_object()
+        return {None: pool.engine(app, tenant)}
+
+
+@contextmanager
+def activar(tenant: str | None, crear: bool = False):
+    """Liga el contexto actual a `tenant` (crear=True crea su BD si no existe)."""
+    if tenant is not None:
+        if not NOMBRE_VALIDO.match(tenant):
+            raise ValueError(f"Nombre de empresa inválido: {tenant!r}")
+        pool.engine(current_app._get_current_object(), tenant, crear=crear)
+    token = _tenant.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _tenant.reset(token)
+
+
+# ---------- Resolución por request ----------
+def resolver() -> str | None:
+    """Empresa del request: header primero, luego subdominio."""
+    cfg = current_app.config
+    tenant = request.headers.get(cfg.get("TENANT_HEADER", "X-Tenant"), "").strip().lower()
+    if tenant:
+        return tenant
+    dominio = (cfg.get("TENANT_DOMAIN") or "").lower()
+    host = request.host.split(":")[0].lower()
+    if dominio and host.endswith("." + dominio):
+        return host[: -len(dominio) - 1].split(".")[-1]
+    return None
+
+
+def _antes():
+    g.tenant_token = None
+    tenant = resolver()
+    if tenant is None:
+        if request.path.startswith("/api/") and request.endpoint not in SIN_EMPRESA:
+            return jsonify({"error": "empresa no indicada"}), 400
+        return None
+    if not NOMBRE_VALIDO.match(tenant):
+        return jsonify({"error": "empresa inválida"}), 400
+    try:
+        pool.engine(current_app._get_current_object(), tenant)
+    except TenantDesconocido:
+        return jsonify({"error": "empresa desconocida"}), 404
+    g.tenant_token = _tenant.set(tenant)
+    return None
+
+
+def _despues(resp):
+    resp.vary.add(current_app.config.get("TENANT_HEADER", "X-Tenant"))
+    return resp
+
+
+def _al_terminar(_exc):
+    token = g.pop("tenant_token", None)
+    if token is not None:
+        _tenant.reset(token)
+
+
+def instalar(app):
+    """Registra la resolución de empresa en la app (antes que los hooks del blueprint)."""
+    app.before_request(_antes)
+    app.after_request(_despues)
+    app.teardown_request(_al_terminar)
@@ -0,0 +1,230 @@
+# bench/benchmark.py
+"""
+Benchmark de ETL y APIs.
+
+1. Carga los CSV de --datos con `python -m app.etl` sobre una BD nueva y mide
+   filas/s (tiempo total del proceso).
+2. Llama cada ruta /api/* con el test client de Flask (sin y con rango de los
+   últimos 30 días) y mide latencia p50/p95 y la de la primera llamada. La
+   caché de KPIs queda apagada (KPI_CACHE_SIZE=0): cada llamada mide la
+   consulta, no un acierto de caché.
+3. Escribe el resultado en JSON (--salida).
+
+Con --comparar BASE.json falla (código 1) si alguna métrica empeora más que
+--umbral respecto de la base; --contra NUEVO.json compara sin volver a correr.
+
+    python -m bench.generar_datos --salida /tmp/bench --ventas 1000000
+    python -m bench.benchmark --datos /tmp/bench --salida base.json
+    python -m bench.benchmark --datos /tmp/bench --comparar base.json --umbral 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# rutas que no tienen sentido medir en bucle (o sin un recurso real: un job que no existe da 404)
+EXCLUIDAS = {"/api/stream", "/api/metrics", "/api/jobs/<job_id>"}
+# rutas que aceptan desde/hasta: se miden también con los últimos 30 días
+CON_RANGO = {
+    "/api/kpis", "/api/top-productos", "/api/ventas", "/api/ventas-por-hora",
+    "/api/ventas-por-dia", "/api/heatmap-hora-dia", "/api/dashboard",
+}
+
+
+def _contar_filas(path):
+    with open(path, "rb") as f:
+        return max(sum(buf.count(b"\n") for buf in iter(lambda: f.read(1 << 20), b"")) - 1, 0)
+
+
+def medir_etl(datos, db_path, workers):
+    """Corre el ETL completo en un proceso aparte y devuelve sus tiempos."""
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    archivos = {k: os.path.join(datos, f"{k}.csv") for k in ("clientes", "productos", "ventas")}
+    cmd = [sys.executable, "-m", "app.etl", "--truncate", "true", "--workers", str(workers)]
+    for k, path in archivos.items():
+        cmd += [f"--{k}", path]
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + db_path)
+
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=RAIZ, env=env, capture_output=True, text=True)
+    seg = time.perf_counter() - t0
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stdout + proc.stderr)
+        raise SystemExit(f"El ETL falló (código {proc.returncode}).")
+
+    filas = _contar_filas(archivos["ventas"])
+    return {
+        "ventas": filas,
+        "segundos": round(seg, 3),
+        "filas_por_s": round(filas / seg, 1) if seg else 0.0,
+    }
+
+
+def _rutas_api(app):
+    """(método, url) de cada ruta /api/*; los parámetros de ruta se llenan con ids de ejemplo."""
+    from app.models import db, Producto, Cliente
+
+    with app.app_context():
+        ejemplo = {
+            "producto_id": db.session.query(db.func.min(Producto.id)).scalar() or 1,
+            "cliente_id": db.session.query(db.func.min(Cliente.id)).scalar() or 1,
+        }
+    rutas = []
+    for regla in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if not regla.rule.startswith("/api/") or regla.rule in EXCLUIDAS:
+            continue
+        try:
+            url = regla.build({a: ejemplo.get(a, 1) for a in regla.arguments})[1]
+        except Exception:
+            continue
+        if "GET" in regla.methods:
+            rutas.append(("GET", url, None))
+        elif regla.rule == "/api/demanda" and "POST" in regla.methods:
+            rutas.append(("POST", url, {"producto_id": ejemplo["producto_id"], "dias_futuro": 30}))
+    return rutas
+
+
+def _rango_30_dias(app):
+    from app.models import db, Venta
+
+    with app.app_context():
+        fin = db.session.query(db.func.max(Venta.fecha)).scalar()
+    if fin is None:
+        return None
+    return (fin - timedelta(days=29)).date().isoformat(), fin.date().isoformat()
+
+
+def medir_api(db_path, repeticiones):
+    """Latencias por ruta con el test client de Flask (cada llamada ejecuta la vista completa)."""
+    os.environ["DATABASE_URL"] = "sqlite:///" + db_path
+    os.environ["KPI_CACHE_SIZE"] = "0"      # si no, desde la 2.ª llamada se mide la caché de KPIs
+    sys.path.insert(0, RAIZ)
+    from app import create_app
+
+    app = create_app()
+    cliente = app.test_client()
+    rango = _rango_30_dias(app)
+
+    resultados = {}
+    for metodo, url, cuerpo in _rutas_api(app):
+        variantes = [url]
+        if rango and metodo == "GET" and url in CON_RANGO:
+            sep = "&" if "?" in url else "?"
+            variantes.append(f"{url}{sep}desde={rango[0]}&hasta={rango[1]}")
+        for u in variantes:
+            tiempos = []
+            estado = None
+            for _ in range(repeticiones):
+                t0 = time.perf_counter()
+                resp = cliente.open(u, method=metodo, json=cuerpo)
+                resp.get_data()          # consume respuestas en streaming
+                tiempos.append((time.perf_counter() - t0) * 1000.0)
+                estado = resp.status_code
+            ms = np.array(tiempos)
+            nombre = f"{metodo} {url}" + (" [30 días]" if u != url else "")
+            resultados[nombre] = {
+                "estado": estado,
+                "primera_ms": round(float(ms[0]), 3),
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(ms, 95)), 3),
+                "n": len(ms),
+            }
+    return resultados
+
+
+def comparar(base, nuevo, umbral, min_ms):
+    """
+    Lista de regresiones [(métrica, base, nuevo)]: latencias (primera llamada,
+    p50, p95) que suben más del umbral (y al menos min_ms) o throughput del
+    ETL que baja más del umbral.
+    """
+    regresiones = []
+    b_etl, n_etl = base.get("etl"), nuevo.get("etl")
+    if b_etl and n_etl and n_etl["filas_por_s"] < b_etl["filas_por_s"] * (1 - umbral):
+        regresiones.append(("etl filas_por_s", b_etl["filas_por_s"], n_etl["filas_por_s"]))
+
+    for ruta, b in base.get("api", {}).items():
+        n = nuevo.get("api", {}).get(ruta)
+        if n is None:
+            continue
+        for m in ("primera_ms", "p50_ms", "p95_ms"):
+            if n[m] > b[m] * (1 + umbral) and n[m] - b[m] >= min_ms:
+                regresiones.append((f"{ruta} {m}", b[m], n[m]))
+    return regresiones
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de ETL y APIs")
+    parser.add_argument("--datos", help="directorio con clientes.csv, productos.csv y ventas.csv")
+    parser.add_argument("--db", help="BD SQLite a usar (se recrea); por defecto, un temporal")
+    parser.add_argument("--workers", type=int, default=1, help="--workers del ETL")
+    parser.add_argument("--repeticiones", type=int, default=30, help="llamadas por ruta")
+    parser.add_argument("--sin-etl", action="store_true", help="usa la BD de --db tal cual")
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    parser.add_argument("--comparar", help="JSON base contra el que comparar")
+    parser.add_argument("--contra", help="JSON nuevo (no corre el benchmark)")
+    parser.add_argument("--umbral", type=float, default=0.2, help="empeoramiento tolerado (0.2 = 20%%)")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="diferencia mínima de latencia a considerar")
+    args = parser.parse_args()
+
+    if args.contra:
+        with open(args.contra, encoding="utf-8") as f:
+            res = json.load(f)
+    else:
+        if not args.sin_etl and not args.datos:
+            parser.error("--datos es obligatorio salvo con --sin-etl o --contra")
+        if args.sin_etl and not args.db:
+            parser.error("--sin-etl necesita --db")
+        db_path = os.path.abspath(args.db or os.path.join(tempfile.mkdtemp(prefix="bench_"), "bench.db"))
+        res = {"meta": {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "maquina": platform.machine(),
+            "repeticiones": args.repeticiones,
+            "kpi_cache_size": 0,
+        }}
+        if not args.sin_etl:
+            res["etl"] = medir_etl(args.datos, db_path, args.workers)
+            print(f"ETL: {res['etl']['ventas']} ventas en {res['etl']['segundos']}s "
+                  f"-> {res['etl']['filas_por_s']:,.0f} filas/s")
+        res["api"] = medir_api(db_path, args.repeticiones)
+        for ruta, r in res["api"].items():
+            print(f"  {ruta:<70} {r['estado']}  p50 {r['p50_ms']:8.2f} ms  p95 {r['p95_ms']:8.2f} ms")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2, ensure_ascii=False)
+        print("Resultados en", args.salida)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        regresiones = comparar(base, res, args.umbral, args.min_ms)
+        for metrica, b, n in regresiones:
+            print(f"REGRESIÓN {metrica}: {b} -> {n}")
+        if regresiones:
+            raise SystemExit(1)
+        print(f"Sin regresiones respecto de {args.comparar} (umbral {args.umbral:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# bench/generar_datos.py
+"""
+Genera clientes.csv / productos.csv / ventas.csv sintéticos a escala.
+
+Las ventas siguen patrones de un comercio real:
+  - hora del día con picos al mediodía y a la tarde, casi nada de madrugada;
+  - día de la semana (sábado fuerte, domingo flojo);
+  - estacionalidad mensual (diciembre y noviembre altos, enero-febrero bajos);
+  - popularidad de productos y clientes tipo Zipf (pocos concentran mucho).
+
+Se escribe por bloques con numpy/pandas, en memoria constante, y las ventas
+salen ordenadas por fecha (como el log de un POS).
+
+    python -m bench.generar_datos --salida /tmp/bench --productos 10000 --ventas 1000000
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+PESO_HORA = np.array([
+    0.2, 0.1, 0.1, 0.1, 0.1, 0.3, 0.8, 1.5, 2.5, 3.5, 4.5, 5.5,
+    7.0, 6.5, 5.0, 4.5, 4.8, 5.5, 6.5, 6.0, 4.5, 3.0, 1.5, 0.6,
+])
+PESO_DIA_SEMANA = np.array([0.9, 0.9, 0.95, 1.0, 1.2, 1.4, 0.65])   # lunes..domingo
+PESO_MES = np.array([0.75, 0.8, 0.95, 0.95, 1.0, 0.95, 1.0, 1.0, 0.95, 1.0, 1.3, 1.6])
+
+
+def _zipf(n, s, rng):
+    """Pesos de popularidad tipo Zipf, en orden aleatorio de ids."""
+    pesos = 1.0 / np.arange(1, n + 1) ** s
+    rng.shuffle(pesos)
+    return pesos / pesos.sum()
+
+
+def generar_clientes(path, n):
+    ids = np.arange(1, n + 1)
+    pd.DataFrame({
+        "id": ids,
+        "nombre": [f"Cliente {i}" for i in ids],
+        "correo": [f"cliente{i}@ejemplo.com" for i in ids],
+    }).to_csv(path, index=False)
+
+
+def generar_productos(path, n, rng):
+    ids = np.arange(1, n + 1)
+    precios = np.round(rng.lognormal(mean=3.0, sigma=0.9, size=n), 2) + 0.5
+    pd.DataFrame({
+        "id": ids,
+        "nombre": [f"Producto {i}" for i in ids],
+        "precio": precios,
+    }).to_csv(path, index=False)
+    return precios
+
+
+def ventas_por_dia(n_ventas, desde, hasta, rng):
+    """Reparte n_ventas entre los días del rango según día de la semana y mes."""
+    dias = np.arange(np.datetime64(desde, "D"), np.datetime64(hasta, "D") + 1)
+    dia_semana = (dias.astype(np.int64) + 3) % 7
+    mes = dias.astype("datetime64[M]").astype(np.int64) % 12
+    pesos = PESO_DIA_SEMANA[dia_semana] * PESO_MES[mes] * rng.uniform(0.85, 1.15, len(dias))
+    return dias, rng.multinomial(n_ventas, pesos / pesos.sum())
+
+
+def generar_ventas(path, n_ventas, n_clientes, precios, desde, hasta, rng, lote=1_000_000):
+    dias, por_dia = ventas_por_dia(n_ventas, desde, hasta, rng)
+    p_hora = PESO_HORA / PESO_HORA.sum()
+    p_producto = _zipf(len(precios), 1.05, rng)
+    p_cliente = _zipf(n_clientes, 0.8, rng)
+
+    siguiente_id = 1
+    escritas = 0
+    inicio_dia = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("id,fecha,cliente_id,producto_id,cantidad,total\n")
+        while inicio_dia < len(dias):
+            # bloque de días que suma ~`lote` ventas
+            acumulado = np.cumsum(por_dia[inicio_dia:])
+            fin_dia = inicio_dia + int(np.searchsorted(acumulado, lote, "right")) + 1
+            fin_dia = min(fin_dia, len(dias))
+            cuantos = por_dia[inicio_dia:fin_dia]
+            n = int(cuantos.sum())
+            if n:
+                dia = np.repeat(dias[inicio_dia:fin_dia], cuantos).astype("datetime64[s]")
+                segundos = rng.choice(24, n, p=p_hora) * 3600 + rng.integers(0, 60, n) * 60
+                fecha = dia + segundos.astype("timedelta64[s]")
+                fecha.sort()
+                producto = rng.choice(len(precios), n, p=p_producto)
+                cantidad = rng.geometric(0.55, n)
+                total = np.round(precios[producto] * cantidad, 2)
+                pd.DataFrame({
+                    "id": np.arange(siguiente_id, siguiente_id + n),
+                    "fecha": np.datetime_as_string(fecha, unit="s"),
+                    "cliente_id": rng.choice(n_clientes, n, p=p_cliente) + 1,
+                    "producto_id": producto + 1,
+                    "cantidad": cantidad,
+                    "total": total,
+                }).to_csv(f, index=False, header=False)
+                siguiente_id += n
+                escritas += n
+            inicio_dia = fin_dia
+    return escritas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera CSV sintéticos para pruebas de rendimiento")
+    parser.add_argument("--salida", required=True, help="directorio destino")
+    parser.add_argument("--clientes", type=int, default=20_000)
+    parser.add_argument("--productos", type=int, default=10_000)
+    parser.add_argument("--ventas", type=int, default=1_000_000)
+    parser.add_argument("--desde", default="2023-01-01")
+    parser.add_argument("--hasta", default="2024-12-31")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--lote", type=int, default=1_000_000, help="ventas por bloque escrito")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.semilla)
+    os.makedirs(args.salida, exist_ok=True)
+    t0 = time.perf_counter()
+    generar_clientes(os.path.join(args.salida, "clientes.csv"), args.clientes)
+    precios = generar_productos(os.path.join(args.salida, "productos.csv"), args.productos, rng)
+    n = generar_ventas(os.path.join(args.salida, "ventas.csv"), args.ventas, args.clientes,
+                       precios, args.desde, args.hasta, rng, args.lote)
+    print(f"{args.clientes} clientes, {args.productos} productos, {n} ventas "
+          f"en {time.perf_counter() - t0:.1f}s -> {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# bench/verificar_derivados.py
+"""
+Verificación de regresión: sketches y segmentación con ventas por debajo de
+su marca de agua (id <= último id procesado).
+
+Carga un conjunto chico con el ETL sobre una BD nueva, calcula sketches y
+segmentación, y después:
+  - fuera de orden (POST /api/ventas/batch): una venta nueva con id mayor a
+    la marca, se refresca, y otra nueva con id menor (dos terminales que
+    envían desordenado);
+  - actualización (POST): una venta existente que cambia de día, de cliente
+    y de total;
+  - CSV con ids no monótonos (ETL): ventas que faltaron en la primera carga,
+    con ids por debajo de la marca.
+Tras cada caso, `sketches.listos()` tiene que dar False, y el refresco
+incremental tiene que dejar lo mismo que uno completo (sketches_dia y
+segmentos_clientes), con los KPIs approx=1 iguales a los exactos; la serie
+exacta (/api/serie) cuenta la venta ya antes de refrescar.
+Código de salida 1 si algo no coincide.
+
+    python -m bench.verificar_derivados [--ventas 20000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from bench import generar_datos
+
+
+def _foto_sketches():
+    from app.models import db, SketchDia
+    cols = SketchDia.__table__.columns
+    return sorted(tuple(getattr(s, c.name) for c in cols) for s in db.session.query(SketchDia))
+
+
+def _foto_segmentos():
+    from app.models import db, SegmentoCliente
+    return {s.cliente_id: (s.ultima_compra, s.frecuencia, round(s.monto, 2), s.segmento)
+            for s in db.session.query(SegmentoCliente)}
+
+
+def _comparar(nombre, dia):
+    """Refresco incremental vs completo; devuelve la lista de fallas."""
+    from app import segmentacion, sketches
+    from app.analytics import AnalyticsEngine
+
+    fallas = []
+    fecha = dia.isoformat()
+    if sketches.listos():
+        fallas.append("sketches.listos() da True con ventas sin procesar")
+    # la serie exacta no depende de los sketches: ya cuenta la venta antes de refrescarlos
+    serie = AnalyticsEngine.get_serie("dia", "total", 1, fecha, fecha)["valores"]
+    exacto = AnalyticsEngine.get_kpis(fecha, fecha)
+    if serie != [exacto["ventas_mes"]]:
+        fallas.append(f"/api/serie de {fecha}: {serie} != exacto {exacto['ventas_mes']}")
+    res = sketches.refrescar()
+    seg = segmentacion.segmentar()
+    incremental = _foto_sketches(), _foto_segmentos()
+    if not sketches.listos():
+        fallas.append("sketches.listos() da False después de refrescar")
+    aprox = AnalyticsEngine.get_kpis(fecha, fecha, approx=True)
+    if aprox["aprox"] is None or aprox["ventas_mes"] != exacto["ventas_mes"]:
+        fallas.append(f"KPIs de {fecha}: approx {aprox['ventas_mes']} (aprox={aprox['aprox'] is not None}) "
+                      f"!= exacto {exacto['ventas_mes']}")
+
+    sketches.refrescar(completo=True)
+    segmentacion.segmentar(completo=True)
+    if incremental[0] != _foto_sketches():
+        fallas.append("sketches_dia incremental != completo")
+    completos = _foto_segmentos()
+    distintos = [c for c in completos if incremental[1].get(c) != completos[c]]
+    if distintos:
+        c = distintos[0]
+        fallas.append(f"{len(distintos)} clientes con segmentación distinta, p. ej. {c}: "
+                      f"{incremental[1].get(c)} != {completos[c]}")
+    print(f"{nombre}: sketches {res['modo']} ({res['dias']} días), {seg['recalculados']} clientes "
+          f"recalculados, {len(fallas)} fallas")
+    for f in fallas:
+        print("  " + f)
+    return fallas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regresión: ventas por debajo de la marca de agua")
+    parser.add_argument("--ventas", type=int, default=20_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rng = np.random.default_rng(7)
+        rutas = {k: os.path.join(tmp, f"{k}.csv") for k in ("clientes", "productos", "ventas")}
+        generar_datos.generar_clientes(rutas["clientes"], 300)
+        precios = generar_datos.generar_productos(rutas["productos"], 100, rng)
+        generar_datos.generar_ventas(rutas["ventas"], args.ventas, 300, precios, "2024-01-01", "2024-03-31", rng)
+        # ids 5001..5020 llegan en un segundo CSV, después de calcular todo
+        with open(rutas["ventas"], encoding="utf-8") as f:
+            encabezado, *lineas = f.readlines()
+        rutas["tarde"] = os.path.join(tmp, "ventas_tarde.csv")
+        for ruta, tarde in ((rutas["ventas"], False), (rutas["tarde"], True)):
+            with open(ruta, "w", encoding="utf-8") as f:
+                f.writelines([encabezado] + [l for l in lineas if (5000 < int(l.split(",", 1)[0]) <= 5020) == tarde])
+
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tmp, "derivados.db")
+        from app import create_app, particiones, segmentacion, sketches
+        from app.etl import cargar_clientes, cargar_productos, cargar_ventas
+        from app.models import db, Venta
+
+        app = create_app()
+        cliente = app.test_client()
+
+        def enviar(**venta):
+            venta.setdefault("cliente_id", 8)
+            venta.setdefault("producto_id", 1)
+            venta.setdefault("cantidad", 1)
+            venta["fecha"] = venta["fecha"].isoformat()
+            r = cliente.post("/api/ventas/batch?esperar=1", json=[venta])
+            assert r.status_code == 201, r.get_json()
+
+        with app.app_context():
+            for cargar, ruta in ((cargar_clientes, rutas["clientes"]), (cargar_productos, rutas["productos"]),
+                                 (cargar_ventas, rutas["ventas"])):
+                cargar(ruta, incremental=False)
+            sketches.refrescar(completo=True)
+            segmentacion.segmentar(completo=True)
+            marca = particiones.max_id()
+            fallas = []
+
+            # fuera de orden: llega antes la venta de id mayor
+            dia = datetime(2024, 3, 6, 12)
+            enviar(id=marca + 1000, fecha=dia, total=120.0)
+            sketches.refrescar()
+            segmentacion.segmentar()
+            enviar(id=marca + 500, fecha=dia.replace(hour=15), total=200.0)
+            fallas += _comparar("fuera de orden", dia.date())
+
+            # actualización: una venta vieja cambia de día, de cliente y de total
+            venta = db.session.get(Venta, 100)
+            nueva = venta.fecha + timedelta(days=10)
+            enviar(id=100, cliente_id=venta.cliente_id % 300 + 1, producto_id=venta.producto_id, fecha=nueva,
+                   total=(venta.total or 0.0) + 500)
+            db.session.expire_all()
+            fallas += _comparar("actualización", nueva.date())
+
+            # CSV con ids por debajo de la marca
+            cargar_ventas(rutas["tarde"], incremental=False)
+            tarde = db.session.get(Venta, 5010).fecha
+            fallas += _comparar("CSV no monótono", tarde.date())
+            db.session.remove()
+            db.engine.dispose()
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
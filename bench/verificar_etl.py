@@ -0,0 +1,71 @@
+# bench/verificar_etl.py
+"""
+Verificación de regresión del ETL: campos entre comillas con saltos de línea.
+
+Genera un productos.csv cuyos nombres llevan un '\n' entre comillas, lo
+carga con `cargar_productos` (lotes chicos, así hay muchos cortes de rango)
+sobre una BD nueva, secuencial y con --workers, y compara cada fila con lo
+que lee `csv.DictReader`. Código de salida 1 si algo no coincide.
+
+    python -m bench.verificar_etl [--productos 20000] [--chunk-size 1000]
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+
+
+def generar(path, n):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["id", "nombre", "precio"])
+        for i in range(1, n + 1):
+            nombre = f'Producto {i}\nlínea 2, "{i % 7}"' if i % 3 else f"Producto {i}"
+            w.writerow([i, nombre, round(1 + i % 97 * 0.5, 2)])
+
+
+def cargar(path, db_path, chunk_size, workers):
+    """Carga `path` en una BD nueva y devuelve ({id: (nombre, precio)}, errores)."""
+    os.environ["DATABASE_URL"] = "sqlite:///" + db_path
+    from app import create_app
+    from app.etl import cargar_productos
+    from app.models import db, Producto
+
+    app = create_app()
+    with app.app_context():
+        stats = cargar_productos(path, chunk_size=chunk_size, workers=workers, incremental=False)
+        filas = {p.id: (p.nombre, p.precio) for p in db.session.query(Producto)}
+        db.session.remove()
+        db.engine.dispose()
+    return filas, stats["errores"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regresión: saltos de línea entre comillas en el ETL")
+    parser.add_argument("--productos", type=int, default=20_000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "productos.csv")
+        generar(path, args.productos)
+        with open(path, encoding="utf-8", newline="") as f:
+            esperado = {int(r["id"]): (r["nombre"], float(r["precio"])) for r in csv.DictReader(f)}
+
+        fallas = 0
+        for workers in sorted({1, args.workers}):
+            filas, errores = cargar(path, os.path.join(tmp, f"w{workers}.db"), args.chunk_size, workers)
+            distintas = [i for i in esperado if filas.get(i) != esperado[i]]
+            print(f"workers={workers}: {len(filas)} filas, {len(distintas)} distintas, {len(errores)} errores")
+            for i in distintas[:5]:
+                print(f"  id {i}: {filas.get(i)!r} != {esperado[i]!r}")
+            for linea, motivo in errores[:5]:
+                print(f"  línea {linea}: {motivo}")
+            fallas += len(distintas) + len(errores) + abs(len(filas) - len(esperado))
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 # run.py  (en la carpeta raíz)
+# Servidor de desarrollo; en producción: python -m app.servidor
 from app import create_app
 
 app = create_app()